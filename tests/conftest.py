@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Every test runs in a scratch directory: the bot reads .token, writes its log and keeps its config
+files relative to the working directory or to CONFIG_PERSIST_PARTITION, all read on import.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+WORK_DIR: str = tempfile.mkdtemp(prefix="tgbot-tests-")
+os.environ["CONFIG_PERSIST_PARTITION"] = WORK_DIR
+os.environ["TGBOT_LOG_FILE"] = f"{WORK_DIR}/bot.log"
+
+from tgbot_python_v2.util import config
+from tgbot_python_v2.util.logging import log_handlers
+
+
+def pytest_sessionstart(session: pytest.Session) -> None:
+    # After pytest found the tests, before they are imported
+    os.chdir(WORK_DIR)
+    Path(".token").write_text("123456:test-token")
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    # The console handler still writes to pytest's capture, which is closed before configs are
+    # written at exit
+    for handler in log_handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(sys.__stderr__)
+            handler.setLevel(logging.WARNING)
+
+
+@pytest.fixture
+def config_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Config files of a test go to its own directory, and are closed after the test."""
+    monkeypatch.setattr(config, "CONFIG_FILE_PATH_PREFIX", str(tmp_path))
+    opened: list[config.Config] = list(config.Config.instances)
+    yield tmp_path
+    for instance in list(config.Config.instances):
+        if instance not in opened:
+            instance.close()
@@ -0,0 +1,225 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from tgbot_python_v2.util import config as config_module
+from tgbot_python_v2.util.config import Config
+
+# Counts up with transactions that await in between reading and writing, like a bot worker
+COUNTER: str = """
+import asyncio, sys
+from tgbot_python_v2.util.config import Config
+
+async def main():
+    config = Config("counter.json")
+    for _ in range(int(sys.argv[1])):
+        async with config.transaction("count") as data:
+            count = data.get("count", 0)
+            await asyncio.sleep(0.001)
+            data["count"] = count + 1
+
+asyncio.run(main())
+"""
+
+
+def on_disk(config_dir: Path, name: str) -> dict:
+    return json.loads((config_dir / name).read_text())
+
+
+def slow_writes(config: Config) -> threading.Event:
+    """Writes of config take a while after the file was replaced, returns an event set then."""
+    written: threading.Event = threading.Event()
+    write_file = config._write_file
+
+    def write_slowly(seq: int, snapshot: str) -> tuple | None:
+        signature: tuple | None = write_file(seq, snapshot)
+        written.set()
+        time.sleep(0.05)
+        return signature
+
+    config._write_file = write_slowly
+    return written
+
+
+def test_read_during_flush_keeps_new_changes(config_dir: Path) -> None:
+    async def run() -> None:
+        config: Config = Config("race.json", lazy=False)
+        written: threading.Event = slow_writes(config)
+        config.config["a"] = 1
+        flush: asyncio.Task = asyncio.create_task(config.flush())
+        await asyncio.to_thread(written.wait)
+
+        config.config["b"] = 2
+        config.read_config()
+        await flush
+        assert config.config == {"a": 1, "b": 2}
+        await config.flush()
+
+    asyncio.run(run())
+    assert on_disk(config_dir, "race.json") == {"a": 1, "b": 2}
+
+
+def test_read_keeps_pending_delayed_write(config_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config_module, "CONFIG_WRITE_DELAY", 0.05)
+
+    async def run() -> None:
+        config: Config = Config("delayed.json", lazy=False)
+        config.config["a"] = 1
+        config.write_config()
+        # Another process replaces the file before the delayed write happened
+        (config_dir / "delayed.json").write_text('{"other": true}')
+        config.read_config()
+        assert config.config == {"a": 1}
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert on_disk(config_dir, "delayed.json") == {"a": 1}
+
+
+def test_read_picks_up_changes_of_others(config_dir: Path) -> None:
+    config: Config = Config("shared.json", lazy=False)
+    config.config["a"] = 1
+    config.write_config()
+    config.read_config()
+    assert config.reads_avoided == 1
+
+    (config_dir / "shared.json").write_text('{"a": 2}')
+    config.read_config()
+    assert config.config == {"a": 2}
+
+
+def test_defaults_are_not_written(config_dir: Path) -> None:
+    config: Config = Config("defaults.json", defaults={"words": ["a"]})
+    assert config.config["words"] == ["a"]
+    config.write_config()
+    assert on_disk(config_dir, "defaults.json") == {}
+
+    config.config["words"].append("b")
+    config.write_config()
+    assert on_disk(config_dir, "defaults.json") == {"words": ["a", "b"]}
+
+
+def test_stored_values_are_copied(config_dir: Path) -> None:
+    config: Config = Config("copied.json", lazy=False)
+    words: list[str] = []
+    config.config["words"] = words
+    words.append("a")
+    assert config.config["words"] == []
+
+    config.config["words"].append("b")
+    config.write_config()
+    assert on_disk(config_dir, "copied.json") == {"words": ["b"]}
+
+
+def test_refresh_applies_unsaved_changes_on_top(config_dir: Path) -> None:
+    config: Config = Config("merged.json", lazy=False)
+    config.config["a"] = {"x": 1}
+    config.config["gone"] = 1
+    config.write_config()
+
+    config.config["a"]["y"] = 2
+    del config.config["gone"]
+    # Another process writes meanwhile
+    (config_dir / "merged.json").write_text('{"a": {"x": 5}, "gone": 1, "b": 3}')
+    config.refresh()
+    assert config.config == {"a": {"x": 5, "y": 2}, "b": 3}
+
+    config.write_config()
+    assert on_disk(config_dir, "merged.json") == {"a": {"x": 5, "y": 2}, "b": 3}
+
+
+def test_transactions_across_processes(config_dir: Path, tmp_path: Path) -> None:
+    script: Path = tmp_path / "counter.py"
+    script.write_text(COUNTER)
+    env: dict[str, str] = {
+        **os.environ,
+        "PYTHONPATH": str(Path(__file__).parent.parent),
+        "CONFIG_PERSIST_PARTITION": str(config_dir),
+        "TGBOT_WORKERS": "2",
+    }
+    workers: list[subprocess.Popen] = [subprocess.Popen([sys.executable, str(script), "50"], env=env) for _ in range(2)]
+    assert [worker.wait(60) for worker in workers] == [0, 0]
+    assert on_disk(config_dir, "counter.json") == {"count": 100}
+
+
+def test_load_configs_reads_lazy_configs_in_a_thread(config_dir: Path) -> None:
+    (config_dir / "preloaded.json").write_text('{"a": 1}')
+    config: Config = Config("preloaded.json", lazy=True)
+    assert not config.loaded
+    on_event_loop: list[bool] = []
+    load = config._load
+
+    def record_load() -> None:
+        on_event_loop.append(threading.current_thread() is threading.main_thread())
+        load()
+
+    config._load = record_load
+    asyncio.run(config_module.load_configs())
+    assert config.loaded
+    assert config.config == {"a": 1}
+    assert on_event_loop == [False]
+
+
+def test_transaction_keeps_changes_made_before_an_exception(config_dir: Path) -> None:
+    async def run() -> Config:
+        config: Config = Config("failed.json", lazy=False)
+        with pytest.raises(RuntimeError):
+            async with config.transaction("a") as data:
+                data["a"] = 1
+                raise RuntimeError("handler failed")
+
+        # The key is free again
+        async with config.transaction("a") as data:
+            data["b"] = 2
+        return config
+
+    config: Config = asyncio.run(run())
+    assert on_disk(config_dir, "failed.json") == {"a": 1, "b": 2}
+    assert config.key_locks == {}
+    assert config.key_lock_users == {}
+
+
+def test_transactions_on_a_key_take_turns(config_dir: Path) -> None:
+    async def run() -> list[str]:
+        config: Config = Config("turns.json", lazy=False)
+        events: list[str] = []
+
+        async def increment(key: str, name: str) -> None:
+            async with config.transaction(key) as data:
+                events.append(f"{name} start")
+                count: int = data.get(key, 0)
+                await asyncio.sleep(0.01)
+                data[key] = count + 1
+                events.append(f"{name} end")
+
+        await asyncio.gather(increment("a", "first"), increment("a", "second"), increment("b", "other"))
+        assert config.config == {"a": 2, "b": 1}
+        return events
+
+    events: list[str] = asyncio.run(run())
+    assert events.index("first end") < events.index("second start")
+    # Another key does not wait
+    assert events.index("other start") < events.index("first end")
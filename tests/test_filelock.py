@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+import pytest
+
+from tgbot_python_v2.util import filelock
+from tgbot_python_v2.util.filelock import FileLock
+
+# Takes the lock in another process and holds it for the given number of seconds
+HOLDER: str = """
+import sys, time
+from pathlib import Path
+from tgbot_python_v2.util.filelock import FileLock
+
+path, mode, seconds = sys.argv[1:]
+lock = FileLock(path)
+with lock.exclusive() if mode == "exclusive" else lock.shared():
+    Path(f"{path}.held").touch()
+    time.sleep(float(seconds))
+"""
+Hold = Callable[[Path, str, float], subprocess.Popen]
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def hold(request: pytest.FixtureRequest, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Hold]:
+    """Returns a function starting a process that holds the lock, once it holds it."""
+    monkeypatch.setattr(filelock, "LOCK_INOTIFY", request.param)
+    script: Path = tmp_path / "holder.py"
+    script.write_text(HOLDER)
+    env: dict[str, str] = {**os.environ, "PYTHONPATH": str(Path(__file__).parent.parent)}
+    holders: list[subprocess.Popen] = []
+
+    def start(path: Path, mode: str, seconds: float) -> subprocess.Popen:
+        holder: subprocess.Popen = subprocess.Popen(
+            [sys.executable, str(script), str(path), mode, str(seconds)], env=env
+        )
+        holders.append(holder)
+        deadline: float = time.monotonic() + 30
+        while not Path(f"{path}.held").exists():
+            assert holder.poll() is None and time.monotonic() < deadline
+            time.sleep(0.01)
+        return holder
+
+    yield start
+    for holder in holders:
+        holder.kill()
+        holder.wait()
+
+
+def test_exclusive_lock_waits_for_the_other_process(tmp_path: Path, hold: Hold) -> None:
+    path: Path = tmp_path / "config.lock"
+    holder: subprocess.Popen = hold(path, "exclusive", 0.5)
+
+    start: float = time.monotonic()
+    with FileLock(str(path)).exclusive(timeout=30) as locked:
+        waited: float = time.monotonic() - start
+        assert locked
+        assert holder.wait(30) == 0
+        assert path.read_text() == str(os.getpid())
+    assert waited > 0.2
+
+
+def test_shared_locks_do_not_wait_for_each_other(tmp_path: Path, hold: Hold) -> None:
+    path: Path = tmp_path / "config.lock"
+    hold(path, "shared", 30)
+
+    with FileLock(str(path)).shared(timeout=0) as locked:
+        assert locked
+    with FileLock(str(path)).exclusive(timeout=0.1) as locked:
+        assert not locked
+
+
+def test_timeout_names_the_holder(tmp_path: Path, hold: Hold, caplog: pytest.LogCaptureFixture) -> None:
+    path: Path = tmp_path / "config.lock"
+    holder: subprocess.Popen = hold(path, "exclusive", 30)
+
+    start: float = time.monotonic()
+    with caplog.at_level(logging.WARNING), FileLock(str(path)).shared(timeout=0.3) as locked:
+        assert not locked
+    assert 0.3 <= time.monotonic() - start < 10
+    assert f"still locked by pid {holder.pid}" in caplog.text
+
+
+def test_lock_of_a_killed_process_is_released(tmp_path: Path, hold: Hold) -> None:
+    path: Path = tmp_path / "config.lock"
+    holder: subprocess.Popen = hold(path, "exclusive", 30)
+
+    holder.send_signal(signal.SIGKILL)
+    with FileLock(str(path)).exclusive(timeout=30) as locked:
+        assert locked
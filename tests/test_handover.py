@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from telegram.ext import Application, ApplicationBuilder
+
+from tgbot_python_v2.util import config, handover, serving
+from tgbot_python_v2.util.webhook import WebhookServer
+
+# Stands in for the bot: the first successor records what it was handed and hands over to a
+# successor of its own, which records what it was handed in turn
+SUCCESSOR: str = """
+import asyncio, json, os, sys
+from tgbot_python_v2.util import handover
+
+async def main():
+    handed_over = await handover.wait_for_predecessor()
+    generation = os.environ.get("GENERATION", "1")
+    with open(os.path.join(sys.argv[1], f"handed-over-{generation}"), "w") as record:
+        json.dump(handed_over, record)
+    if generation == "1":
+        successor = await handover.start_successor({"GENERATION": "2"})
+        await successor.release(handed_over[0] + 10, [handed_over[0] + 10])
+
+asyncio.run(main())
+"""
+
+
+@pytest.fixture
+def app() -> Application:
+    return ApplicationBuilder().token("123456:test-token").build()
+
+
+def test_stopping_polling_again_after_handover(app: Application) -> None:
+    # The updater is not running anymore once the intake was released to a successor
+    asyncio.run(serving._stop_polling(app))
+
+
+def test_webhook_successor_skips_what_the_predecessor_received(
+    app: Application, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def wait_for_predecessor() -> tuple[int, list[int]]:
+        return 7, [5, 7]
+
+    server: WebhookServer = WebhookServer(app, port=0)
+    monkeypatch.setattr(handover, "IS_SUCCESSOR", True)
+    monkeypatch.setattr(handover, "wait_for_predecessor", wait_for_predecessor)
+    monkeypatch.setattr(serving, "webhook_server", server)
+    started: list[bool] = []
+
+    async def start_intake() -> None:
+        started.append(True)
+
+    asyncio.run(serving._after_predecessor(app, start_intake)())
+    assert started == [True]
+    assert server.last_update_id == 7
+    assert list(server.seen) == [5, 7]
+
+
+def test_successor_hands_over_to_its_own_successor(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    script: Path = tmp_path / "bot.py"
+    script.write_text(SUCCESSOR)
+    monkeypatch.setattr(sys, "argv", [str(script), str(tmp_path)])
+    monkeypatch.setenv("PYTHONPATH", str(Path(__file__).parent.parent))
+    # Starting a successor shares the config files until it is done
+    monkeypatch.setattr(config, "CONFIG_SHARED", config.CONFIG_SHARED)
+    monkeypatch.setattr(handover, "successor", None)
+
+    async def run() -> None:
+        successor: handover.Successor | None = await handover.start_successor()
+        assert successor is not None
+        await successor.release(7, [5, 7])
+        successor.writer.close()
+        assert await asyncio.wait_for(successor.process.wait(), 30) == 0
+
+    asyncio.run(run())
+    deadline: float = time.monotonic() + 30
+    while not (tmp_path / "handed-over-2").exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert json.loads((tmp_path / "handed-over-1").read_text()) == [7, [5, 7]]
+    assert json.loads((tmp_path / "handed-over-2").read_text()) == [17, [17]]
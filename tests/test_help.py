@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import pytest
+from telegram.constants import MessageLimit
+
+from tgbot_python_v2.util import help as help_module
+from tgbot_python_v2.util.help import Help
+
+
+@pytest.fixture(autouse=True)
+def empty_help(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Modules imported by other tests registered their help already."""
+    monkeypatch.setattr(Help, "help_messages", {})
+    monkeypatch.setattr(Help, "help_owners", {})
+    monkeypatch.setattr(Help, "rendered", None)
+    monkeypatch.setattr(Help, "cmd_update_pending", False)
+
+
+def register(count: int, text: str = "Does things") -> None:
+    for number in range(count):
+        Help.register_help(f"cmd{number}", text)
+
+
+def test_rendered_help_is_kept_until_help_changes() -> None:
+    register(2)
+    rendered: str = Help.get_help()
+    assert rendered == "/cmd0 -> Does things\n/cmd1 -> Does things\n"
+    assert Help.get_help() is rendered
+
+    # Registering the same help again changes nothing
+    Help.register_help("cmd0", "Does things")
+    assert Help.get_help() is rendered
+
+    Help.register_help("added", "New")
+    assert Help.get_help() == rendered + "/added -> New\n"
+    assert Help.get_help_pages() == (Help.get_help(),)
+
+    Help.register_help("added", "Changed")
+    assert Help.get_help().endswith("/added -> Changed\n")
+
+    Help.remove_help("added")
+    assert Help.get_help() == rendered
+
+
+@pytest.mark.parametrize(("count", "sizes"), [(0, [0]), (1, [1]), (3, [3]), (4, [3, 1]), (7, [3, 3, 1])])
+def test_pages_hold_help_page_lines_commands(monkeypatch: pytest.MonkeyPatch, count: int, sizes: list[int]) -> None:
+    monkeypatch.setattr(help_module, "HELP_PAGE_LINES", 3)
+    register(count)
+
+    pages: tuple[str, ...] = Help.get_help_pages()
+    assert [len(page.splitlines()) for page in pages] == sizes
+    assert "".join(pages) == Help.get_help()
+
+
+def test_pages_fit_in_a_message(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(help_module, "HELP_PAGE_LINES", 10)
+    # Three of these fit in a message, four do not
+    register(5, "x" * (MessageLimit.MAX_TEXT_LENGTH // 4))
+
+    pages: tuple[str, ...] = Help.get_help_pages()
+    assert [len(page.splitlines()) for page in pages] == [3, 2]
+    assert all(len(page) <= MessageLimit.MAX_TEXT_LENGTH - 100 for page in pages)
@@ -0,0 +1,171 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from tgbot_python_v2.util import config as config_module
+from tgbot_python_v2.util import filelock
+from tgbot_python_v2.util.config import JournalConfig
+from tgbot_python_v2.util.filelock import FileLock
+
+
+def reopen(config: JournalConfig) -> JournalConfig:
+    config.close()
+    return JournalConfig(config.name, lazy=False)
+
+
+def journal_lines(config_dir: Path, name: str) -> list:
+    return [json.loads(line) for line in (config_dir / f"{name}.journal").read_text().splitlines()]
+
+
+def test_changes_are_appended_and_replayed(config_dir: Path) -> None:
+    config: JournalConfig = JournalConfig("votes.json", lazy=False)
+    config.config["123"] = {"count": 1}
+    config.write_config()
+    config.config["123"]["count"] = 2
+    config.config["124"] = {"count": 1}
+    config.write_config()
+    del config.config["124"]
+    config.write_config()
+
+    header, *records = journal_lines(config_dir, "votes.json")
+    assert header == {"snapshot": (config_dir / "votes.json").stat().st_ino}
+    assert records[0] == [["123"], {"count": 1}]
+    assert sorted(records[1:3], key=str) == [[["123", "count"], 2], [["124"], {"count": 1}]]
+    assert records[3:] == [[["124"]]]
+    assert json.loads((config_dir / "votes.json").read_text()) == {}
+    assert reopen(config).config == {"123": {"count": 2}}
+
+
+def test_broken_record_is_skipped_and_compacted(config_dir: Path) -> None:
+    config: JournalConfig = JournalConfig("broken.json", lazy=False)
+    config.config["a"] = 1
+    config.write_config()
+    with open(config_dir / "broken.json.journal", "a") as journal:
+        journal.write('[["b"], ')
+
+    config = reopen(config)
+    assert config.config == {"a": 1}
+    config.config["c"] = 3
+    config.write_config()
+    assert json.loads((config_dir / "broken.json").read_text()) == {"a": 1, "c": 3}
+    assert len(journal_lines(config_dir, "broken.json")) == 1
+
+
+def test_large_journal_is_compacted(config_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config_module, "CONFIG_JOURNAL_SIZE", 100)
+    config: JournalConfig = JournalConfig("counter.json", lazy=False)
+    for count in range(10):
+        config.config["count"] = count
+        config.write_config()
+
+    lines: list = journal_lines(config_dir, "counter.json")
+    assert len(lines) < 10
+    assert lines[0] == {"snapshot": (config_dir / "counter.json").stat().st_ino}
+    assert json.loads((config_dir / "counter.json").read_text())["count"] < 9
+    assert reopen(config).config == {"count": 9}
+
+
+def test_journal_left_by_crash_during_compaction_is_ignored(config_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    config: JournalConfig = JournalConfig("crash.json", lazy=False)
+    config.config["count"] = 1
+    config.config["old"] = True
+    config.write_config()
+    stale: str = (config_dir / "crash.json.journal").read_text()
+
+    # The process dies after the new file replaced the old one, before the journal was replaced
+    config.config["count"] = 2
+    del config.config["old"]
+    monkeypatch.setattr(config_module, "CONFIG_JOURNAL_SIZE", 0)
+    config.write_config()
+    (config_dir / "crash.json.journal").write_text(stale)
+    monkeypatch.setattr(config_module, "CONFIG_JOURNAL_SIZE", 1024 * 1024)
+
+    config = reopen(config)
+    assert config.config == {"count": 2}
+    config.config["count"] = 3
+    config.write_config()
+    assert reopen(config).config == {"count": 3}
+
+
+def test_compaction_is_not_done_on_the_event_loop(config_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    async def run() -> list[tuple[bool, bool]]:
+        config: JournalConfig = JournalConfig("compacted.json", lazy=False)
+        writes: list[tuple[bool, bool]] = []
+        write_file = config._write_file
+
+        def record_write(seq: int, snapshot: tuple[list[str], str | None]) -> tuple | None:
+            # Whether it compacted, and whether it ran on the event loop's thread
+            writes.append((snapshot[1] is not None, threading.current_thread() is threading.main_thread()))
+            return write_file(seq, snapshot)
+
+        config._write_file = record_write
+        config.config["count"] = 1
+        config.write_config()
+        monkeypatch.setattr(config_module, "CONFIG_JOURNAL_SIZE", 0)
+        config.config["count"] = 2
+        config.write_config()
+        # A write while the compaction is in progress waits for it in a thread as well
+        config.config["count"] = 3
+        config.write_config()
+        await asyncio.gather(*config.flush_tasks)
+        return writes
+
+    assert asyncio.run(run()) == [(False, True), (True, False)]
+    assert json.loads((config_dir / "compacted.json").read_text()) == {"count": 3}
+    assert len(journal_lines(config_dir, "compacted.json")) == 1
+
+
+def append_like_another_process(config_dir: Path, name: str, record: str) -> None:
+    with FileLock(str(config_dir / f"{name}.lock")).exclusive(), open(config_dir / f"{name}.journal", "a") as journal:
+        journal.write(record)
+
+
+@pytest.mark.skipif(filelock.libc is None, reason="needs inotify")
+def test_changes_of_other_processes_are_picked_up_through_inotify(config_dir: Path) -> None:
+    async def wait_for(condition: Callable[[], bool]) -> None:
+        deadline: float = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        config: JournalConfig = JournalConfig("watched.json", lazy=False)
+        config.config["a"] = 1
+        config.write_config()
+        config_module.watch_configs()
+        try:
+            # Appending to the journal is only seen through the lock file being closed
+            append_like_another_process(config_dir, "watched.json", '[["b"], 2]\n')
+            await wait_for(lambda: config.config == {"a": 1, "b": 2})
+
+            # Replacing the file without taking the lock, e.g. by hand
+            tmp_file: Path = config_dir / "watched.json.tmp"
+            tmp_file.write_text('{"c": 3}')
+            os.replace(tmp_file, config_dir / "watched.json")
+            await wait_for(lambda: config.config == {"c": 3})
+        finally:
+            config_module.unwatch_configs()
+
+    asyncio.run(run())
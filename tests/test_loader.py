@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import types
+from pathlib import Path
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, BaseHandler, CommandHandler, MessageHandler, filters
+
+from tgbot_python_v2.util import loader, routing
+from tgbot_python_v2.util.loader import LoadedModule, _swap_handlers
+
+
+async def callback(update: Update, context: object) -> None:
+    pass
+
+
+def module(tmp_path: Path, name: str, handlers: list[tuple[int, BaseHandler]]) -> LoadedModule:
+    path: Path = tmp_path / f"{name}.py"
+    path.write_text("")
+    loaded: LoadedModule = LoadedModule(path)
+    loaded.handlers = handlers
+    return loaded
+
+
+def test_reloaded_handlers_take_the_place_of_the_old_ones(tmp_path: Path) -> None:
+    app: Application = ApplicationBuilder().token("123456:test-token").build()
+    before: CommandHandler = CommandHandler("before", callback)
+    old_command: CommandHandler = CommandHandler("old", callback)
+    old_scoped: MessageHandler = MessageHandler(filters.TEXT, callback)
+    after: MessageHandler = MessageHandler(filters.ALL, callback)
+    app.add_handler(before)
+    app.add_handler(old_command)
+    routing.add_handler(app, old_scoped, [1])
+    app.add_handler(after)
+    app.add_handler(MessageHandler(filters.ALL, callback), group=1)
+    old: LoadedModule = module(tmp_path, "reloaded", [(0, old_command), (0, old_scoped)])
+
+    # The new module's setup_module() added its handlers at the end
+    new_command: CommandHandler = CommandHandler("new", callback)
+    new_scoped: MessageHandler = MessageHandler(filters.TEXT, callback)
+    app.add_handler(new_command)
+    routing.add_handler(app, new_scoped, [1])
+    new: LoadedModule = module(tmp_path, "reloaded", [(0, new_command), (0, new_scoped)])
+
+    groups: dict[int, list[BaseHandler]] = app.handlers
+    group: list[BaseHandler] = list(app.handlers[0])
+    _swap_handlers(app, old, new)
+
+    assert [handler for _, handler in routing.iter_handlers(app)][:4] == [before, new_command, new_scoped, after]
+    assert old_scoped not in routing.scoped
+    # Updates being processed go on with the groups as they were
+    assert groups[0] == group
+    assert app.handlers[1] is groups[1]
+    routing.remove_handler(app, new_scoped)
+
+
+def test_removed_module_takes_its_empty_group_along(tmp_path: Path) -> None:
+    app: Application = ApplicationBuilder().token("123456:test-token").build()
+    handler: CommandHandler = CommandHandler("old", callback)
+    app.add_handler(handler, group=2)
+    groups: dict[int, list[BaseHandler]] = app.handlers
+
+    _swap_handlers(app, module(tmp_path, "removed", [(2, handler)]), None)
+    assert app.handlers == {}
+    assert groups == {2: [handler]}
+
+
+@pytest.fixture
+def cache_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(loader, "LAZY_MODULES", True)
+    monkeypatch.setattr(loader, "CACHE_FILE", tmp_path / ".module_cache.json")
+    monkeypatch.setattr(loader, "cache", {"version": loader.CACHE_VERSION, "modules": {}, "synced_commands": None})
+    return loader.CACHE_FILE
+
+
+def record(path: Path, handlers: list[tuple[int, BaseHandler]]) -> None:
+    """Start up with the module once, and read the cache back like the next startup."""
+    imported: LoadedModule = LoadedModule(path)
+    imported.module = types.ModuleType(imported.name)
+    imported.handlers = handlers
+    loader._record(imported)
+    loader.write_cache()
+    loader.cache["modules"].clear()
+    loader.read_cache()
+
+
+def test_cache_hit_makes_the_module_lazy(tmp_path: Path, cache_file: Path) -> None:
+    path: Path = tmp_path / "cached.py"
+    path.write_text("# version 1")
+    other: Path = tmp_path / "other.py"
+    other.write_text("")
+    record(path, [(0, CommandHandler("cached", callback))])
+
+    lazy, eager = loader._plan((path, other), {})
+    assert [(mdl.loaded.path, mdl.commands) for mdl in lazy] == [(path, ["cached"])]
+    assert eager == [other]
+
+
+def test_cache_miss_falls_back_to_the_manifest(tmp_path: Path, cache_file: Path) -> None:
+    listed: Path = tmp_path / "listed.py"
+    listed.write_text("")
+    unlisted: Path = tmp_path / "unlisted.py"
+    unlisted.write_text("")
+
+    lazy, eager = loader._plan((listed, unlisted), {"listed": {"commands": {"listed": "Help text"}}})
+    assert [(mdl.loaded.path, mdl.help_strings) for mdl in lazy] == [(listed, {"listed": "Help text"})]
+    assert eager == [unlisted]
+
+
+def test_cache_entry_is_invalidated_by_a_changed_file(tmp_path: Path, cache_file: Path) -> None:
+    path: Path = tmp_path / "changed.py"
+    path.write_text("# version 1")
+    record(path, [(0, CommandHandler("changed", callback))])
+
+    path.write_text("# version 2")
+    lazy, eager = loader._plan((path,), {})
+    assert lazy == []
+    assert eager == [path]
+
+
+def test_cache_keeps_modules_with_other_handlers_eager(tmp_path: Path, cache_file: Path) -> None:
+    path: Path = tmp_path / "messages.py"
+    path.write_text("")
+    record(path, [(0, CommandHandler("messages", callback)), (0, MessageHandler(filters.TEXT, callback))])
+
+    lazy, eager = loader._plan((path,), {"messages": {"commands": {"messages": None}}})
+    assert lazy == []
+    assert eager == [path]
+
+
+def test_cache_is_not_used_without_lazy_modules(
+    tmp_path: Path, cache_file: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path: Path = tmp_path / "cached.py"
+    path.write_text("")
+    record(path, [(0, CommandHandler("cached", callback))])
+
+    monkeypatch.setattr(loader, "LAZY_MODULES", False)
+    lazy, eager = loader._plan((path,), {})
+    assert lazy == []
+    assert eager == [path]
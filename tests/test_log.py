@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import gzip
+import io
+import random
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from tgbot_python_v2.modules import log
+
+SECRETS: list[bytes] = [b"123:abcSECRET", b"123%3AabcSECRET"]
+
+
+def chunked(data: bytes, rng: random.Random) -> list[bytes]:
+    chunks: list[bytes] = []
+    while data:
+        size: int = rng.randint(1, 15)
+        chunks.append(data[:size])
+        data = data[size:]
+    return chunks
+
+
+def test_redact_secrets_split_between_chunks() -> None:
+    rng: random.Random = random.Random(1)
+    pieces: list[bytes] = [*SECRETS, b"123:abc", b"12", b"x", b"\n"]
+    for _ in range(500):
+        data: bytes = b"".join(rng.choice(pieces) for _ in range(40))
+        expected: bytes = data
+        for secret in SECRETS:
+            expected = expected.replace(secret, log.REDACTED)
+
+        assert b"".join(log.redact(chunked(data, rng), SECRETS)) == expected
+
+
+def test_redact_keeps_text_without_secrets() -> None:
+    assert b"".join(log.redact([b"hello ", b"world\n"], SECRETS)) == b"hello world\n"
+    assert b"".join(log.redact([], SECRETS)) == b""
+
+
+def read_tail(data: bytes, lines: int) -> bytes:
+    log_file: io.BufferedReader = io.BufferedReader(io.BytesIO(data))
+    return data[log.offset_tail(log_file, len(data), lines) :]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1024])
+def test_offset_tail(monkeypatch: pytest.MonkeyPatch, chunk_size: int) -> None:
+    monkeypatch.setattr(log, "CHUNK_SIZE", chunk_size)
+    data: bytes = b"".join(f"line {number}\n".encode() for number in range(10))
+
+    assert read_tail(data, 3) == b"line 7\nline 8\nline 9\n"
+    assert read_tail(data, 1) == b"line 9\n"
+    assert read_tail(data, 0) == b""
+    assert read_tail(data, 10) == data
+    assert read_tail(data, 50) == data
+    assert read_tail(b"", 5) == b""
+
+
+@pytest.fixture
+def log_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    log_path: Path = tmp_path / "bot.log"
+    lines: list[str] = [f"2024-12-31 10:{minute:02d}:00,000 [INFO] x: {log.TOKEN} {minute}\n" for minute in range(60)]
+    log_path.write_text("".join(lines))
+    monkeypatch.setattr(log, "LOG_FILE", str(log_path))
+    monkeypatch.setattr(log, "INDEX_BLOCK", 100)
+    monkeypatch.setattr(log, "index", log.LogIndex(str(log_path)))
+    return log_path
+
+
+def test_build_log_since_and_redaction(log_path: Path) -> None:
+    since: float = log.parse_since(["2024-12-31", "10:45"])
+    output_file, compressed = log.build_log(None, since, False)
+    output: str = output_file.read().decode()
+
+    assert not compressed
+
+    assert output.splitlines()[0] == "2024-12-31 10:45:00,000 [INFO] x: [token redacted] 45"
+    assert len(output.splitlines()) == 15
+    assert log.TOKEN not in output
+
+
+def test_build_log_compresses_above_threshold(log_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(log, "SPOOL_SIZE", 100)
+    monkeypatch.setattr(log, "GZIP_ABOVE", 10 * len(log_path.read_bytes().splitlines()[0]))
+
+    output_file, compressed = log.build_log(5, None, False)
+    assert not compressed
+    assert len(output_file.read().splitlines()) == 5
+
+    output_file, compressed = log.build_log(None, None, False)
+    assert compressed
+    # Larger than SPOOL_SIZE, so it was moved out of memory
+    assert output_file._rolled
+    output: bytes = gzip.decompress(output_file.read())
+    assert len(output.splitlines()) == 60
+    assert log.TOKEN.encode() not in output
+
+
+class FakeMessage:
+    def __init__(self, user_id: int) -> None:
+        self.from_user: SimpleNamespace = SimpleNamespace(id=user_id)
+        self.replies: list[str] = []
+        self.documents: list[tuple[bytes, str]] = []
+
+    async def reply_text(self, text: str) -> None:
+        self.replies.append(text)
+
+    async def reply_document(self, document: io.IOBase, filename: str) -> None:
+        self.documents.append((document.read(), filename))
+
+
+def get_log(*args: str) -> FakeMessage:
+    message: FakeMessage = FakeMessage(log.RM6785_MASTER_USER[0])
+    asyncio.run(log.get_log(SimpleNamespace(message=message), SimpleNamespace(args=list(args))))
+    return message
+
+
+def test_get_log_sends_document(log_path: Path) -> None:
+    message: FakeMessage = get_log("tail", "2")
+    assert message.replies == []
+    assert len(message.documents) == 1
+    assert message.documents[0][1] == "bot.log"
+    assert message.documents[0][0].decode().splitlines()[-1].endswith("[token redacted] 59")
+
+    message = get_log("gz")
+    assert message.documents[0][1] == "bot.log.gz"
+    assert len(gzip.decompress(message.documents[0][0]).splitlines()) == 60
+
+
+def test_get_log_too_large(log_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(log, "MAX_UPLOAD", 100)
+
+    message: FakeMessage = get_log("gz")
+    assert message.documents == []
+    assert len(message.replies) == 1
+    assert "compressed" in message.replies[0]
+    assert "tail N or since TIME" in message.replies[0]
+
+    assert get_log("tail", "1").documents != []
+
+
+def test_get_log_usage(log_path: Path) -> None:
+    assert get_log("tail", "x").replies == [log.USAGE]
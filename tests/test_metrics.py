@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import datetime
+import re
+from collections import Counter
+
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from tgbot_python_v2.util import metrics
+
+# The exposition format's ABNF, https://github.com/OpenObservability/OpenMetrics/blob/main/specification/OpenMetrics.md
+METRIC_NAME: str = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+ESCAPED: str = r'(?:[^"\\\n]|\\["\\n])*'
+LABELS: str = rf'\{{(?:[a-zA-Z_][a-zA-Z0-9_]*="{ESCAPED}"(?:,[a-zA-Z_][a-zA-Z0-9_]*="{ESCAPED}")*)?\}}'
+NUMBER: str = r"[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|[+-]?(?i:inf|infinity)|(?i:nan)"
+DESCRIPTOR: re.Pattern = re.compile(
+    rf"# (?:TYPE ({METRIC_NAME}) (counter|gauge|histogram|gaugehistogram|stateset|info|summary|unknown)"
+    rf"|HELP ({METRIC_NAME}) (?:{ESCAPED})|UNIT ({METRIC_NAME}) ([a-zA-Z0-9_:]*))"
+)
+SAMPLE: re.Pattern = re.compile(rf"({METRIC_NAME})({LABELS})? ({NUMBER})(?: {NUMBER})?")
+LABEL: re.Pattern = re.compile(rf'([a-zA-Z_][a-zA-Z0-9_]*)="({ESCAPED})"')
+SUFFIXES: dict[str, tuple[str, ...]] = {"counter": ("_total", "_created"), "gauge": ("",)}
+SUFFIXES["histogram"] = ("_bucket", "_count", "_sum", "_created")
+
+
+def parse(text: str) -> dict[str, tuple[str, list[tuple[str, dict[str, str], float]]]]:
+    """Checks text against the grammar and the rules for counters, gauges and histograms, returns
+    the type and samples of every metric family."""
+    assert text.endswith("# EOF\n")
+    families: dict[str, tuple[str, list[tuple[str, dict[str, str], float]]]] = {}
+    units: dict[str, str] = {}
+    family: str | None = None
+    samples_seen: set[tuple[str, tuple]] = set()
+    for line in text.removesuffix("# EOF\n").splitlines():
+        if descriptor := DESCRIPTOR.fullmatch(line):
+            name: str = descriptor[1] or descriptor[3] or descriptor[4]
+            if name != family:
+                # Descriptors start a family, and come before its samples
+                assert name not in families, f"{name} is described twice"
+                family = name
+                families[name] = ("unknown", [])
+            assert not families[name][1], f"descriptor after the samples of {name}"
+            if descriptor[2]:
+                families[name] = (descriptor[2], [])
+            if descriptor[5]:
+                units[name] = descriptor[5]
+            continue
+
+        sample = SAMPLE.fullmatch(line)
+        assert sample is not None, f"not a sample: {line!r}"
+        assert family is not None
+        metric_type, samples = families[family]
+        suffix: str = sample[1].removeprefix(family)
+        assert sample[1].startswith(family) and suffix in SUFFIXES[metric_type], f"{sample[1]} is not a {family}"
+        labels: dict[str, str] = dict(LABEL.findall(sample[2] or ""))
+        key: tuple[str, tuple] = (sample[1], tuple(sorted(labels.items())))
+        assert key not in samples_seen, f"duplicate sample {line!r}"
+        samples_seen.add(key)
+        samples.append((suffix, labels, float(sample[3])))
+
+    for name, unit in units.items():
+        assert name.endswith(f"_{unit}")
+    for name, (metric_type, samples) in families.items():
+        if metric_type == "histogram":
+            check_histogram(name, samples)
+    return families
+
+
+def check_histogram(name: str, samples: list[tuple[str, dict[str, str], float]]) -> None:
+    series: dict[tuple, dict[str, list]] = {}
+    for suffix, labels, value in samples:
+        le: str | None = labels.get("le")
+        others: tuple = tuple(sorted((label, text) for label, text in labels.items() if label != "le"))
+        parts: dict[str, list] = series.setdefault(others, {"buckets": [], "count": []})
+        if suffix == "_bucket":
+            parts["buckets"].append((float(le), value))
+        elif suffix == "_count":
+            parts["count"].append(value)
+    for labels, parts in series.items():
+        bounds: list[float] = [bound for bound, _ in parts["buckets"]]
+        counts: list[float] = [count for _, count in parts["buckets"]]
+        assert bounds == sorted(bounds) and bounds[-1] == float("inf"), f"{name}{labels} buckets"
+        assert counts == sorted(counts), f"{name}{labels} buckets are not cumulative"
+        assert parts["count"] == [counts[-1]], f"{name}{labels} count"
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(metrics, "api_stats", {})
+    monkeypatch.setattr(metrics, "in_flight", 0)
+    monkeypatch.setattr(metrics, "loop_lag_buckets", [0] * (len(metrics.LAG_BUCKETS) + 1))
+    monkeypatch.setattr(metrics, "loop_lag_sum", 0.0)
+    monkeypatch.setattr(metrics, "loop_stalls", Counter())
+    monkeypatch.setattr(metrics, "loop_blocked_seconds", {})
+
+
+def test_empty_metrics_are_valid() -> None:
+    families = parse(metrics.render())
+    assert families["tgbot_api_requests"] == ("counter", [])
+    assert families["tgbot_api_requests_in_flight"] == ("gauge", [("", {}, 0.0)])
+    assert families["tgbot_loop_lag_seconds"][0] == "histogram"
+
+
+def test_recorded_metrics_are_valid() -> None:
+    metrics.record_api_call("sendMessage", 0.07, None)
+    metrics.record_api_call("sendMessage", 100.0, TimedOut("Pool timeout: All connections are occupied"))
+    metrics.record_api_call("sendMessage", 0.3, RetryAfter(datetime.timedelta(seconds=5)))
+    metrics.record_api_call("getUpdates", 0.01, BadRequest("Chat not found"))
+    metrics.record_loop_lag(0.001)
+    metrics.record_loop_lag(60.0)
+    metrics.record_loop_stall("misc.neofetch", 0.4)
+
+    families = parse(metrics.render())
+    assert ("_total", {"method": "sendMessage"}, 3.0) in families["tgbot_api_requests"][1]
+    assert ("_total", {"method": "sendMessage", "error": "PoolTimeout"}, 1.0) in families["tgbot_api_errors"][1]
+    assert ("_total", {"method": "getUpdates", "error": "BadRequest"}, 1.0) in families["tgbot_api_errors"][1]
+    assert ("_total", {"method": "sendMessage"}, 5.0) in families["tgbot_api_flood_wait_seconds"][1]
+    duration: list = families["tgbot_api_request_duration_seconds"][1]
+    assert ("_bucket", {"method": "sendMessage", "le": "0.1"}, 1.0) in duration
+    assert ("_bucket", {"method": "sendMessage", "le": "30.0"}, 2.0) in duration
+    assert ("_bucket", {"method": "sendMessage", "le": "+Inf"}, 3.0) in duration
+    assert ("_sum", {}, 60.001) in families["tgbot_loop_lag_seconds"][1]
+    assert families["tgbot_loop_stalls"][1] == [("_total", {"handler": "misc.neofetch"}, 1.0)]
+
+
+@pytest.mark.parametrize(
+    "broken",
+    [
+        "# TYPE x counter\nx 1\n# EOF\n",
+        "# TYPE x counter\nx_total 1\n# EOF",
+        "# TYPE x_seconds counter\n# UNIT x_seconds bytes\nx_seconds_total 1\n# EOF\n",
+        '# TYPE x counter\nx_total{a="1"} 1\nx_total{a="1"} 2\n# EOF\n',
+        '# TYPE x histogram\nx_bucket{le="1"} 2\nx_bucket{le="+Inf"} 1\nx_count 1\n# EOF\n',
+        '# TYPE x histogram\nx_bucket{le="1"} 1\nx_count 1\n# EOF\n',
+        "# TYPE x counter\nx_total 1\n# TYPE x counter\n# EOF\n",
+        "# TYPE x gauge\nx one\n# EOF\n",
+    ],
+)
+def test_parser_finds_mistakes(broken: str) -> None:
+    with pytest.raises(AssertionError):
+        parse(broken)
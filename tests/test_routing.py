@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import datetime
+from collections.abc import Iterator
+
+import pytest
+from telegram import Chat, Message, Update
+from telegram.ext import Application, ApplicationBuilder, BaseHandler, MessageHandler, filters
+
+from tgbot_python_v2.util import routing
+
+
+def make_update(chat_id: int, text: str = "hello") -> Update:
+    return Update(1, message=Message(1, datetime.datetime.now(), Chat(chat_id, Chat.SUPERGROUP), text=text))
+
+
+def first_match(app: Application, update: Update) -> BaseHandler | None:
+    """The handler of group 0 the application would hand the update to."""
+    for handler in app.handlers.get(0, []):
+        check: object = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler.handler if isinstance(handler, routing.ChatScoped) else handler
+    return None
+
+
+async def callback(update: Update, context: object) -> None:
+    pass
+
+
+@pytest.fixture
+def app() -> Iterator[Application]:
+    app: Application = ApplicationBuilder().token("123456:test-token").build()
+    yield app
+    for _, handler in list(routing.iter_handlers(app)):
+        if handler in routing.scoped:
+            routing.remove_handler(app, handler)
+
+
+def test_scoped_handlers_keep_their_place(app: Application) -> None:
+    everything: MessageHandler = MessageHandler(filters.ALL, callback)
+    scoped: MessageHandler = MessageHandler(filters.TEXT, callback)
+    text: MessageHandler = MessageHandler(filters.TEXT, callback)
+    routing.add_handler(app, scoped, [1])
+    app.add_handler(everything)
+    routing.add_handler(app, MessageHandler(filters.TEXT, callback), [2])
+    app.add_handler(text)
+
+    assert first_match(app, make_update(1)) is scoped
+    assert first_match(app, make_update(2)) is everything
+    assert first_match(app, make_update(3)) is everything
+    assert [handler for _, handler in routing.iter_handlers(app)][:2] == [scoped, everything]
+
+
+def test_chats_of_a_handler_change(app: Application) -> None:
+    scoped: MessageHandler = MessageHandler(filters.TEXT, callback)
+    routing.add_handler(app, scoped, [1])
+    assert first_match(app, make_update(2)) is None
+
+    routing.add_chat(scoped, 2)
+    assert first_match(app, make_update(2)) is scoped
+    routing.remove_chat(scoped, 1)
+    assert first_match(app, make_update(1)) is None
+
+    routing.remove_handler(app, scoped)
+    assert first_match(app, make_update(2)) is None
+    assert scoped not in routing.scoped
+
+
+def test_removing_handlers_leaves_the_groups_being_iterated(app: Application) -> None:
+    handler: MessageHandler = MessageHandler(filters.ALL, callback)
+    other: MessageHandler = MessageHandler(filters.TEXT, callback)
+    app.add_handler(handler)
+    app.add_handler(other, group=1)
+    groups: dict[int, list[BaseHandler]] = app.handlers
+
+    routing.remove_handlers(app, [handler])
+    assert app.handlers == {1: [other]}
+    assert groups == {0: [handler], 1: [other]}
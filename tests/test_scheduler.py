@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import datetime
+import random
+
+import pytest
+from telegram import Chat, Message, Update
+from telegram._utils.defaultvalue import DefaultValue
+from telegram.ext import CommandHandler
+
+from tgbot_python_v2.util import scheduler
+from tgbot_python_v2.util.scheduler import ChatScheduler
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat: Chat = Chat(chat_id, Chat.SUPERGROUP)
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(), chat))
+
+
+class Recorder:
+    def __init__(self):
+        self.started: dict[int, list[int]] = {}
+        self.running: set[int] = set()
+        self.running_chats: set[int] = set()
+        self.max_running: int = 0
+        self.overlaps: int = 0
+
+    async def handle(self, chat_id: int, update_id: int) -> None:
+        if chat_id in self.running_chats:
+            self.overlaps += 1
+        self.running_chats.add(chat_id)
+        self.running.add(update_id)
+        self.max_running = max(self.max_running, len(self.running))
+        self.started.setdefault(chat_id, []).append(update_id)
+        await asyncio.sleep(random.uniform(0, 0.003))
+        self.running.discard(update_id)
+        self.running_chats.discard(chat_id)
+
+
+async def feed(scheduler: ChatScheduler, recorder: Recorder, updates: list[tuple[int, int]]) -> None:
+    await scheduler.initialize()
+    for update_id, chat_id in updates:
+        await scheduler.do_process_update(make_update(update_id, chat_id), recorder.handle(chat_id, update_id))
+    await scheduler.drain()
+
+
+def test_updates_of_a_chat_run_in_order_one_at_a_time() -> None:
+    random.seed(1)
+    updates: list[tuple[int, int]] = [(update_id, random.choice([1, 2, 3, 4, 5])) for update_id in range(300)]
+    scheduler: ChatScheduler = ChatScheduler(concurrency=3, max_pending=20, max_chat_pending=0)
+    recorder: Recorder = Recorder()
+
+    asyncio.run(feed(scheduler, recorder, updates))
+
+    for chat_id, started in recorder.started.items():
+        assert started == [update_id for update_id, chat in updates if chat == chat_id]
+    assert recorder.overlaps == 0
+    assert scheduler.processed == len(updates)
+
+
+def test_concurrency_is_capped() -> None:
+    updates: list[tuple[int, int]] = [(update_id, update_id) for update_id in range(100)]
+    scheduler: ChatScheduler = ChatScheduler(concurrency=4, max_pending=1000, max_chat_pending=0)
+    recorder: Recorder = Recorder()
+
+    asyncio.run(feed(scheduler, recorder, updates))
+
+    assert recorder.max_running == 4
+    assert scheduler.processed == len(updates)
+
+
+def test_flooding_chat_is_dropped_beyond_its_limit() -> None:
+    async def run() -> tuple[ChatScheduler, Recorder]:
+        scheduler: ChatScheduler = ChatScheduler(concurrency=1, max_pending=1000, max_chat_pending=5)
+        recorder: Recorder = Recorder()
+        await scheduler.initialize()
+        # Nothing runs before the first await, so the chat's lane fills up
+        for update_id in range(20):
+            await scheduler.do_process_update(make_update(update_id, 1), recorder.handle(1, update_id))
+        await scheduler.drain()
+        return scheduler, recorder
+
+    scheduler, recorder = asyncio.run(run())
+
+    assert scheduler.dropped + scheduler.processed == 20
+    assert scheduler.dropped > 0
+    assert recorder.started[1] == sorted(recorder.started[1])
+
+
+async def callback(update: Update, context: object) -> None:
+    pass
+
+
+def test_adopt_handlers_keeps_an_explicit_block(monkeypatch: pytest.MonkeyPatch) -> None:
+    default: CommandHandler = CommandHandler("default", callback)
+    blocking: CommandHandler = CommandHandler("blocking", callback, block=True)
+    background: CommandHandler = CommandHandler("background", callback, block=False)
+
+    monkeypatch.setattr(scheduler, "SCHEDULER_CONCURRENCY", 0)
+    scheduler.adopt_handlers([default, blocking, background])
+    assert isinstance(default.block, DefaultValue)
+
+    monkeypatch.setattr(scheduler, "SCHEDULER_CONCURRENCY", 4)
+    scheduler.adopt_handlers([default, blocking, background])
+    # Not a DefaultValue anymore, so Defaults(block=False) does not apply to it either
+    assert default.block is True
+    assert blocking.block is True
+    assert background.block is False
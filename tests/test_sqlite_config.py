@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from tgbot_python_v2.util.config import SqliteConfig
+
+
+def stored(config_dir: Path) -> dict[str, str]:
+    with sqlite3.connect(config_dir / "settings.sqlite3") as connection:
+        return dict(connection.execute("SELECT key, value FROM config"))
+
+
+def test_only_changed_keys_are_written(config_dir: Path) -> None:
+    config: SqliteConfig = SqliteConfig("settings.json", lazy=False)
+    config.config["a"] = {"count": 1}
+    config.config["b"] = [1, 2]
+    config.write_config()
+    assert stored(config_dir) == {"a": '{"count": 1}', "b": "[1, 2]"}
+
+    config.config["a"]["count"] += 1
+    assert config._changes() == ({"a": '{"count": 2}'}, set())
+    config.write_config()
+    assert stored(config_dir)["a"] == '{"count": 2}'
+
+
+def test_removed_keys(config_dir: Path) -> None:
+    config: SqliteConfig = SqliteConfig("settings.json", lazy=False)
+    config.config["kept"] = 1
+    config.config["gone"] = 2
+    config.write_config()
+
+    del config.config["gone"]
+    # Added and removed again before any write, there is no row to delete
+    config.config["never_written"] = 3
+    del config.config["never_written"]
+    assert config._changes() == ({}, {"gone"})
+
+    config.write_config()
+    assert stored(config_dir) == {"kept": "1"}
+
+
+def test_replaced_config_is_diffed_against_rows(config_dir: Path) -> None:
+    config: SqliteConfig = SqliteConfig("settings.json", lazy=False)
+    config.config.update({"a": 1, "b": 2})
+    config.write_config()
+
+    config.config = {"a": 1, "c": 3}
+    assert config._changes() == ({"c": "3"}, {"b"})
+
+
+def test_int_keys_are_stored_as_strings(config_dir: Path) -> None:
+    config: SqliteConfig = SqliteConfig("settings.json", lazy=False)
+    config.config[123] = "chat"
+    config.write_config()
+    assert stored(config_dir) == {"123": '"chat"'}
+
+    config.config[123] = "chat"
+    assert config._changes() == ({}, set())
+
+
+def test_failed_migration_leaves_the_json_file_to_import_again(
+    config_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    data: dict = {"a": 1, "b": [2], "c": {"d": 3}}
+    (config_dir / "settings.json").write_text(json.dumps(data))
+    dumps = json.dumps
+    calls: list[object] = []
+
+    def fail_on_second_row(value: object, **kwargs: object) -> str:
+        calls.append(value)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return dumps(value, **kwargs)
+
+    config: SqliteConfig = SqliteConfig("settings.json")
+    monkeypatch.setattr(json, "dumps", fail_on_second_row)
+    with pytest.raises(OSError, match="disk full"):
+        config.read_config()
+    monkeypatch.setattr(json, "dumps", dumps)
+
+    assert stored(config_dir) == {}
+    assert (config_dir / "settings.json").exists()
+    assert not (config_dir / "settings.json.migrated").exists()
+
+    assert config.config == data
+    assert stored(config_dir) == {key: json.dumps(value) for key, value in data.items()}
+    assert not (config_dir / "settings.json").exists()
+    assert json.loads((config_dir / "settings.json.migrated").read_text()) == data
+
+
+def test_interrupted_rename_is_finished(config_dir: Path) -> None:
+    (config_dir / "settings.json").write_text('{"a": 1}')
+    SqliteConfig("settings.json", lazy=False).close()
+    # As if the bot died after the import was committed, before the file was renamed
+    (config_dir / "settings.json.migrated").rename(config_dir / "settings.json")
+
+    config: SqliteConfig = SqliteConfig("settings.json", lazy=False)
+    assert config.config == {"a": 1}
+    assert not (config_dir / "settings.json").exists()
+    assert (config_dir / "settings.json.migrated").exists()
+
+
+def test_json_file_next_to_a_migrated_database_is_left_alone(config_dir: Path) -> None:
+    (config_dir / "settings.json").write_text('{"a": 1}')
+    SqliteConfig("settings.json", lazy=False).close()
+    (config_dir / "settings.json").write_text('{"a": 2}')
+
+    assert SqliteConfig("settings.json", lazy=False).config == {"a": 1}
+    assert json.loads((config_dir / "settings.json").read_text()) == {"a": 2}
+    assert json.loads((config_dir / "settings.json.migrated").read_text()) == {"a": 1}
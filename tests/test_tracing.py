@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import math
+
+import pytest
+
+from tgbot_python_v2.util import tracing
+from tgbot_python_v2.util.tracing import BUCKET_GROWTH, BUCKET_MIN, STATS_WINDOW, Histogram
+
+
+@pytest.mark.parametrize("seconds", [0.0011, 0.0012, 0.005, 0.0173, 0.25, 1.0, 3.7, 42.0])
+def test_quantile_is_the_upper_bound_of_the_bucket(seconds: float) -> None:
+    histogram: Histogram = Histogram()
+    histogram.record(seconds, 0.0)
+
+    (quantile,) = histogram.quantiles(0.0, 0.5)
+    assert seconds <= quantile <= seconds * BUCKET_GROWTH
+    # On the bucket grid
+    assert math.isclose(
+        math.log(quantile / BUCKET_MIN, BUCKET_GROWTH), round(math.log(quantile / BUCKET_MIN, BUCKET_GROWTH))
+    )
+
+
+def test_values_below_the_first_bucket() -> None:
+    histogram: Histogram = Histogram()
+    histogram.record(0.0, 0.0)
+    histogram.record(BUCKET_MIN / 2, 0.0)
+    assert histogram.quantiles(0.0, 0.5, 1.0) == [BUCKET_MIN, BUCKET_MIN]
+
+
+def test_quantiles_of_many_values() -> None:
+    histogram: Histogram = Histogram()
+    for milliseconds in range(1, 101):
+        histogram.record(milliseconds / 1000, 0.0)
+
+    p50, p95, p99 = histogram.quantiles(0.0, 0.5, 0.95, 0.99)
+    assert 0.050 <= p50 <= 0.050 * BUCKET_GROWTH
+    assert 0.095 <= p95 <= 0.095 * BUCKET_GROWTH
+    assert 0.099 <= p99 <= 0.099 * BUCKET_GROWTH
+    assert histogram.count(0.0) == 100
+    assert histogram.time(0.0) == pytest.approx(5.05)
+
+
+def test_empty_histogram() -> None:
+    assert Histogram().quantiles(0.0, 0.5) == [0.0]
+    assert Histogram().count(0.0) == 0
+
+
+def test_old_values_leave_the_window() -> None:
+    histogram: Histogram = Histogram()
+    histogram.record(10.0, 0.0)
+    slice_length: float = STATS_WINDOW / tracing.SLICES
+    histogram.record(0.01, STATS_WINDOW - slice_length)
+    assert histogram.count(STATS_WINDOW - slice_length) == 2
+
+    # The slice holding the first value is out of the window now
+    assert histogram.count(STATS_WINDOW) == 1
+    assert histogram.quantiles(STATS_WINDOW, 1.0)[0] < 10.0
+    # Recording drops slices that left the window
+    histogram.record(0.01, STATS_WINDOW)
+    assert len(histogram.slices) == 2
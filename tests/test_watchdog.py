@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import sys
+import time
+from types import FrameType
+
+import pytest
+
+from tgbot_python_v2.util import tracing, watchdog
+from tgbot_python_v2.util.watchdog import LoopWatchdog
+
+# A module with a decorated handler, like rm6785's check()
+MODULE: str = """
+from functools import wraps
+
+def check(func):
+    @wraps(func)
+    def wrapper():
+        return func()
+    return wrapper
+
+@check
+def approve():
+    return sys._getframe()
+"""
+
+
+def test_culprit_is_the_decorated_handler() -> None:
+    module: dict = {"__name__": "tgbot_python_v2.modules.rm6785", "sys": sys}
+    exec(MODULE, module)  # noqa: S102
+    frame: FrameType = module["approve"]()
+    assert watchdog._culprit(frame) == "rm6785.approve"
+
+
+def test_stall_is_blamed_on_the_traced_handler(monkeypatch: pytest.MonkeyPatch) -> None:
+    stalls: list[str] = []
+    monkeypatch.setattr(watchdog, "record_loop_stall", lambda culprit, lag: stalls.append(culprit))
+
+    async def approve(update: object, context: object) -> None:
+        time.sleep(0.3)  # noqa: ASYNC251 - blocks the loop on purpose
+
+    async def run() -> None:
+        loop_watchdog: LoopWatchdog = LoopWatchdog(threshold=0.1)
+        loop_watchdog.start()
+        await asyncio.sleep(0.05)
+        await tracing._traced("rm6785", approve)(None, None)
+        await asyncio.sleep(0.05)
+        loop_watchdog.stop()
+
+    asyncio.run(run())
+    assert stalls == ["rm6785.test_stall_is_blamed_on_the_traced_handler.<locals>.approve"]
+    assert not tracing.running
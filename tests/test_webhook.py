@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import json
+
+import pytest
+from telegram.ext import Application, ApplicationBuilder
+
+from tgbot_python_v2.util import webhook
+from tgbot_python_v2.util.webhook import WebhookServer
+
+
+async def post(port: int, update_ids: list[int], secret: str = "secret") -> list[int]:
+    """Post updates over one keep-alive connection, returns the status of each answer."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    statuses: list[int] = []
+    for update_id in update_ids:
+        body: bytes = json.dumps({"update_id": update_id}).encode()
+        writer.write(
+            f"POST /webhook HTTP/1.1\r\nX-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        statuses.append(int((await reader.readline()).split()[1]))
+        length: int = 0
+        while (line := await reader.readline()) != b"\r\n":
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+    writer.close()
+    return statuses
+
+
+def queued(app: Application) -> list[int]:
+    update_ids: list[int] = []
+    while not app.update_queue.empty():
+        update_ids.append(app.update_queue.get_nowait().update_id)
+    return update_ids
+
+
+async def serve(*batches: list[int], seen: list[int] = ()) -> list[int]:
+    app: Application = ApplicationBuilder().token("123456:test-token").build()
+    server: WebhookServer = WebhookServer(app, listen="127.0.0.1", port=0, secret="secret")
+    server.remember(seen)
+    await server.start()
+    port: int = server.server.sockets[0].getsockname()[1]
+    try:
+        statuses: list[list[int]] = await asyncio.gather(*(post(port, batch) for batch in batches))
+    finally:
+        await server.stop()
+    assert all(status == 200 for batch in statuses for status in batch)
+    return queued(app)
+
+
+def test_out_of_order_updates_are_all_handled() -> None:
+    assert sorted(asyncio.run(serve([5, 3], [4, 1], [2]))) == [1, 2, 3, 4, 5]
+
+
+def test_updates_sent_again_are_handled_once() -> None:
+    assert asyncio.run(serve([5, 3, 4, 3, 5])) == [5, 3, 4]
+
+
+def test_updates_received_by_predecessor_are_skipped() -> None:
+    assert asyncio.run(serve([6, 8, 7], seen=[5, 7])) == [6, 8]
+
+
+def test_seen_updates_are_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(webhook, "SEEN_UPDATES", 2)
+    assert asyncio.run(serve([1, 2, 3, 1, 3])) == [1, 2, 3, 1]
+
+
+async def send_raw(request: bytes) -> tuple[int, bool]:
+    """Send a request as it is, returns the status of the answer and whether the server closed the
+    connection afterwards."""
+    app: Application = ApplicationBuilder().token("123456:test-token").build()
+    server: WebhookServer = WebhookServer(app, listen="127.0.0.1", port=0, secret="secret")
+    await server.start()
+    port: int = server.server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        status: int = int((await reader.readline()).split()[1])
+        # Drains the answer, then sees whether the connection ends
+        await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return status, reader.at_eof()
+    finally:
+        await server.stop()
+
+
+@pytest.mark.parametrize(
+    ("request_head", "status"),
+    [
+        (b"POST /webhook HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+        (b"POST /webhook HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+        (b"POST /webhook HTTP/1.1\r\nContent-Length: +2\r\n\r\n", 400),
+        (b"POST /webhook HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (webhook.MAX_BODY_SIZE + 1), 413),
+        (b"POST /webhook HTTP/1.1\r\nX-Long: " + b"a" * webhook.MAX_LINE_SIZE + b"\r\n\r\n", 431),
+        (b"POST /webhook HTTP/1.1\r\n" + b"X-Many: a\r\n" * (webhook.MAX_HEADERS + 1) + b"\r\n", 431),
+        (b"POST /" + b"a" * webhook.MAX_LINE_SIZE + b" HTTP/1.1\r\n\r\n", 414),
+        (b"garbage\r\n\r\n", 400),
+    ],
+)
+def test_malformed_requests_are_refused(request_head: bytes, status: int) -> None:
+    assert asyncio.run(send_raw(request_head)) == (status, True)
+
+
+def test_headers_up_to_the_limit_are_taken() -> None:
+    headers: bytes = b"X-Many: a\r\n" * (webhook.MAX_HEADERS - 1) + b"Connection: close\r\n"
+    assert asyncio.run(send_raw(b"GET /nowhere HTTP/1.1\r\n" + headers + b"\r\n")) == (404, True)
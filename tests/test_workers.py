@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+import asyncio
+import datetime
+import sys
+from pathlib import Path
+
+import pytest
+from telegram import Chat, Message, Update
+from telegram.ext import Application, ApplicationBuilder
+
+from tgbot_python_v2.util import workers
+from tgbot_python_v2.util.workers import WorkerPool
+
+# Stands in for a worker: the first one handles one update and crashes on the second, the one
+# started in its place records and handles what it is given
+WORKER: str = """
+import json, os, sys
+from pathlib import Path
+
+acks = os.fdopen(int(os.environ["TGBOT_WORKER_ACK_FD"]), "w", buffering=1)
+crashed = Path(sys.argv[1], "crashed")
+for line in sys.stdin:
+    update_id = json.loads(line)["update_id"]
+    if not crashed.exists() and update_id == 2:
+        crashed.touch()
+        sys.exit(1)
+    with open(Path(sys.argv[1], "handled"), "a") as handled:
+        handled.write(f"{update_id}\\n")
+    acks.write(f"{update_id}\\n")
+"""
+
+
+def make_update(update_id: int) -> Update:
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(), Chat(1, Chat.PRIVATE)))
+
+
+def test_updates_of_a_crashed_worker_go_to_its_replacement(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["-c", WORKER, str(tmp_path)])
+    monkeypatch.setattr(workers, "RESPAWN_DELAY", 0)
+    handled: Path = tmp_path / "handled"
+
+    async def run() -> WorkerPool:
+        app: Application = ApplicationBuilder().token("123456:test-token").build()
+        pool: WorkerPool = WorkerPool(1)
+        await pool.start(app)
+        first_watcher: asyncio.Task = pool.watchers[0]
+        for update_id in (1, 2, 3):
+            await pool.route(make_update(update_id), None)
+        while not handled.exists() or handled.read_text().split() != ["1", "2", "3"]:
+            await asyncio.sleep(0.01)
+        while pool.unacked[0]:
+            await asyncio.sleep(0.01)
+
+        assert first_watcher.done()
+        assert pool.watchers[0] is not first_watcher
+        await pool.stop(app)
+        return pool
+
+    pool: WorkerPool = asyncio.run(asyncio.wait_for(run(), 10))
+    assert len(pool.watchers) == 1
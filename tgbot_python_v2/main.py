@@ -16,26 +16,42 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
+import asyncio
 import logging
 import os
+import sys
 import time
-from importlib import import_module
 from pathlib import Path
 
 import tgbot_python_v2.util.logging
-from tgbot_python_v2 import MODULE_DIR
-from tgbot_python_v2.util.module import ModuleMetadata
+from tgbot_python_v2.util.config import flush_configs, load_configs, unwatch_configs, watch_configs
+from tgbot_python_v2.util.loader import (
+    LAZY_MODULES,
+    commands_synced,
+    load_modules,
+    log_timing_report,
+    mark_commands_synced,
+    write_cache,
+)
+from tgbot_python_v2.util.metrics import start_export, stop_export
+from tgbot_python_v2.util.scheduler import SCHEDULER_CONCURRENCY, SCHEDULER_MAX_PENDING, ChatScheduler
+from tgbot_python_v2.util.serving import restart, run
+from tgbot_python_v2.util.tracing import STATS_INTERVAL, TRACE_ENABLED, TracedApplication, TracedRequest, report_stats
+from tgbot_python_v2.util.watchdog import start_watchdog, stop_watchdog
+from tgbot_python_v2.util.workers import IS_INTAKE, IS_WORKER, WORKER_INDEX, WorkerPool
 
 log = logging.getLogger(__name__)
 
 from telegram import Update
-from telegram.error import TimedOut
+from telegram.error import TelegramError, TimedOut
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackContext,
     CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
@@ -47,6 +63,16 @@ except ImportError:
         raise RuntimeError("Cannot get bot token either from api_token file or environment variable.")
 Path(".token").write_text(TOKEN)
 
+if IS_INTAKE:
+    # Only receive updates and hand them to the worker processes, which load the modules
+    pool: WorkerPool = WorkerPool()
+    app = ApplicationBuilder().token(TOKEN).post_init(pool.start).post_stop(pool.stop).build()
+    app.add_handler(TypeHandler(Update, pool.route))
+    run(app)
+    if pool.restart_requested:
+        restart()
+    sys.exit(0)
+
 from tgbot_python_v2.util.help import Help
 
 log.info("Starting bot startup timer")
@@ -59,7 +85,82 @@ import tgbot_python_v2.modules.updater
 # import tgbot_python_v2.modules.moderation       # /ban, /kick, etc
 # import tgbot_python_v2.modules.komaru           # Pranaya's komaru GIFs channel management
 
-app = ApplicationBuilder().token(TOKEN).post_init(tgbot_python_v2.modules.updater.finish_update).build()
+
+async def update_bot_commands(application: Application) -> None:
+    """After the modules registered their help, we can update telegram commands and description."""
+    if commands_synced():
+        log.info("Bot commands did not change since the last update, skipping")
+        return
+    if not Help.cmd_update_pending:
+        return
+
+    log.info("Updating bot commands...")
+    try:
+        await Help.update_bot_cmd(application.bot)
+    except TimedOut:
+        # Retry one more time because railway moment
+        try:
+            await Help.update_bot_cmd(application.bot)
+        except TimedOut as e:
+            log.error(f"Failed to update bot command, cause: {e}")
+            return
+    except TelegramError as e:
+        log.error(f"Failed to update bot command, cause: {e}")
+        return
+
+    log.info("Command update successful")
+    mark_commands_synced()
+    await asyncio.to_thread(write_cache)
+
+
+commands_task: asyncio.Task | None = None
+stats_task: asyncio.Task | None = None
+
+
+async def post_init(application: Application) -> None:
+    global commands_task, stats_task
+
+    watch_configs()
+    # Updates are only received once this returns
+    await load_configs()
+    await start_export()
+    start_watchdog()
+    if TRACE_ENABLED and STATS_INTERVAL:
+        stats_task = asyncio.create_task(report_stats(), name="report_stats")
+    if WORKER_INDEX:
+        # Worker 0 takes care of these for every worker
+        return
+
+    # Receiving updates does not need to wait for the command list to be sent. The application is
+    # not running yet, so Application.create_task() would not keep track of the task.
+    commands_task = asyncio.create_task(update_bot_commands(application), name="update_bot_commands")
+    await tgbot_python_v2.modules.updater.finish_update(application)
+
+
+async def post_stop(application: Application) -> None:
+    # Updates already taken from Telegram are not fetched again, handle them while the bot still works
+    if isinstance(application.update_processor, ChatScheduler):
+        await application.update_processor.drain()
+    await flush_configs()
+    unwatch_configs()
+    if stats_task is not None:
+        stats_task.cancel()
+    stop_watchdog()
+    await stop_export()
+
+
+builder: ApplicationBuilder = ApplicationBuilder().token(TOKEN).post_init(post_init).post_stop(post_stop)
+if SCHEDULER_CONCURRENCY:
+    # A full queue stops fetching updates until the scheduler catches up
+    builder.update_queue(asyncio.Queue(SCHEDULER_MAX_PENDING)).concurrent_updates(ChatScheduler())
+if IS_WORKER:
+    # Updates come from the intake process
+    builder.updater(None)
+# Same pool size as ApplicationBuilder's default request
+builder.request(TracedRequest(connection_pool_size=256))
+if TRACE_ENABLED:
+    builder.application_class(TracedApplication)
+app = builder.build()
 
 
 async def callback(update: Update, context: CallbackContext) -> None:
@@ -69,54 +170,16 @@ async def callback(update: Update, context: CallbackContext) -> None:
 app.add_handler(
     CallbackQueryHandler(
         callback,
-        pattern=lambda data: data == f"{modules.updater.name}:confirm_update",
+        pattern=lambda data: data == f"{tgbot_python_v2.modules.updater.name}:confirm_update",
         block=False,
     )
 )
 
 # Load modules
-mdls = tuple(Path(f"{MODULE_DIR}/modules").glob("*.py"))
-log.info(f"Modules found: {mdls}")
-for mdl in mdls:
-    try:
-        mod: object = import_module("tgbot_python_v2.modules." + mdl.name.removesuffix(".py"))
-    except Exception as e:
-        log.error(f"failed to import module '{mdl.name}', it will not be loaded at all.")
-        log.error(f"error was: {e}")
-        continue
-
-    log.info(f"Loading module '{mdl}'")
-    if not getattr(mod, "ModuleMetadata", None):
-        log.error(f"Failure loading module '{mdl}', ModuleMetadata not detected.")
-        continue
-
-    if not issubclass(mod.ModuleMetadata, ModuleMetadata):
-        log.error(f"ModuleMetadata of module '{mdl}' is not a subclass of tgbot_python_v2.util.module.ModuleMetadata")
-        log.error(f"Refusing to load module '{mdl}'")
-        continue
-
-    log.debug(f"Running setup_module() for module '{mdl}'")
-    try:
-        mod.ModuleMetadata.setup_module(app)
-        log.debug("setup_module() finished.")
-    except Exception as e:
-        log.warning(f"Error while running setup_module() for module '{mdl}', module may not work properly.")
-        log.warning(f"More info: {e}")
-
-
-# After these modules registers their help, we can update telegram commands and description.
-log.info("Updating bot commands...")
-if Help.cmd_update_pending:
-    try:
-        Help.update_bot_cmd()
-        log.info("Command update successful")
-    except TimedOut:
-        # Retry one more time because railway moment
-        try:
-            Help.update_bot_cmd()
-            log.info("Command update successful")
-        except TimedOut as e:
-            log.error(f"Failed to update bot command, cause: {e}")
-
+loaded = load_modules(app)
+log_timing_report(loaded)
+# Without lazy modules only synced_commands is read back, which is written when it changes
+if LAZY_MODULES and not WORKER_INDEX:
+    write_cache()
 log.info(f"Bot startup took {(time.time() - import_start_time):.1f}s")
-app.run_polling()
+run(app)
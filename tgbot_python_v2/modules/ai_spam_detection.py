@@ -27,6 +27,7 @@ from telegram.ext import Application, ContextTypes, JobQueue, MessageHandler, Co
 
 import tgbot_python_v2.util.module
 from tgbot_python_v2.modules.rm6785 import RM6785_MASTER_USER
+from tgbot_python_v2.util import routing
 
 log: logging.Logger = logging.getLogger(__name__)
 
@@ -80,7 +81,9 @@ class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
 
         model = genai.GenerativeModel(model_name="gemini-2.0-flash-exp", generation_config=generation_config)
 
-        app.add_handler(MessageHandler(filters.TEXT | filters.CAPTION, on_message, block=False), group=3)
+        routing.add_handler(
+            app, MessageHandler(filters.TEXT | filters.CAPTION, on_message, block=False), GROUP_WHITELISTS, group=3
+        )
         app.add_handler(CommandHandler("getconfidencethreshold", get_confidence_rate_threshold, block=False))
         app.add_handler(CommandHandler("setconfidencethreshold", set_confidence_rate_threshold, block=False))
 
@@ -109,10 +112,6 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     else:
         text: str = update.message.text
 
-    if update.message.chat_id not in GROUP_WHITELISTS:
-        log.info(f"chat with id {update.message.chat_id} not in whitelist")
-        return
-
     log.info(f"got message: '{text}'")
     log.info(f"from chat: {update.message.chat_id}")
     if len(text.split(" ")) <= 3:
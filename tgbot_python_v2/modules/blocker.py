@@ -30,16 +30,12 @@ from telegram.ext import (
 
 import tgbot_python_v2.util.module
 from tgbot_python_v2.modules.rm6785 import RM6785_MASTER_USER
-from tgbot_python_v2.util.config import Config
+from tgbot_python_v2.util.config import Config, SqliteConfig
 from tgbot_python_v2.util.help import Help
 
 log: logging.Logger = logging.getLogger(__name__)
 
-config: Config = Config("sticker-blocklist.json")
-if config.config.get("blocklist") is None:
-    config.config["blocklist"] = []
-if config.config.get("gif_blocklist") is None:
-    config.config["gif_blocklist"] = []
+config: Config = SqliteConfig("sticker-blocklist.json", defaults={"blocklist": [], "gif_blocklist": []})
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -88,21 +84,20 @@ async def block_unblock(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text("Not a sticker.")
         return
 
-    if re.match(r"^/unblock", update.message.text):
-        if update.message.reply_to_message.sticker.set_name in config.config["blocklist"]:
-            config.config["blocklist"].remove(update.message.reply_to_message.sticker.set_name)
-            await update.message.reply_text("Blocklist updated.")
-        else:
-            await update.message.reply_text("Not in blocklist.")
+    async with config.transaction("blocklist") as data:
+        if re.match(r"^/unblock", update.message.text):
+            if update.message.reply_to_message.sticker.set_name in data["blocklist"]:
+                data["blocklist"].remove(update.message.reply_to_message.sticker.set_name)
+                await update.message.reply_text("Blocklist updated.")
+            else:
+                await update.message.reply_text("Not in blocklist.")
 
-    elif re.match(r"^/block", update.message.text):
-        if update.message.reply_to_message.sticker.set_name in config.config["blocklist"]:
-            await update.message.reply_text("Sticker already in blacklist.")
-        else:
-            config.config["blocklist"].append(update.message.reply_to_message.sticker.set_name)
-            await update.message.reply_text("Blocklist updated.")
-
-    config.write_config()
+        elif re.match(r"^/block", update.message.text):
+            if update.message.reply_to_message.sticker.set_name in data["blocklist"]:
+                await update.message.reply_text("Sticker already in blacklist.")
+            else:
+                data["blocklist"].append(update.message.reply_to_message.sticker.set_name)
+                await update.message.reply_text("Blocklist updated.")
 
 
 async def gblock_gunblock(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -118,21 +113,20 @@ async def gblock_gunblock(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Not a gif.")
         return
 
-    if re.match(r"^/gunblock", update.message.text):
-        if update.message.reply_to_message.animation.file_unique_id in config.config["gif_blocklist"]:
-            config.config["gif_blocklist"].remove(update.message.reply_to_message.animation.file_unique_id)
-            await update.message.reply_text("Blocklist updated.")
-        else:
-            await update.message.reply_text("Not in blocklist.")
-
-    elif re.match(r"^/gblock", update.message.text):
-        if update.message.reply_to_message.animation.file_unique_id in config.config["gif_blocklist"]:
-            await update.message.reply_text("Gif already in blocklist.")
-        else:
-            config.config["gif_blocklist"].append(update.message.reply_to_message.animation.file_unique_id)
-            await update.message.reply_text("Blocklist updated.")
-
-    config.write_config()
+    async with config.transaction("gif_blocklist") as data:
+        if re.match(r"^/gunblock", update.message.text):
+            if update.message.reply_to_message.animation.file_unique_id in data["gif_blocklist"]:
+                data["gif_blocklist"].remove(update.message.reply_to_message.animation.file_unique_id)
+                await update.message.reply_text("Blocklist updated.")
+            else:
+                await update.message.reply_text("Not in blocklist.")
+
+        elif re.match(r"^/gblock", update.message.text):
+            if update.message.reply_to_message.animation.file_unique_id in data["gif_blocklist"]:
+                await update.message.reply_text("Gif already in blocklist.")
+            else:
+                data["gif_blocklist"].append(update.message.reply_to_message.animation.file_unique_id)
+                await update.message.reply_text("Blocklist updated.")
 
 
 async def list_blocklist(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
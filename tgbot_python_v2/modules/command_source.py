@@ -22,6 +22,7 @@ from telegram.helpers import escape_markdown
 
 from tgbot_python_v2.util import module
 from tgbot_python_v2.util.help import Help
+from tgbot_python_v2.util.loader import load_command
 
 
 class ModuleMetadata(module.ModuleMetadata):
@@ -36,6 +37,8 @@ async def get_command_source(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     target_command = context.args[0]
+    # A lazily loaded module only has a stub registered until it is imported
+    await load_command(context.application, target_command)
 
     handlers_dict: dict[BaseHandler, list[BaseHandler]] = context.application.handlers
     for handlers in handlers_dict.values():
@@ -19,10 +19,14 @@ Module to send message with help strings when requested.
 Available methods:
 
     bot_help(update, context):
-        Sends help message.
+        Sends the first page of the help message.
+
+    callback_handler(update, context):
+        Shows another page of the help message.
 """
 
 import logging
+import re
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
@@ -47,44 +51,52 @@ class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
             CallbackQueryHandler(
                 callback_handler,
                 block=False,
-                pattern=lambda data: data in [f"{__name__}:shrink", f"{__name__}:expand"],
+                # shrink and expand are the buttons of help messages sent before there were pages
+                pattern=rf"^{re.escape(__name__)}:(page:\d+|shrink|expand)$",
             )
         )
 
 
+# Help.version the pages were built for, and each page's text and buttons
+pages: tuple[int, tuple[tuple[str, InlineKeyboardMarkup | None], ...]] | None = None
+
+
+def get_pages() -> tuple[tuple[str, InlineKeyboardMarkup | None], ...]:
+    global pages
+
+    if pages is not None and pages[0] == Help.version:
+        return pages[1]
+
+    texts: tuple[str, ...] = Help.get_help_pages()
+    built: list[tuple[str, InlineKeyboardMarkup | None]] = []
+    for index, text in enumerate(texts):
+        if len(texts) == 1:
+            built.append((text, None))
+            continue
+
+        buttons: list[InlineKeyboardButton] = []
+        if index > 0:
+            buttons.append(InlineKeyboardButton("« Previous", callback_data=f"{__name__}:page:{index - 1}"))
+        if index < len(texts) - 1:
+            buttons.append(InlineKeyboardButton("Next »", callback_data=f"{__name__}:page:{index + 1}"))
+        built.append((f"{text}\n[page {index + 1}/{len(texts)}]", InlineKeyboardMarkup([buttons])))
+
+    pages = (Help.version, tuple(built))
+    return pages[1]
+
+
 async def callback_handler(update: Update, context: CallbackContext):
     log.info(f"Callback data received: {update.callback_query.data}")
-    if update.callback_query.data not in [f"{__name__}:expand", f"{__name__}:shrink"]:
-        return
-
-    if update.callback_query.data == f"{__name__}:expand":
-        markup: InlineKeyboardMarkup = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Shrink help", callback_data=f"{__name__}:shrink")]]
-        )
-        await update.callback_query.edit_message_text(Help.get_help(), reply_markup=markup)
-    elif update.callback_query.data == f"{__name__}:shrink":
-        markup: InlineKeyboardMarkup = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Expand help", callback_data=f"{__name__}:expand")]]
-        )
-        await update.callback_query.edit_message_text(
-            "\n".join(Help.get_help().split("\n")[0:5]) + "\n[..more]",
-            reply_markup=markup,
-        )
-    else:
-        raise ValueError(f"'{update.callback_query.data}' was not expected here")
+    page: str = update.callback_query.data.rpartition(":")[2]
+    texts: tuple[tuple[str, InlineKeyboardMarkup | None], ...] = get_pages()
+    # Buttons of an older help message may point past the last page
+    text, markup = texts[min(int(page), len(texts) - 1) if page.isdigit() else 0]
+    await update.callback_query.edit_message_text(text, reply_markup=markup)
 
 
 async def bot_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if len(Help.get_help().split("\n")) > 5:
-        markup: InlineKeyboardMarkup = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Expand help", callback_data=f"{__name__}:expand")]]
-        )
-        await update.message.reply_text(
-            "\n".join(Help.get_help().split("\n")[0:5]) + "\n[..more]",
-            reply_markup=markup,
-        )
-    else:
-        await update.message.reply_text(Help.get_help())
+    text, markup = get_pages()[0]
+    await update.message.reply_text(text, reply_markup=markup)
 
 
 Help.register_help("help", "Show help message.")
@@ -28,7 +28,8 @@ from telegram.ext import (
 )
 
 import tgbot_python_v2.util.module
-from tgbot_python_v2.util.config import Config
+from tgbot_python_v2.util import routing
+from tgbot_python_v2.util.config import Config, SqliteConfig
 from tgbot_python_v2.util.help import Help
 
 LISTEN_MODE: bool = False
@@ -47,24 +48,25 @@ log: logging.Logger = logging.getLogger(__name__)
 # "file_unique_id": {"file_id": id, trigger_keywords: [keyword, keyword, keyword]},
 # "file_unique_id": {"file_id": id, trigger_keywords: [keyword, keyword, keyword]}
 # }
-config_db: Config = Config("komaru.json")
+
+
+def migrate_gifs(gifs: dict) -> None:
+    """Migrate to the new json structure"""
+    for key, value in gifs.items():
+        if type(value) is str:
+            log.info(f"Migrating komaru gif '{key}' to new json structure")
+            gifs[key] = {
+                "file_id": value,
+                "trigger_keywords": [],
+            }
+
+
+config_db: Config = SqliteConfig("komaru.json", on_load=migrate_gifs)
 # expected json structure:
 # {
 # "trigger_chat_whitelist": [chat_id, chat_id, chat_id]
 # }
-config: Config = Config("komaru-config.json")
-
-if not config.config.get("trigger_chat_whitelist"):
-    config.config["trigger_chat_whitelist"] = []
-
-# Migrate to the new json structure
-for key in config_db.config.keys():
-    if type(config_db.config[key]) is str:
-        log.info(f"Migrating komaru gif '{key}' to new json structure")
-        config_db.config[key] = {
-            "file_id": config_db.config[key],
-            "trigger_keywords": [],
-        }
+config: Config = Config("komaru-config.json", defaults={"trigger_chat_whitelist": []})
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -80,7 +82,7 @@ class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
         app.add_handler(CommandHandler("listtrigger", listtrigger, block=False))
         app.add_handler(CommandHandler("komaru", komaru_random, block=False))
         app.add_handler(MessageHandler(filters.ANIMATION, komaru_listener, block=False))
-        app.add_handler(MessageHandler(filters.TEXT, trigger_handler, block=False), group=1)
+        routing.add_handler(app, trigger, config.config["trigger_chat_whitelist"], group=1)
 
 
 async def update_komaru(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -159,6 +161,8 @@ async def whitelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     config.config["trigger_chat_whitelist"].append(update.message.chat_id)
+    config.write_config()
+    routing.add_chat(trigger, update.message.chat_id)
     await update.message.reply_text("Whitelisted")
 
 
@@ -172,6 +176,8 @@ async def unwhitelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     config.config["trigger_chat_whitelist"].remove(update.message.chat_id)
+    config.write_config()
+    routing.remove_chat(trigger, update.message.chat_id)
     await update.message.reply_text("Unwhitelisted")
 
 
@@ -197,13 +203,13 @@ async def addtrigger(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     errors: list[str] = []
-    for keyword in context.args:
-        if keyword in config_db.config[update.message.reply_to_message.animation.file_unique_id]["trigger_keywords"]:
-            errors.append(f"Keyword '{keyword}' already exists")
-        else:
-            config_db.config[update.message.reply_to_message.animation.file_unique_id]["trigger_keywords"].append(
-                keyword
-            )
+    key: str = update.message.reply_to_message.animation.file_unique_id
+    async with config_db.transaction(key) as gifs:
+        for keyword in context.args:
+            if keyword in gifs[key]["trigger_keywords"]:
+                errors.append(f"Keyword '{keyword}' already exists")
+            else:
+                gifs[key]["trigger_keywords"].append(keyword)
 
     if len(errors) > 0:
         joint: str = "\n".join(errors)
@@ -234,13 +240,13 @@ async def removetrigger(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     errors: list[str] = []
-    for keyword in context.args:
-        if keyword in config_db.config[update.message.reply_to_message.animation.file_unique_id]["trigger_keywords"]:
-            config_db.config[update.message.reply_to_message.animation.file_unique_id]["trigger_keywords"].remove(
-                keyword
-            )
-        else:
-            errors.append(f"Keyword '{keyword}' does not exist")
+    key: str = update.message.reply_to_message.animation.file_unique_id
+    async with config_db.transaction(key) as gifs:
+        for keyword in context.args:
+            if keyword in gifs[key]["trigger_keywords"]:
+                gifs[key]["trigger_keywords"].remove(keyword)
+            else:
+                errors.append(f"Keyword '{keyword}' does not exist")
 
     if len(errors) > 0:
         joint: str = "\n".join(errors)
@@ -267,9 +273,6 @@ async def listtrigger(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def trigger_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.chat_id not in config.config["trigger_chat_whitelist"]:
-        return
-
     for value in config_db.config.values():
         for keyword in value["trigger_keywords"]:
             if keyword.lower() in update.message.text.lower():
@@ -280,6 +283,10 @@ async def trigger_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
 
+# Only tried in whitelisted chats, kept up to date by /whitelist and /unwhitelist
+trigger: MessageHandler = MessageHandler(filters.TEXT, trigger_handler, block=False)
+
+
 async def komaru_random(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.reply_to_message:
         await update.message.reply_animation(config_db.config[random.choice(tuple(config_db.config.keys()))]["file_id"])
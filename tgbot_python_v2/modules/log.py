@@ -14,8 +14,34 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
+"""
+Module to send the bot's log file.
+Available methods:
+
+    get_log(update, context)
+        Send the log file, or a part of it. Arguments: tail N, since TIME, gz. Logs larger than
+        GZIP_ABOVE are always compressed.
+
+    LogIndex(path)
+        Find where the lines written since a given time start in the log file.
+
+    redact(chunks, secrets)
+        Replace secrets in a stream of chunks, also where a secret is split between two chunks.
+"""
+
+import asyncio
+import bisect
+import datetime
+import gzip
+import io
 import logging
+import os
+import re
+import tempfile
+import threading
+from collections.abc import Iterable, Iterator
 from pathlib import Path
+from urllib.parse import quote
 
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
@@ -23,9 +49,23 @@ from telegram.ext import Application, CommandHandler, ContextTypes
 import tgbot_python_v2.util.module
 from tgbot_python_v2.modules.rm6785 import RM6785_MASTER_USER
 from tgbot_python_v2.util.help import Help
+from tgbot_python_v2.util.logging import LOG_FILE
 
 log: logging.Logger = logging.getLogger(__name__)
-TOKEN: str = Path(".token").read_text()
+TOKEN: str = Path(".token").read_text().strip()
+# The token as it appears in the log, e.g. in request URLs
+SECRETS: list[bytes] = [secret.encode() for secret in {TOKEN, quote(TOKEN, safe="")}]
+REDACTED: bytes = b"[token redacted]"
+CHUNK_SIZE: int = 1024 * 1024
+# Bytes of log covered by one entry of LogIndex
+INDEX_BLOCK: int = 64 * 1024
+# Logs larger than this are sent compressed even without gz
+GZIP_ABOVE: int = 5 * 1024 * 1024
+# Telegram refuses larger documents from bots
+MAX_UPLOAD: int = 50 * 1024 * 1024
+# The log being sent is kept in memory up to this size, and in a temporary file beyond
+SPOOL_SIZE: int = 8 * 1024 * 1024
+USAGE: str = "Usage: /getlog [tail N | since TIME] [gz]\nTIME is e.g. 2h, 30m, 14:00 or 2024-12-31 14:00"
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -34,26 +74,199 @@ class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
         app.add_handler(CommandHandler("getlog", get_log, block=False))
 
 
+def _line_time(line: bytes) -> float | None:
+    """Time of a log line, None for lines without one (e.g. a traceback)."""
+    try:
+        return datetime.datetime.fromisoformat(line[:19].decode()).timestamp()
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+class LogIndex:
+    """Time and offset of the first line in every INDEX_BLOCK bytes of the log, so that finding
+    where a time starts only reads one block. Extended as the log grows, rebuilt once it was
+    rotated."""
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.inode: int | None = None
+        self.times: list[float] = []
+        self.offsets: list[int] = []
+        # Start of the next block to index
+        self.indexed_to: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def _update(self, log_file: io.BufferedReader, size: int) -> None:
+        inode: int = os.fstat(log_file.fileno()).st_ino
+        if inode != self.inode or size < self.indexed_to:
+            self.inode = inode
+            self.times, self.offsets, self.indexed_to = [], [], 0
+
+        while self.indexed_to < size:
+            log_file.seek(self.indexed_to)
+            if self.indexed_to:
+                # Skip the rest of the line the block starts in
+                log_file.readline()
+            while (offset := log_file.tell()) < size:
+                line: bytes = log_file.readline()
+                if not line.endswith(b"\n"):
+                    # Still being written, try again next time
+                    return
+                if (line_time := _line_time(line)) is not None:
+                    self.times.append(line_time)
+                    self.offsets.append(offset)
+                    break
+            self.indexed_to += INDEX_BLOCK
+
+    def offset_since(self, log_file: io.BufferedReader, size: int, since: float) -> int:
+        """Offset of the first line written at or after since, or size if there is none."""
+        with self.lock:
+            self._update(log_file, size)
+            # Start from the last indexed line before since, the line searched for is in that block
+            block: int = bisect.bisect_left(self.times, since) - 1
+            offset: int = self.offsets[block] if block >= 0 else 0
+
+        log_file.seek(offset)
+        while offset < size:
+            line: bytes = log_file.readline()
+            if (line_time := _line_time(line)) is not None and line_time >= since:
+                return offset
+            offset += len(line)
+        return size
+
+
+def offset_tail(log_file: io.BufferedReader, size: int, lines: int) -> int:
+    """Offset of the start of the last lines lines."""
+    offset: int = size
+    # The last line ends with a newline, which does not start another line
+    newlines: int = -1
+    while offset > 0:
+        start: int = max(offset - CHUNK_SIZE, 0)
+        log_file.seek(start)
+        chunk: bytes = log_file.read(offset - start)
+        position: int = len(chunk)
+        while (position := chunk.rfind(b"\n", 0, position)) != -1:
+            newlines += 1
+            if newlines == lines:
+                return start + position + 1
+        offset = start
+    return 0
+
+
+def read_chunks(log_file: io.BufferedReader, start: int, end: int) -> Iterator[bytes]:
+    log_file.seek(start)
+    while start < end and (chunk := log_file.read(min(CHUNK_SIZE, end - start))):
+        start += len(chunk)
+        yield chunk
+
+
+def redact(chunks: Iterable[bytes], secrets: list[bytes]) -> Iterator[bytes]:
+    """The last bytes of each chunk that may be the start of a secret are held back until the next
+    chunk shows whether they are."""
+    keep: int = max(len(secret) for secret in secrets) - 1
+    held: bytes = b""
+    for chunk in chunks:
+        data: bytes = held + chunk
+        cut: int = max(len(data) - keep, 0)
+        for secret in secrets:
+            # A secret starting before the cut is complete in data, cut after it instead
+            start: int = data.rfind(secret, 0, cut - 1 + len(secret))
+            if start != -1:
+                cut = max(cut, start + len(secret))
+        yield _replace(data[:cut], secrets)
+        held = data[cut:]
+    yield _replace(held, secrets)
+
+
+def _replace(data: bytes, secrets: list[bytes]) -> bytes:
+    for secret in secrets:
+        data = data.replace(secret, REDACTED)
+    return data
+
+
+def parse_since(args: list[str]) -> float | None:
+    """Accepts a duration (2h, 30m, 1d), a time of today (14:00) or a date and time."""
+    text: str = " ".join(args)
+    if match := re.fullmatch(r"(\d+)([smhd])", text):
+        seconds: int = int(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+        return datetime.datetime.now().timestamp() - seconds
+    try:
+        return datetime.datetime.combine(datetime.date.today(), datetime.time.fromisoformat(text)).timestamp()
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+index: LogIndex = LogIndex(LOG_FILE)
+
+
+def build_log(tail: int | None, since: float | None, compress: bool) -> tuple[tempfile.SpooledTemporaryFile, bool]:
+    """Runs in a thread. The log is read in chunks and written to a file that only stays in
+    memory while it is small. Returns the file, rewound, and whether it is compressed, which it
+    is with compress or when more than GZIP_ABOVE bytes of log are sent."""
+    output: tempfile.SpooledTemporaryFile = tempfile.SpooledTemporaryFile(SPOOL_SIZE)  # noqa: SIM115 - the caller closes it
+    with open(LOG_FILE, "rb") as log_file:
+        # Lines written while this runs are left out
+        size: int = os.fstat(log_file.fileno()).st_size
+        start: int = 0
+        if tail is not None:
+            start = offset_tail(log_file, size, tail)
+        elif since is not None:
+            start = index.offset_since(log_file, size, since)
+
+        compress = compress or size - start > GZIP_ABOVE
+        if compress:
+            with gzip.GzipFile(fileobj=output, mode="wb") as sink:
+                sink.writelines(redact(read_chunks(log_file, start, size), SECRETS))
+        else:
+            output.writelines(redact(read_chunks(log_file, start, size), SECRETS))
+
+    output.seek(0)
+    return output, compress
+
+
 async def get_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    log_file: Path = Path("bot.log")
-    tmp_file: Path = Path("tmp.log")
+    # Allow only master users for retrieving logs
+    if update.message.from_user.id not in RM6785_MASTER_USER:
+        await update.message.reply_text("You're not allowed to do this")
+        return
 
     # Check if file exist
-    if not log_file.is_file():
+    if not Path(LOG_FILE).is_file():
         log.error("Log file does not exist")
         return
 
-    # Truncate token from log
-    tmp_file.write_text(log_file.read_text().replace(TOKEN, "[token redacted]"))
+    args: list[str] = list(context.args or [])
+    compress: bool = "gz" in args
+    if compress:
+        args.remove("gz")
 
-    # Allow only master users for retrieving logs
-    if update.message.from_user.id not in RM6785_MASTER_USER:
-        await update.message.reply_text("You're not allowed to do this")
+    tail: int | None = None
+    since: float | None = None
+    if args and args[0] == "tail" and len(args) == 2 and args[1].isdigit():
+        tail = int(args[1])
+    elif args and args[0] == "since" and (since := parse_since(args[1:])) is not None:
+        pass
+    elif args:
+        await update.message.reply_text(USAGE)
         return
 
-    await update.message.reply_document(tmp_file)
+    output, compressed = await asyncio.to_thread(build_log, tail, since, compress)
+    with output:
+        size: int = output.seek(0, os.SEEK_END)
+        output.seek(0)
+        if size > MAX_UPLOAD:
+            await update.message.reply_text(
+                f"The log is {size / 1024 / 1024:.0f} MB{' compressed' if compressed else ''}, Telegram takes "
+                f"{MAX_UPLOAD // 1024 // 1024} MB at most. Ask for a part of it with tail N or since TIME."
+            )
+            return
 
-    tmp_file.unlink()
+        name: str = f"{Path(LOG_FILE).name}.gz" if compressed else Path(LOG_FILE).name
+        await update.message.reply_document(output, filename=name)
 
 
-Help.register_help("getlog", "Retrieve bot log")
+Help.register_help("getlog", "Retrieve bot log, optionally: tail N, since TIME, gz")
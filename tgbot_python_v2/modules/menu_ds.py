@@ -33,7 +33,6 @@ from tgbot_python_v2.util.help import Help
 
 log: logging.Logger = logging.getLogger(__name__)
 config: Config = Config("menu_db.json")
-config.write_config()
 # Expected json structure
 # {"1": [file_id, unique_id]}
 
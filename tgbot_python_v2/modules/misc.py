@@ -31,11 +31,13 @@ from telegram.helpers import escape_markdown
 
 import tgbot_python_v2.util.module
 from tgbot_python_v2.modules.rm6785 import RM6785_CHANNEL_ID
+from tgbot_python_v2.util import routing
 from tgbot_python_v2.util.config import Config
 from tgbot_python_v2.util.help import Help
 
 main_log: logging.Logger = logging.getLogger(__file__)
 auto_forward_state: bool = False
+AUTO_FORWARD_CHAT_ID: int = -1001511914394
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -44,8 +46,12 @@ class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
         app.add_handler(CommandHandler("neofetch", neofetch, block=False))
         app.add_handler(CommandHandler("magisk", magisk, block=False))
         app.add_handler(CommandHandler("toggleautoforward", toggle_auto_forward, block=False))
-        app.add_handler(MessageHandler(filters.Regex(r"(?i)#Pratham"), auto_forward, block=False))
-        app.add_handler(MessageHandler(filters.ALL, tyagi_sanitizer, block=False), group=2)
+        routing.add_handler(
+            app, MessageHandler(filters.Regex(r"(?i)#Pratham"), auto_forward, block=False), [AUTO_FORWARD_CHAT_ID]
+        )
+        routing.add_handler(
+            app, MessageHandler(filters.ALL, tyagi_sanitizer, block=False), [RM6785_CHANNEL_ID], group=2
+        )
 
 
 async def neofetch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -83,25 +89,17 @@ async def toggle_auto_forward(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def auto_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log = main_log.getChild("auto_forward")
-    target_group_id: int = -1001511914394
     user_id = 1583181351
 
     if not auto_forward_state:
         log.info("Returning as auto-forward is disabled")
         return
 
-    if update.message.chat_id != target_group_id:
-        log.info("Not target chat, skip forwarding")
-        return
-
     await update.message.forward(user_id)
     await update.message.reply_text("Message forwarded to Pratham")
 
 
 async def tyagi_sanitizer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if update.effective_chat.id != RM6785_CHANNEL_ID:
-        return
-
     if update.channel_post.from_user.id == 712305133:
         await update.channel_post.delete()
 
@@ -17,6 +17,7 @@
 import logging
 import os
 import time
+from functools import wraps
 
 from openai import AsyncOpenAI
 from telegram import Update
@@ -50,14 +51,11 @@ if not API_KEY_OK:
     log.error("Cannot get OpenAI api key; module will be disabled.")
 
 aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
-config: Config = Config("openai.json")
-
-if not config.config.get(RESTRICTED_CHATS_KEY):
-    config.config[RESTRICTED_CHATS_KEY] = {}
-    config.write_config()
+config: Config = Config("openai.json", defaults={RESTRICTED_CHATS_KEY: {}})
 
 
 def check_key(function):
+    @wraps(function)
     async def wrapper(*arg, **kwargs):
         if API_KEY_OK:
             await function(*arg, **kwargs)
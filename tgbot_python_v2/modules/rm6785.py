@@ -43,6 +43,7 @@ Available methods:
 import json
 import logging
 import re
+from functools import wraps
 
 from telegram import Message, MessageId, Update
 from telegram.ext import (
@@ -54,11 +55,11 @@ from telegram.ext import (
 )
 
 import tgbot_python_v2.util.module
-from tgbot_python_v2.util.config import Config
+from tgbot_python_v2.util.config import Config, JournalConfig
 from tgbot_python_v2.util.help import Help
 
 log: logging.Logger = logging.getLogger(__name__)
-config: Config = Config("rm6785_config.json")
+config: Config = JournalConfig("rm6785_config.json", defaults={"authorized_users": []})
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -99,16 +100,12 @@ REALME6_GROUP_ID: int = -1001309495065
 REALME6_ADMIN_GROUP_ID: int = -1001596458040
 
 
-if config.config.get("authorized_users") is None:
-    config.config["authorized_users"] = []
-    config.write_config()
-
-
 # Decorator hell indeed
 def check(count_init=False, reply_init=False):
     def decorator(func):
         """Common checks for most RM6785's methods."""
 
+        @wraps(func)
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Make sure we're in rm6785 chat
             if update.effective_chat.id != RM6785_DEVELOPMENT_CHAT_ID:
@@ -121,20 +118,17 @@ def check(count_init=False, reply_init=False):
                 await update.message.reply_text("You are not authorized to use this command.")
                 return
 
-            count: int = 0
             if reply_init:
                 if update.message.reply_to_message is None:
                     await update.message.reply_text("You must reply to a message.")
                     return
 
                 if count_init:
-                    try:
-                        count: int = config.config[str(update.message.reply_to_message.message_id)]
-                    except KeyError:
-                        pass
+                    key: str = str(update.message.reply_to_message.message_id)
+                    # Keep other commands on the same message from changing the count until this one is done
+                    async with config.transaction(key) as data:
+                        return await func(update, context, data.get(key, 0))
 
-            if reply_init and count_init:
-                return await func(update, context, count)
             return await func(update, context)
 
         return wrapper
@@ -147,7 +141,6 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE, count) ->
     if count < 2:
         count += 1
         config.config[str(update.message.reply_to_message.message_id)] = count
-        config.write_config()
         await update.message.reply_text(f"Approved. count: {count}")
     else:
         await update.message.reply_text("Message already have enough approval!")
@@ -157,7 +150,6 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE, count) ->
 async def disapprove(update: Update, context: ContextTypes.DEFAULT_TYPE, count) -> None:
     count -= 1
     config.config[str(update.message.reply_to_message.message_id)] = count
-    config.write_config()
     await update.message.reply_text(f"Disapproved. count: {count}")
 
 
@@ -173,7 +165,6 @@ async def post(update: Update, context: ContextTypes.DEFAULT_TYPE, count) -> Non
     await result.get_bot().pin_chat_message(RM6785_CHAT_ID, result.message_id)
 
     del config.config[str(update.message.reply_to_message.message_id)]
-    config.write_config()
     await message.edit_text("Posted")
 
 
@@ -255,10 +246,8 @@ async def loadconfig(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text("Invalid JSON.")
         return
 
-    with open(config.file, "w") as f:
-        json.dump(json.loads(update.message.reply_to_message.text), f)
-
-    config.read_config()
+    config.config = json.loads(update.message.reply_to_message.text)
+    config.write_config()
     await update.message.reply_text("New config loaded")
 
 
@@ -29,6 +29,7 @@ from telegram.ext import Application, ContextTypes, MessageHandler, filters
 
 import tgbot_python_v2.util.module as module
 from tgbot_python_v2.modules.rm6785 import RM6785_DEVELOPMENT_CHAT_ID
+from tgbot_python_v2.util import routing
 
 log: logging.Logger = logging.getLogger(__name__)
 
@@ -63,7 +64,9 @@ def extract_expdb(expdb, out) -> tuple[bool, Exception | None]:
 class ModuleMetadata(module.ModuleMetadata):
     @classmethod
     def setup_module(cls, app: Application):
-        app.add_handler(MessageHandler(filters.Document.ALL, expdbreader, block=False))
+        routing.add_handler(
+            app, MessageHandler(filters.Document.ALL, expdbreader, block=False), [RM6785_DEVELOPMENT_CHAT_ID]
+        )
 
 
 async def expdbreader(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -78,8 +81,6 @@ async def expdbreader(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if not re.match(r"expdb.*", update.message.document.file_name):
         return
-    if update.effective_chat.id != RM6785_DEVELOPMENT_CHAT_ID:
-        return
 
     # Download the file
     with NamedTemporaryFile() as expdb_tempf, NamedTemporaryFile() as out_tempf:
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Module to show how long handlers take, see util/tracing.py.
+Available methods:
+
+    stats(update, context)
+        Send the latency of whole updates, of the slowest handlers and of every module, and the
+        handlers that blocked the event loop.
+"""
+
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+import tgbot_python_v2.util.module
+from tgbot_python_v2.modules.rm6785 import RM6785_MASTER_USER
+from tgbot_python_v2.util import metrics, tracing
+from tgbot_python_v2.util.help import Help
+
+log: logging.Logger = logging.getLogger(__name__)
+SLOWEST_HANDLERS: int = 10
+
+
+class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
+    @classmethod
+    def setup_module(cls, app: Application):
+        app.add_handler(CommandHandler("stats", stats, block=False))
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.message.from_user.id not in RM6785_MASTER_USER:
+        await update.message.reply_text("You're not allowed to do this")
+        return
+
+    now: float = time.monotonic()
+    # Modules that were busy the longest first
+    modules: list[tuple[str, tracing.HandlerStats]] = sorted(
+        tracing.module_stats.items(), key=lambda item: item[1].total.time(now), reverse=True
+    )
+    lines: list[str] = [f"Last {tracing.STATS_WINDOW / 60:.0f} minutes, pid {os.getpid()}"]
+    if tracing.TRACE_ENABLED:
+        lines += [
+            "",
+            tracing.describe("All updates", tracing.update_stats),
+            "",
+            "Slowest handlers (p95):",
+            *(tracing.describe(name, handler) for name, handler in tracing.worst(SLOWEST_HANDLERS)),
+            "",
+            "Modules:",
+            *(tracing.describe(name, module) for name, module in modules if module.total.count(now)),
+        ]
+    else:
+        lines += ["", "Tracing is turned off (TGBOT_TRACE=0)"]
+    if metrics.loop_stalls:
+        lines += ["", "Blocked the event loop (since startup):"]
+        lines += [
+            f"{culprit}: {count} times, {metrics.loop_blocked_seconds[culprit]:.1f}s"
+            for culprit, count in metrics.loop_stalls.most_common()
+        ]
+    if scheduler_stats := getattr(context.application.update_processor, "stats", None):
+        lines += ["", "Scheduler: " + ", ".join(f"{key} {value}" for key, value in scheduler_stats().items())]
+
+    await update.message.reply_text("\n".join(lines))
+
+
+Help.register_help("stats", "Show how long handlers take")
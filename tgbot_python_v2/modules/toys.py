@@ -40,7 +40,19 @@ from tgbot_python_v2.util.config import Config
 from tgbot_python_v2.util.help import Help
 
 log: logging.Logger = logging.getLogger(__name__)
-config: Config = Config("toys.json")
+DEFAULT_INSERT_WORDS: str = (
+    "bsdk chutiya bc arch fedora dnf pacman gay lesbian pranaya sharan nero bot cum coom bhai bro "
+    "pro max dick big based rui rui2 rui1 samarbot brainfuck inactive dead optimized lines amazing "
+    "updated changelog bugs lag adb shell ffs f2fs ext4 ipv6 komaru cute adorable boot rom recovery "
+    "docker micro rose miss sir exam pactice allow invite python poothon poopthon nodejs js hello "
+    "world development kit lint fuck fucking madarchod behenchod message maybe ping oof available "
+    "solution test goes order biggest problem though command root magisk superuser insta facebook "
+    "fuckbook twitter ot inr 69 vanilla gapps creampie admin link embed why removed knowing certain "
+    "funny bootloader boobloader unlocked uncocked kang kanger sagar java gawd god samar hakimi "
+    "mcdonald covid kick ban fart poop pee penis enlarge chup chutiye kek speaking always never los "
+    "aex realme oplus vooc dart rebrand rust with vast erofs guilty wrong yeet prath joemomma"
+)
+config: Config = Config("toys.json", defaults={"insert_words": DEFAULT_INSERT_WORDS.split(" ")})
 
 
 class ModuleMetadata(tgbot_python_v2.util.module.ModuleMetadata):
@@ -129,19 +141,7 @@ Help.register_help("shuffle", "Shuffle replied message.")
 
 
 def init_insert_words() -> None:
-    default_words: str = (
-        "bsdk chutiya bc arch fedora dnf pacman gay lesbian pranaya sharan nero bot cum coom bhai bro "
-        "pro max dick big based rui rui2 rui1 samarbot brainfuck inactive dead optimized lines amazing "
-        "updated changelog bugs lag adb shell ffs f2fs ext4 ipv6 komaru cute adorable boot rom recovery "
-        "docker micro rose miss sir exam pactice allow invite python poothon poopthon nodejs js hello "
-        "world development kit lint fuck fucking madarchod behenchod message maybe ping oof available "
-        "solution test goes order biggest problem though command root magisk superuser insta facebook "
-        "fuckbook twitter ot inr 69 vanilla gapps creampie admin link embed why removed knowing certain "
-        "funny bootloader boobloader unlocked uncocked kang kanger sagar java gawd god samar hakimi "
-        "mcdonald covid kick ban fart poop pee penis enlarge chup chutiye kek speaking always never los "
-        "aex realme oplus vooc dart rebrand rust with vast erofs guilty wrong yeet prath joemomma"
-    )
-    config.config["insert_words"]: list[str] = default_words.split(" ")
+    config.config["insert_words"] = DEFAULT_INSERT_WORDS.split(" ")
     config.write_config()
 
 
@@ -219,10 +219,6 @@ async def reset_words(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     await update.message.reply_text(f"Word list reset successfully.")
 
 
-# Make sure insert_words is initialized, otherwise we could cause traceback in insert()
-if config.config.get("insert_words") is None:
-    init_insert_words()
-
 Help.register_help("add_words", "Adds the given words to database for /insert.")
 Help.register_help("remove_words", "Removes the given words from database for /insert.")
 Help.register_help("reset_words", "Resets the words in database for /insert.")
@@ -14,11 +14,8 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
-import atexit
 import logging
-import os
-import sys
-from os import execve, system
+from os import system
 from time import sleep
 
 import telegram.error
@@ -27,8 +24,10 @@ from telegram.ext import Application, CallbackContext, CommandHandler, ContextTy
 
 import tgbot_python_v2.util.module
 from tgbot_python_v2.modules.rm6785 import RM6785_MASTER_USER
+from tgbot_python_v2.util import serving, workers
 from tgbot_python_v2.util.config import Config
 from tgbot_python_v2.util.help import Help
+from tgbot_python_v2.util.loader import commands_synced, core_changed, mark_commands_synced, reload_modules, write_cache
 
 log: logging.Logger = logging.getLogger(__name__)
 config: Config = Config("updater.json")
@@ -113,6 +112,12 @@ async def update_start(update: Update, context: CallbackContext) -> None:
         await update.callback_query.edit_message_text("Failed to git pull")
         return
 
+    # Changed modules can be swapped in place, anything else needs a restart. Every worker has its
+    # own copy of the modules, those are restarted as well.
+    if not core_changed() and not workers.IS_WORKER:
+        await reload_in_place(update, context)
+        return
+
     await update.callback_query.edit_message_text("Updating bot")
     log.info("Restarting bot")
 
@@ -125,14 +130,31 @@ async def update_start(update: Update, context: CallbackContext) -> None:
     config.write_config()
 
     # Make sure the bot does not restart indefinitely
-    await context.application.updater._stop_polling()
-    try:
-        await update.get_bot().get_updates(offset=update.update_id + 1)
-    except telegram.error.TimedOut:
-        pass
+    if not await serving.relaunch(context.application, update.update_id):
+        await abort_restart(update.callback_query.message)
+
 
-    atexit._run_exitfuncs()
-    execve(sys.executable, [sys.executable, *sys.argv], os.environ)
+async def reload_in_place(update: Update, context: CallbackContext) -> None:
+    log.info("Reloading changed modules")
+    await update.callback_query.edit_message_text("Reloading modules")
+    reloaded = reload_modules(context.application)
+
+    text: str = "Bot updated, no module changed"
+    if reloaded:
+        text = f"Bot updated, reloaded: {', '.join(mdl.short_name for mdl in reloaded)}"
+    if failed := [mdl.short_name for mdl in reloaded if mdl.error is not None]:
+        text += f"\nFailed to load: {', '.join(failed)}"
+    await update.callback_query.edit_message_text(text)
+
+    if commands_synced():
+        return
+    try:
+        await Help.update_bot_cmd(context.bot)
+    except telegram.error.TelegramError as e:
+        log.error(f"Failed to update bot command, cause: {e}")
+        return
+    mark_commands_synced()
+    write_cache()
 
 
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -142,12 +164,6 @@ async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     message = await update.message.reply_text("Restarting")
 
-    await context.application.updater._stop_polling()
-    try:
-        await update.get_bot().get_updates(offset=update.update_id + 1)
-    except telegram.error.TimedOut:
-        pass
-
     config.config = {
         "should_finish_restart": True,
         "was_updated": False,
@@ -156,8 +172,14 @@ async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
     config.write_config()
 
-    atexit._run_exitfuncs()
-    execve(sys.executable, [sys.executable, *sys.argv], os.environ)
+    if not await serving.relaunch(context.application, update.update_id):
+        await abort_restart(message)
+
+
+async def abort_restart(message: Message) -> None:
+    config.config = {}
+    config.write_config()
+    await message.edit_text("New instance failed to start, still running the old one. Check the logs.")
 
 
 Help.register_help("update", "Update and restart the bot.")
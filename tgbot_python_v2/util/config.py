@@ -14,12 +14,33 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
+import asyncio
 import atexit
+import copy
+import ctypes
+import inspect
 import json
 import logging
 import os
-import time
+import sqlite3
+import struct
+import threading
+from collections.abc import AsyncIterator, Callable, Hashable
+from contextlib import AbstractContextManager, asynccontextmanager
 from pathlib import Path
+from typing import Any, ClassVar
+
+from tgbot_python_v2.util.filelock import (
+    IN_CLOEXEC,
+    IN_CLOSE_WRITE,
+    IN_MOVED_TO,
+    IN_NONBLOCK,
+    LOCK_TIMEOUT,
+    FileLock,
+    libc,
+)
+from tgbot_python_v2.util.tracking import Path as ChangePath
+from tgbot_python_v2.util.tracking import track
 
 CONFIG_FILE_PATH_PREFIX: str = ""
 log: logging.Logger = logging.getLogger(__name__)
@@ -27,57 +48,110 @@ log: logging.Logger = logging.getLogger(__name__)
 if os.getenv("CONFIG_PERSIST_PARTITION"):
     CONFIG_FILE_PATH_PREFIX = os.getenv("CONFIG_PERSIST_PARTITION", "")
 
-
-def write_lock_file(file: Path) -> None:
-    log.info(f"Creating lock file: '{file.as_posix()}.lock'")
-    with open(f"{file.as_posix()}.lock", "w") as f:
-        f.write(str(os.getpid()))
-
-
-def remove_lock_file(file: Path) -> None:
-    log.info(f"Removing lock file: '{file.as_posix()}.lock'")
-    try:
-        Path(f"{file.as_posix()}.lock").unlink()
-    except FileNotFoundError:
-        log.warning(f"Failed to remove lock file: '{file.as_posix()}.lock'")
-
-
-def is_lock_file_exist(file: Path) -> bool:
-    return Path(f"{file.as_posix()}.lock").exists()
+# With several worker processes (see util/workers.py), every process has its own instance of each
+# config file. Changes written by another process are picked up as soon as they are written (see
+# watch_configs()), or on the next access where inotify is not available.
+CONFIG_WORKERS_SHARED: bool = int(os.getenv("TGBOT_WORKERS", "1")) > 1
+CONFIG_SHARED: bool = CONFIG_WORKERS_SHARED
+# Writes of a config within this many seconds are combined into one, 0 (the default) writes right away
+CONFIG_WRITE_DELAY: float = float(os.getenv("TGBOT_CONFIG_WRITE_DELAY", "0"))
+# Size in bytes a JournalConfig's journal may reach before the JSON file is rewritten
+CONFIG_JOURNAL_SIZE: int = int(os.getenv("TGBOT_CONFIG_JOURNAL_SIZE", str(1024 * 1024)))
+# Read config files on first use instead of when they are opened
+CONFIG_LAZY: bool = os.getenv("TGBOT_LAZY_CONFIGS", "1") != "0"
+# Pick up changes other processes write to config files as they happen, see watch_configs()
+CONFIG_WATCH: bool = os.getenv("TGBOT_CONFIG_WATCH", "1") != "0"
 
 
 class Config:
-    active_config: list[str] = []
+    """A JSON config file, read into the dict config. Dicts and lists stored in it are copied on
+    assignment (see util/tracking.py): after config["key"] = value, change config["key"], not value."""
+
+    active_config: ClassVar[list[str]] = []
+    instances: ClassVar[list["Config"]] = []
 
-    def __init__(self, file: str):
+    def __init__(
+        self,
+        file: str,
+        defaults: dict | None = None,
+        on_load: Callable[[dict], None] | None = None,
+        lazy: bool = CONFIG_LAZY,
+    ):
+        """defaults are filled in for missing top-level keys whenever the file is read, they are only
+        written once they are changed. on_load is called with the config after every read, e.g. to
+        migrate old data, what it changes is written along with the next write."""
         if file in Config.active_config:
             raise ValueError("The config file is already opened by another instance!")
 
         self.write_pending: bool = False
-        self._config: dict = {}
+        # Paths changed since the config was last read or written, see util/tracking.py
+        self.dirty: set[ChangePath] = set()
+        self._config: dict = track({}, self._changed)
+        self.defaults: dict = defaults or {}
+        self.on_load: Callable[[dict], None] | None = on_load
+        # Whether the file was read already, lazy configs are read on first use or by load_configs()
+        self.loaded: bool = False
+        # Held while reading the file for the first time, which may happen in a thread
+        self.load_lock: threading.Lock = threading.Lock()
+        self.name: str = file
         self.file: str = f"{CONFIG_FILE_PATH_PREFIX}/{file}"
+        # Held while reading or replacing the file, so the file and its signature always match
+        self.lock: FileLock = FileLock(f"{self.file}.lock")
+        # Module that opened the config, it is closed when that module is reloaded
+        frame = inspect.currentframe().f_back
+        while frame.f_globals.get("__name__") == __name__:
+            frame = frame.f_back
+        self.owner: str = frame.f_globals.get("__name__", "")
         self.closed: bool = False
+        # Identity of the file as last read or written
+        self.signature: tuple | None = None
+        # read_config() calls that found the file unchanged and skipped parsing it
+        self.reads_avoided: int = 0
+        # Delayed write, see write_config()
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.flush_tasks: set[asyncio.Task] = set()
+        self.flush_lock: asyncio.Lock = asyncio.Lock()
+        # Snapshots are numbered, so an older one never replaces a newer one on disk
+        self.write_seq: int = 0
+        self.written_seq: int = 0
+        self.file_lock: threading.Lock = threading.Lock()
+        # Locks of keys with a running transaction, and how many transactions use each
+        self.key_locks: dict[Hashable, asyncio.Lock] = {}
+        self.key_lock_users: dict[Hashable, int] = {}
+        # In shared mode, held by the running transaction of any process, see transaction()
+        self.transaction_lock: FileLock = FileLock(f"{self.file}.transaction.lock")
+        self.shared_transaction_lock: asyncio.Lock = asyncio.Lock()
         self.log = lambda text: log.info(f"[Config: {self.file}] {text}")
 
         Config.active_config.append(file)
+        Config.instances.append(self)
+        if not lazy:
+            self._ensure_loaded()
 
+        # Make sure changes are written upon exit
+        atexit.register(self.on_exit)
+
+    def _ensure_loaded(self) -> None:
+        if self.loaded:
+            return
+
+        # load_configs() may be reading the file in a thread, the config is only used once it is done
+        with self.load_lock:
+            if self.loaded:
+                return
+            self._open()
+            self.loaded = True
+
+    def _open(self) -> None:
         # Automatically load config from file if exist
         if Path(self.file).exists() and Path(self.file).is_file():
             self.log(f"Auto-loading config from {self.file} since it exists")
-            if is_lock_file_exist(Path(self.file)):
-                self.log(f"Config file is locked, waiting for it to be unlocked")
-                while is_lock_file_exist(Path(self.file)):
-                    time.sleep(0.1)
-                self.log(f"Config file is unlocked, loading config")
-            self.read_config()
+            self._load()
         else:
-            # Create the file to avoid traceback during read_config() call
+            # Create the file to avoid traceback during _load() call
             with open(self.file, "w") as config:
                 config.write("{}")
-            self.read_config()
-
-        # Make sure changes are written upon exit
-        atexit.register(self.on_exit)
+            self._load()
 
     @staticmethod
     def _ensure_open(method):
@@ -93,40 +167,732 @@ class Config:
             self.log("Instance already closed, will not write config")
             return
 
-        if not self.write_pending:
+        if not self._modified():
             self.log("No need to save changes")
+            return
 
         self.log("Writing unsaved changes")
-        self.write_config()
+        self._write_now()
+
+    def _disk_signature(self) -> tuple | None:
+        try:
+            stat: os.stat_result = os.stat(self.file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _changed(self, path: ChangePath) -> None:
+        self.dirty.add(path)
+
+    def _modified(self) -> bool:
+        """Whether the config was changed since it was last read or written."""
+        return bool(self.dirty)
+
+    def _snapshot(self) -> tuple[int, Any]:
+        self.write_seq += 1
+        self.dirty.clear()
+        return self.write_seq, json.dumps(self._config)
+
+    def _write_file(self, seq: int, snapshot: str) -> tuple | None:
+        """Safe to call from another thread, works on a snapshot of the config. Returns the
+        signature of the written file, or None if a newer snapshot was written already."""
+        with self.file_lock:
+            if seq < self.written_seq:
+                return None
+
+            self.log(f"Writing config to {self.file}")
+            tmp_file: str = self._write_tmp_file(snapshot)
+            with self.lock.exclusive():
+                os.replace(tmp_file, self.file)
+                signature: tuple | None = self._disk_signature()
+            self._sync_directory()
+            self.written_seq = seq
+            return signature
+
+    def _write_tmp_file(self, snapshot: str) -> str:
+        """Write to a temporary file first, so that neither other processes nor a crash ever
+        leave a half-written config behind. Returns its path, to be renamed over the config."""
+        tmp_file: str = f"{self.file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as config_file:
+            config_file.write(json.dumps(json.loads(snapshot), indent=2))
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        return tmp_file
+
+    def _sync_directory(self) -> None:
+        # Make renames and newly created files in the directory durable
+        directory: int = os.open(os.path.dirname(os.path.abspath(self.file)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _written(self, snapshot: str, signature: tuple | None) -> None:
+        if signature is not None:
+            self.signature = signature
+
+    def _write_now(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        seq, snapshot = self._snapshot()
+        signature: tuple | None = self._write_file(seq, snapshot)
+        self.write_pending = False
+        self._written(snapshot, signature)
 
     @_ensure_open
     def write_config(self) -> None:
-        self.log(f"Writing config to {self.file}")
-        with open(self.file, "w") as config_file:
-            json.dump(self.config, config_file, indent=2)
-        self.write_pending = False
-        remove_lock_file(Path(self.file))
+        """The config is written right away. With CONFIG_WRITE_DELAY set, from the event loop the write
+        happens that many seconds later in a thread, and further calls until then are covered by that
+        write; in shared mode, or without a running event loop, it is still written right away.
+        From the event loop, writes that take long (see _slow_write()) and writes while another one
+        is in progress happen in a thread right away, whatever the delay. Unchanged configs are not
+        written."""
+        if not self._modified():
+            return
+
+        try:
+            loop: asyncio.AbstractEventLoop | None = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and (self.flush_lock.locked() or self._slow_write()):
+            # Not on the event loop, nor waiting there for the write in progress
+            self.write_pending = True
+            if self.flush_handle is not None:
+                self.flush_handle.cancel()
+            self._start_flush()
+            return
+        if not CONFIG_WRITE_DELAY or CONFIG_SHARED or loop is None:
+            self._write_now()
+            return
+
+        self.write_pending = True
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(CONFIG_WRITE_DELAY, self._start_flush)
+
+    def _slow_write(self) -> bool:
+        """Whether the next write rewrites a file that may be large, the whole config is small
+        enough to be written from the event loop."""
+        return False
+
+    @asynccontextmanager
+    async def transaction(self, key: Hashable) -> AsyncIterator[dict]:
+        """Change the config without other transactions on the same key running in between, e.g. for
+        a read-modify-write across an await. Transactions on other keys are not held up. The config is
+        written once at the end, changes made before an exception are kept.
+
+            async with config.transaction(chat_id) as data:
+                data[chat_id] = data.get(chat_id, 0) + 1
+
+        In shared mode, transactions on the config run one at a time across all processes, whatever
+        their key: each starts from what the one before wrote, and writes before the next starts.
+
+        Transactions are not reentrant, do not nest two on the same key."""
+        lock: asyncio.Lock | None = self.key_locks.get(key)
+        if lock is None:
+            lock = self.key_locks[key] = asyncio.Lock()
+        self.key_lock_users[key] = self.key_lock_users.get(key, 0) + 1
+        try:
+            async with lock, self._shared_transaction():
+                try:
+                    yield self.config
+                finally:
+                    self.write_config()
+                    if CONFIG_SHARED:
+                        # The next transaction, maybe in another process, starts from what is on disk
+                        await self.flush()
+        finally:
+            self.key_lock_users[key] -= 1
+            if not self.key_lock_users[key]:
+                del self.key_lock_users[key]
+                del self.key_locks[key]
+
+    @asynccontextmanager
+    async def _shared_transaction(self) -> AsyncIterator[None]:
+        """Keep the transactions of other processes out in shared mode, and pick up what they wrote."""
+        if not CONFIG_SHARED:
+            yield
+            return
+
+        # Only one thread per process waits for the lock file
+        async with self.shared_transaction_lock:
+            held: AbstractContextManager[bool] = self.transaction_lock.exclusive()
+            await asyncio.to_thread(held.__enter__)
+            try:
+                self.refresh()
+                yield
+            finally:
+                held.__exit__(None, None, None)
+
+    def _start_flush(self) -> None:
+        self.flush_handle = None
+        task: asyncio.Task = asyncio.create_task(self.flush(), name=f"flush_config_{self.name}")
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """Do a delayed write now, returns once the config is on disk."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        async with self.flush_lock:
+            self.write_pending = False
+            if self.closed or not self._modified():
+                return
+
+            seq, snapshot = self._snapshot()
+            try:
+                signature: tuple | None = await asyncio.to_thread(self._write_file, seq, snapshot)
+            except (OSError, sqlite3.Error) as e:
+                log.error(f"[Config: {self.file}] Failed to write config, will retry on the next write: {e}")
+                # What exactly was in the snapshot is gone, write everything next time
+                self.dirty.add(())
+                return
+            self._written(snapshot, signature)
 
     @_ensure_open
     def read_config(self) -> None:
+        """Read the file again if it changed since it was last read or written. An unchanged file is
+        not parsed again. Changes still waiting to be written are kept, the file is not read while
+        there are any or while a write is in progress, they are written over it instead."""
+        if not self.loaded:
+            self._ensure_loaded()
+            return
+        if self.signature is not None and self.signature == self._disk_signature():
+            self.reads_avoided += 1
+            return
+        if self.flush_lock.locked() or self._modified():
+            # A write in progress records the file's signature once it is done
+            return
+        self._load()
+
+    def _load(self) -> None:
         self.log(f"Reading config from {self.file}")
-        with open(self.file, "r") as config_file:
-            self.config = json.load(config_file)
+        with self.lock.shared(), open(self.file, "r") as config_file:
+            self.signature = self._disk_signature()
+            data: dict = json.load(config_file)
+        self._use(data)
+
+    def _use(self, data: dict) -> None:
+        """Take data read from the file as the config. The config is updated in place and values that
+        did not change are kept, so that references to them, e.g. in a running transaction, stay valid."""
+        for key, value in self.defaults.items():
+            if key not in data:
+                data[key] = copy.deepcopy(value)
+        for key in [key for key in self._config if key not in data]:
+            del self._config[key]
+        for key, value in data.items():
+            if key not in self._config or self._config[key] != value:
+                self._config[key] = value
+        self.dirty.clear()
+        if self.on_load is not None:
+            self.on_load(self._config)
+
+    def refresh(self) -> None:
+        """Pick up changes another process wrote to the file. Unsaved changes here are applied on top
+        of them, and win where both changed the same value."""
+        if self.closed or not self.loaded or self.flush_lock.locked():
+            # A write in progress records the file's signature once it is done
+            return
+        if self.signature == self._disk_signature():
+            return
+
+        if () in self.dirty:
+            self.log("Changed by another process, but the whole config was replaced here. Keeping it.")
+            self.signature = self._disk_signature()
+        elif self._modified():
+            self.log("Changed by another process, reloading and keeping the unsaved changes here")
+            self._reload_keeping_changes()
+        else:
+            self.log("Changed by another process, reloading")
+            self._load()
+
+    def _reload_keeping_changes(self) -> None:
+        changes: list[tuple[ChangePath, bool, Any]] = []
+        for path in sorted(self.dirty, key=len):
+            value: Any = self._config
+            removed: bool = False
+            for depth, key in enumerate(path):
+                if not isinstance(value, dict):
+                    # Items of a list share its path
+                    path = path[:depth]
+                    break
+                if key not in value:
+                    path = path[: depth + 1]
+                    removed = True
+                    break
+                value = value[key]
+            changes.append((path, removed, copy.deepcopy(value)))
+
+        self._load()
+        for path, removed, value in changes:
+            target: dict = self._config
+            for key in path[:-1]:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            # Marks the path as changed again
+            if removed:
+                target.pop(path[-1], None)
+                self._changed(path)
+            else:
+                target[path[-1]] = value
 
     @property
     def config(self) -> dict:
+        if not self.loaded:
+            self._ensure_loaded()
+        elif CONFIG_SHARED and watch_fd < 0:
+            self.refresh()
         return self._config
 
-    @_ensure_open
     @config.setter
+    @_ensure_open
     def config(self, value) -> None:
-        self._config = value
-        self.write_pending = True
-        write_lock_file(Path(self.file))
+        # What is stored has to be known to replace it
+        self._ensure_loaded()
+        self._config = track(value, self._changed)
+        self._changed(())
 
     def close(self) -> None:
-        self.write_config()
+        self.on_exit()
         self.write_pending = False
-        remove_lock_file(Path(self.file))
-        Config.active_config.remove(self.file)
+        Config.active_config.remove(self.name)
+        Config.instances.remove(self)
         self.closed = True
+
+
+class SqliteConfig(Config):
+    """Config stored in SQLite (<name>.sqlite3, in WAL mode) with one row per top-level key, for
+    configs that keep growing. Only keys whose value changed are written, so the cost of a write
+    follows the size of the change rather than the size of the config.
+
+    Takes the same name as the JSON config it replaces, the JSON file is imported on first use
+    and renamed to <name>.migrated. The import is a single transaction, if it fails the database
+    stays empty and the JSON file is imported again next time."""
+
+    def __init__(self, file: str, **kwargs: Any):
+        self.db_file: str = f"{CONFIG_FILE_PATH_PREFIX}/{Path(file).stem}.sqlite3"
+        self.connection: sqlite3.Connection | None = None
+        # Each key's value as stored in the database
+        self.rows: dict[str, str] = {}
+        super().__init__(file, **kwargs)
+
+    def _open(self) -> None:
+        self.log(f"Opening {self.db_file}")
+        # Every use of the connection is serialized by file_lock, writes happen in a thread
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+        try:
+            self.connection.execute(f"PRAGMA busy_timeout = {int(LOCK_TIMEOUT * 1000)}")
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            # Survives crashes of the bot, only a power loss may lose the last transactions
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            if Path(self.file).is_file():
+                self._migrate()
+            self._load()
+        except BaseException:
+            # Opened again on the next use
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def _migrate(self) -> None:
+        migrated: bool = False
+        # Taking the write lock first keeps other processes from importing the same file meanwhile
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.connection.execute("SELECT 1 FROM config LIMIT 1").fetchone() is None and Path(self.file).is_file():
+                self.log(f"Migrating {self.file} to {self.db_file}")
+                with open(self.file) as config_file:
+                    data: dict = json.load(config_file)
+                self.connection.executemany(
+                    "INSERT INTO config (key, value) VALUES (?, ?)",
+                    ((str(key), json.dumps(value)) for key, value in data.items()),
+                )
+                migrated = True
+
+        if migrated or not Path(f"{self.file}.migrated").exists():
+            if not migrated:
+                # The import was committed, but renaming the file was not done
+                self.log(f"{self.file} was imported into {self.db_file} already, finishing the migration")
+            try:
+                os.replace(self.file, f"{self.file}.migrated")
+            except FileNotFoundError:
+                # Renamed by another process
+                return
+            self._sync_directory()
+        else:
+            self.log(f"Ignoring {self.file}, {self.db_file} is in use already")
+
+    def _disk_signature(self) -> tuple | None:
+        # Changes whenever another connection committed, which is all shared mode needs to know
+        with self.file_lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()
+
+    def _changes(self) -> tuple[dict[str, str], set[str]]:
+        """Keys whose value differs from the stored one, and keys that were removed. Only keys
+        that were changed are serialized, unless the whole config was replaced or cleared."""
+        if () in self.dirty:
+            values: dict[str, str] = {str(key): json.dumps(value) for key, value in self._config.items()}
+            removed: set[str] = self.rows.keys() - values.keys()
+        else:
+            keys: set = {path[0] for path in self.dirty}
+            values = {str(key): json.dumps(self._config[key]) for key in keys if key in self._config}
+            removed = ({str(key) for key in keys if key not in self._config} - values.keys()) & self.rows.keys()
+        changed: dict[str, str] = {key: value for key, value in values.items() if self.rows.get(key) != value}
+        return changed, removed
+
+    def _snapshot(self) -> tuple[int, tuple[dict[str, str], set[str]]]:
+        self.write_seq += 1
+        changes: tuple[dict[str, str], set[str]] = self._changes()
+        self.dirty.clear()
+        return self.write_seq, changes
+
+    def _write_file(self, seq: int, snapshot: tuple[dict[str, str], set[str]]) -> tuple | None:
+        changed, removed = snapshot
+        with self.file_lock:
+            if seq < self.written_seq:
+                return None
+            if not changed and not removed:
+                self.written_seq = seq
+                return self.signature
+
+            self.log(f"Writing {len(changed)} changed and {len(removed)} removed keys to {self.db_file}")
+            # SQLite does its own locking, the lock file is taken so that closing it tells watching
+            # processes that the transaction is committed, see watch_configs()
+            with self.lock.exclusive(), self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    # Keeps the rowid, and with it the key's position
+                    "INSERT INTO config (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    changed.items(),
+                )
+                self.connection.executemany("DELETE FROM config WHERE key = ?", ((key,) for key in removed))
+            self.written_seq = seq
+            return self.connection.execute("PRAGMA data_version").fetchone()
+
+    def _written(self, snapshot: tuple[dict[str, str], set[str]], signature: tuple | None) -> None:
+        if signature is None:
+            return
+
+        changed, removed = snapshot
+        self.rows.update(changed)
+        for key in removed:
+            self.rows.pop(key, None)
+        self.signature = signature
+
+    def _load(self) -> None:
+        self.log(f"Reading config from {self.db_file}")
+        with self.file_lock:
+            self.signature = self.connection.execute("PRAGMA data_version").fetchone()
+            # In insertion order, like the JSON file
+            rows: dict[str, str] = dict(self.connection.execute("SELECT key, value FROM config ORDER BY rowid"))
+        # Only parse values that changed since the last read
+        reuse: bool = not self.dirty
+        data: dict = {
+            key: self._config[key]
+            if reuse and self.rows.get(key) == value and key in self._config
+            else json.loads(value)
+            for key, value in rows.items()
+        }
+        self.rows = rows
+        self._use(data)
+
+    def close(self) -> None:
+        super().close()
+        if self.connection is not None:
+            with self.file_lock:
+                self.connection.close()
+
+
+class JournalConfig(Config):
+    """Config that appends every change to <name>.journal instead of rewriting the JSON file, for
+    configs that are written often. A change is written as a line holding the path of the changed
+    value and the new value, or only the path if the value was removed:
+
+        [["123", "count"], 4]
+        [["124"]]
+
+    The first line names the inode of the JSON file the journal belongs to, {"snapshot": 1234}.
+    Reading replays the journal on top of the JSON file. Once the journal is larger than
+    CONFIG_JOURNAL_SIZE, the next write rewrites the JSON file and starts a new journal."""
+
+    def __init__(self, file: str, **kwargs: Any):
+        self.journal_file: str = f"{CONFIG_FILE_PATH_PREFIX}/{file}.journal"
+        # Size of the journal as last read or written
+        self.journal_size: int = 0
+        super().__init__(file, **kwargs)
+
+    def _disk_signature(self) -> tuple | None:
+        try:
+            stat: os.stat_result = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return super()._disk_signature(), None
+        return super()._disk_signature(), (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _records(self) -> list[str]:
+        records: list[str] = []
+        written: set[ChangePath] = set()
+        # Shorter paths first, changes below a path that is written anyway are skipped
+        for path in sorted(self.dirty, key=len):
+            value: Any = self._config
+            removed: bool = False
+            for depth, key in enumerate(path):
+                if not isinstance(value, dict):
+                    # Items of a list share its path, a change inside one rewrites the whole list
+                    path = path[:depth]
+                    break
+                if key not in value:
+                    path = path[: depth + 1]
+                    removed = True
+                    break
+                value = value[key]
+
+            if any(path[:depth] in written for depth in range(len(path) + 1)):
+                continue
+            written.add(path)
+            # Keys become strings in JSON, paths have to match the keys read back from the file
+            keys: list[str] = [str(key) for key in path]
+            records.append(json.dumps([keys] if removed else [keys, value]) + "\n")
+        return records
+
+    def _compacts(self, records: list[str]) -> bool:
+        return () in self.dirty or self.journal_size + sum(map(len, records)) > CONFIG_JOURNAL_SIZE
+
+    def _slow_write(self) -> bool:
+        # Compacting rewrites the JSON file, appending is quick
+        return self._compacts([] if () in self.dirty else self._records())
+
+    def _snapshot(self) -> tuple[int, tuple[list[str], str | None]]:
+        self.write_seq += 1
+        records: list[str] = [] if () in self.dirty else self._records()
+        full: str | None = None
+        if self._compacts(records):
+            full = json.dumps(self._config)
+            records = []
+        self.dirty.clear()
+        return self.write_seq, (records, full)
+
+    def _write_file(self, seq: int, snapshot: tuple[list[str], str | None]) -> tuple | None:
+        records, full = snapshot
+        with self.file_lock:
+            if seq < self.written_seq:
+                return None
+
+            if full is not None:
+                self.log(f"Compacting {self.journal_file} into {self.file}")
+                tmp_file: str = self._write_tmp_file(full)
+                tmp_journal: str = f"{self.journal_file}.{os.getpid()}.tmp"
+                with open(tmp_journal, "w") as journal:
+                    journal.write(self._header(os.stat(tmp_file).st_ino))
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                with self.lock.exclusive():
+                    # The old journal names the replaced file, after a crash in between it is not
+                    # replayed over the new one
+                    os.replace(tmp_file, self.file)
+                    os.replace(tmp_journal, self.journal_file)
+                    signature: tuple | None = self._disk_signature()
+                self._sync_directory()
+            elif records:
+                self.log(f"Appending {len(records)} changes to {self.journal_file}")
+                created: bool = not os.path.exists(self.journal_file)
+                header: str = self._header() if created or not os.path.getsize(self.journal_file) else ""
+                with self.lock.exclusive(), open(self.journal_file, "a") as journal:
+                    journal.write(header + "".join(records))
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    signature = self._disk_signature()
+                if created:
+                    self._sync_directory()
+            else:
+                signature = self.signature
+            self.written_seq = seq
+            return signature
+
+    def _written(self, snapshot: tuple[list[str], str | None], signature: tuple | None) -> None:
+        if signature is not None:
+            self.signature = signature
+            self.journal_size = signature[1][2] if signature[1] else 0
+
+    def _header(self, snapshot: int | None = None) -> str:
+        """First line of a new journal, for the JSON file with the given inode, by default the
+        current one."""
+        return json.dumps({"snapshot": os.stat(self.file).st_ino if snapshot is None else snapshot}) + "\n"
+
+    def _replay(self, data: dict, start: int = 0) -> bool:
+        """Apply the journal from the given offset to data, returns whether the journal has to be
+        rewritten because it had broken records or does not belong to the JSON file."""
+        if not os.path.exists(self.journal_file):
+            return False
+
+        broken: bool = False
+        with open(self.journal_file, "rb") as journal:
+            journal.seek(start)
+            if start == 0:
+                line: bytes = journal.readline()
+                try:
+                    snapshot: Any = json.loads(line)["snapshot"] if line else None
+                except (ValueError, LookupError, TypeError):
+                    snapshot = -1
+                if line and snapshot != os.stat(self.file).st_ino:
+                    # Left behind by a crash during compaction, its changes are in the file already
+                    log.warning(f"[Config: {self.file}] Ignoring {self.journal_file}, it belongs to another file")
+                    return True
+            for line in journal:
+                try:
+                    record: list = json.loads(line)
+                    *parents, key = record[0]
+                except (ValueError, LookupError, TypeError):
+                    # A crash in the middle of an append leaves a partial record behind
+                    log.warning(f"[Config: {self.file}] Skipping broken record in {self.journal_file}: {line!r}")
+                    broken = True
+                    continue
+
+                target: dict = data
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                if len(record) > 1:
+                    target[key] = record[1]
+                else:
+                    target.pop(key, None)
+        return broken
+
+    def _appended(self, signature: tuple) -> bool:
+        """Whether the journal only grew since it was last read or written, and the config has no
+        unsaved changes, so that only the new records need to be applied."""
+        return (
+            self.loaded
+            and not self.dirty
+            and self.signature is not None
+            and self.signature[1] is not None
+            and signature[1] is not None
+            and signature[0] == self.signature[0]
+            and signature[1][0] == self.signature[1][0]
+            and signature[1][2] >= self.journal_size
+        )
+
+    def _load(self) -> None:
+        data: dict | None = None
+        with self.lock.shared():
+            signature: tuple = self._disk_signature()
+            appended: bool = self._appended(signature)
+            self.signature = signature
+            if appended:
+                self.log(f"Reading new records from {self.journal_file}")
+                broken: bool = self._replay(self._config, self.journal_size)
+                self.dirty.clear()
+            else:
+                self.log(f"Reading config from {self.file} and {self.journal_file}")
+                with open(self.file, "r") as config_file:
+                    data = json.load(config_file)
+                broken = self._replay(data)
+        if data is not None:
+            self._use(data)
+        self.journal_size = self.signature[1][2] if self.signature[1] else 0
+        if broken:
+            # Records appended after a partial one would end up on its line, and ones appended to a
+            # journal of another file would be ignored, compact first
+            self._changed(())
+
+
+def share_configs(shared: bool) -> None:
+    """Turn on shared mode while another process may write the same config files, e.g. during a
+    restart (see util/handover.py). Turning it off picks up what the other process wrote last."""
+    global CONFIG_SHARED
+
+    for instance in Config.instances:
+        if shared and instance.flush_handle is not None:
+            # The other process should see what was written so far
+            instance._write_now()
+        elif not shared:
+            instance.refresh()
+    CONFIG_SHARED = shared or CONFIG_WORKERS_SHARED
+
+
+async def load_configs() -> None:
+    """Read every config that was not used yet in a thread, so that their first use does not read
+    and parse the file on the event loop. Meant for post_init, and after lazily importing modules."""
+    for instance in list(Config.instances):
+        if instance.loaded or instance.closed:
+            continue
+        try:
+            await asyncio.to_thread(instance._ensure_loaded)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            # Raised again on first use
+            log.error(f"[Config: {instance.file}] Failed to read config: {e}")
+
+
+async def flush_configs() -> None:
+    """Do every delayed write now, meant for shutdown."""
+    await asyncio.gather(*(instance.flush() for instance in Config.instances))
+
+
+# inotify descriptor watching the config directory, -1 while not watching
+watch_fd: int = -1
+INOTIFY_EVENT: struct.Struct = struct.Struct("iIII")
+IN_Q_OVERFLOW: int = 0x00004000
+
+
+def _read_events() -> None:
+    try:
+        data: bytes = os.read(watch_fd, 65536)
+    except BlockingIOError:
+        return
+
+    names: set[str] = set()
+    overflow: bool = False
+    offset: int = 0
+    while offset < len(data):
+        _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        start: int = offset + INOTIFY_EVENT.size
+        names.add(os.fsdecode(data[start : start + length].rstrip(b"\0")))
+        overflow |= bool(mask & IN_Q_OVERFLOW)
+        offset = start + length
+
+    for instance in Config.instances:
+        # Every write ends with closing the lock file. The config file itself is watched too, for
+        # changes made without taking the lock, e.g. by hand.
+        if overflow or {os.path.basename(instance.file), os.path.basename(instance.lock.path)} & names:
+            try:
+                instance.refresh()
+            except (OSError, ValueError, sqlite3.Error) as e:
+                log.error(f"[Config: {instance.file}] Failed to pick up changes: {e}")
+
+
+def watch_configs() -> None:
+    """Pick up changes other processes write to config files as soon as they are written, instead
+    of checking the file on every access in shared mode, or not at all otherwise. Needs a running
+    event loop, meant for post_init."""
+    global watch_fd
+
+    if watch_fd >= 0 or not CONFIG_WATCH or libc is None:
+        return
+
+    directory: str = os.path.dirname(os.path.abspath(f"{CONFIG_FILE_PATH_PREFIX}/config"))
+    fd: int = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        log.warning(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        return
+    if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        log.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+        os.close(fd)
+        return
+
+    asyncio.get_running_loop().add_reader(fd, _read_events)
+    watch_fd = fd
+    log.info(f"Watching {directory} for config changes")
+
+
+def unwatch_configs() -> None:
+    global watch_fd
+
+    if watch_fd < 0:
+        return
+    asyncio.get_running_loop().remove_reader(watch_fd)
+    os.close(watch_fd)
+    watch_fd = -1
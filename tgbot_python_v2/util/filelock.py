@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Cross-process file locks, based on flock(). The kernel releases a lock when its holder exits,
+so a crash never leaves a stale lock behind.
+Available methods:
+
+    FileLock(path)
+        Lock on the given lock file.
+
+    FileLock.shared(timeout) / FileLock.exclusive(timeout)
+        Context managers holding the lock, returning whether it was taken in time.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+import select
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# Time to wait for a lock before going on without it
+LOCK_TIMEOUT: float = float(os.getenv("TGBOT_LOCK_TIMEOUT", "10"))
+# Wait for locks to be released with inotify instead of polling, where available
+LOCK_INOTIFY: bool = os.getenv("TGBOT_LOCK_INOTIFY", "1") != "0"
+# Polling interval bounds, when inotify is not used
+POLL_MIN: float = 0.001
+POLL_MAX: float = 0.1
+
+IN_NONBLOCK: int = os.O_NONBLOCK
+IN_CLOEXEC: int = os.O_CLOEXEC
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_TO: int = 0x00000080
+
+
+def _load_inotify() -> ctypes.CDLL | None:
+    try:
+        libc: ctypes.CDLL | None = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        libc = None
+    if libc is None or not hasattr(libc, "inotify_init1"):
+        log.info("inotify is not available, waiting for locks by polling")
+        return None
+    return libc
+
+
+# Also used by util/config.py to watch for changes of config files
+libc: ctypes.CDLL | None = _load_inotify()
+
+
+class _CloseWatch:
+    """Wakes up when the lock file is closed by a process that had it open, which is how every
+    lock is released. Falls back to polling with backoff if inotify cannot be used."""
+
+    def __init__(self, path: str):
+        self.fd: int = -1
+        self.delay: float = POLL_MIN
+        if libc is None or not LOCK_INOTIFY:
+            return
+
+        fd: int = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            log.warning(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE) < 0:
+            log.warning(f"Cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout: float) -> None:
+        if self.fd < 0:
+            time.sleep(min(self.delay, timeout))
+            self.delay = min(self.delay * 2, POLL_MAX)
+            return
+
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                # Only the wakeup matters, drop the events
+                os.read(self.fd, 4096)
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileLock:
+    """Advisory lock on a lock file. The holder of an exclusive lock writes its pid into the file,
+    which is logged when another process gives up waiting for it.
+
+    Locks are held per FileLock and are not reentrant, do not nest them."""
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def _try_lock(self, fd: int, operation: int) -> bool:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+    def _holder(self) -> str:
+        try:
+            with open(self.path) as lock_file:
+                pid: int = int(lock_file.read().strip())
+        except (OSError, ValueError):
+            return "an unknown process"
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            # The lock is still held, so the pid's file descriptor lives on in another process
+            return f"pid {pid}, which exited (a process it started may have inherited the lock)"
+        except PermissionError:
+            pass
+        return f"pid {pid}"
+
+    def _acquire(self, fd: int, operation: int, timeout: float) -> bool:
+        if self._try_lock(fd, operation):
+            return True
+
+        deadline: float = time.monotonic() + timeout
+        # Watch before retrying, so a release between the two is not missed
+        watch: _CloseWatch = _CloseWatch(self.path)
+        try:
+            while not self._try_lock(fd, operation):
+                remaining: float = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.warning(f"{self.path} is still locked by {self._holder()} after {timeout:.0f}s, going on")
+                    return False
+                watch.wait(remaining)
+        finally:
+            watch.close()
+        return True
+
+    @contextmanager
+    def _locked(self, operation: int, timeout: float) -> Iterator[bool]:
+        fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            locked: bool = self._acquire(fd, operation, timeout)
+            if locked and operation == fcntl.LOCK_EX:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, str(os.getpid()).encode(), 0)
+            yield locked
+        finally:
+            # Closing releases the lock, and wakes up processes waiting for it
+            os.close(fd)
+
+    def shared(self, timeout: float = LOCK_TIMEOUT) -> AbstractContextManager[bool]:
+        return self._locked(fcntl.LOCK_SH, timeout)
+
+    def exclusive(self, timeout: float = LOCK_TIMEOUT) -> AbstractContextManager[bool]:
+        return self._locked(fcntl.LOCK_EX, timeout)
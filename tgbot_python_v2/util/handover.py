@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Restarting without a gap in receiving updates. The running bot starts its successor (the same
+command line with TGBOT_HANDOVER_FD set) and keeps handling updates while the successor loads
+its modules and runs post_init. Once the successor reports ready, the running bot stops receiving
+updates, sends the successor the id of the last update it received and handles what it has left,
+while the successor starts receiving updates.
+Available methods:
+
+    start_successor(env)
+        Start the successor and wait until it is ready, returns a Successor or None.
+
+    Successor.release(last_update_id, received)
+        Let the successor start receiving updates.
+
+    wait_for_predecessor()
+        In the successor, report ready and wait until it may receive updates.
+
+The predecessor hands over the id of the last update it received, followed by the ids of the
+updates it received last when it received them over a webhook, on one line: "120 117 119 120".
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+from collections.abc import Iterable
+
+from tgbot_python_v2.util.config import share_configs
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# Opt-in: a supervisor watching the pid (e.g. systemd, or PID 1 of a container) would see the bot
+# exit, by default the process is replaced with exec instead
+HANDOVER_ENABLED: bool = os.getenv("TGBOT_HANDOVER", "0") == "1" and os.getpid() != 1
+# Time given to the successor to load its modules
+HANDOVER_TIMEOUT: float = float(os.getenv("TGBOT_HANDOVER_TIMEOUT", "300"))
+# Removed from the environment, so that the successor's own successor does not inherit it
+HANDOVER_FD: int | None = int(fd) if (fd := os.environ.pop("TGBOT_HANDOVER_FD", None)) is not None else None
+IS_SUCCESSOR: bool = HANDOVER_FD is not None
+READY: bytes = b"ready\n"
+
+if IS_SUCCESSOR:
+    # The predecessor still handles updates and writes its config files until it exited
+    share_configs(True)
+
+
+class Successor:
+    def __init__(self, process: asyncio.subprocess.Process, writer: asyncio.StreamWriter):
+        self.process: asyncio.subprocess.Process = process
+        self.writer: asyncio.StreamWriter = writer
+
+    async def release(self, last_update_id: int, received: Iterable[int] = ()) -> None:
+        """The successor starts receiving updates once this returns. The connection stays open
+        until this process exits, which tells the successor that config files are no longer shared."""
+        log.info(f"Handing over to pid {self.process.pid}, last update received was {last_update_id}")
+        self.writer.write(" ".join(map(str, (last_update_id, *received))).encode() + b"\n")
+        await self.writer.drain()
+
+
+# Kept until exit, closing the connection early would tell the successor that this process exited
+successor: Successor | None = None
+
+
+async def start_successor(env: dict[str, str] | None = None) -> Successor | None:
+    """Returns None if the successor exited or did not get ready in time, it is killed then
+    and this process keeps running as if nothing happened."""
+    global successor
+
+    share_configs(True)
+    ours, theirs = socket.socketpair()
+    try:
+        process: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            *sys.argv,
+            pass_fds=(theirs.fileno(),),
+            env={**os.environ, **(env or {}), "TGBOT_HANDOVER_FD": str(theirs.fileno())},
+        )
+    finally:
+        theirs.close()
+    reader, writer = await asyncio.open_connection(sock=ours)
+    log.info(f"Started successor with pid {process.pid}, waiting for it to be ready")
+
+    try:
+        line: bytes = await asyncio.wait_for(reader.readline(), HANDOVER_TIMEOUT)
+    except TimeoutError:
+        log.error(f"Successor did not get ready in {HANDOVER_TIMEOUT:.0f}s")
+        line = b""
+
+    if line == READY:
+        successor = Successor(process, writer)
+        return successor
+
+    log.error("Successor failed to start, keeping this process")
+    if process.returncode is None:
+        process.kill()
+    await process.wait()
+    writer.close()
+    share_configs(False)
+    return None
+
+
+async def _wait_for_exit(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    await reader.read()
+    writer.close()
+    log.info("Predecessor exited")
+    share_configs(False)
+
+
+exit_watcher: asyncio.Task | None = None
+
+
+async def wait_for_predecessor() -> tuple[int, list[int]] | None:
+    """Returns the id of the last update the predecessor received and the ids of the updates it
+    received last, or None if it exited without handing over, e.g. because it was killed."""
+    global exit_watcher
+
+    reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=HANDOVER_FD))
+    writer.write(READY)
+    await writer.drain()
+    log.info("Ready, waiting for the predecessor to stop receiving updates")
+
+    line: bytes = await reader.readline()
+    if not line:
+        log.warning("Predecessor exited without handing over")
+        writer.close()
+        share_configs(False)
+        return None
+
+    exit_watcher = asyncio.create_task(_wait_for_exit(reader, writer), name="handover_exit_watcher")
+    last_update_id, *received = map(int, line.split())
+    return last_update_id, received
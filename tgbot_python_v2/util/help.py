@@ -14,55 +14,73 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
-import asyncio
+import hashlib
+import inspect
+import json
 import logging
 import os
+from typing import ClassVar
 
 from telegram import Bot, BotCommand
+from telegram.constants import MessageLimit
 
 log: logging.Logger = logging.getLogger(__name__)
 
-try:
-    from api_token import TOKEN
-except ImportError:
-    if not (TOKEN := os.getenv("BOT_TOKEN")):
-        log.critical("Failed to get bot token")
+# Commands shown on one page of /help
+HELP_PAGE_LINES: int = int(os.getenv("TGBOT_HELP_PAGE_LINES", "10"))
 
 
 class Help:
     """Class for storing help strings. Class methods only."""
 
-    bot: Bot = Bot(TOKEN)
-    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
-    help_messages: dict = {}
+    help_messages: ClassVar[dict] = {}
+    help_owners: ClassVar[dict[str, str]] = {}
     cmd_update_pending: bool = False
+    # Bumped on every change of the help strings, the rendered help is kept until then
+    version: int = 0
+    rendered: tuple[int, str, tuple[str, ...]] | None = None
 
     @classmethod
-    def update_bot_cmd(cls):
-        """Update bot cmds in Telegram, eliminating the need to do it manually through @BotFather."""
-        # commands: list[BotCommand] = []
-        # for cmd in cls.help_messages.keys():
-        #     commands.append(BotCommand(cmd, cls.help_messages.get(cmd)))
-        commands: list[BotCommand] = [
+    def _changed(cls) -> None:
+        cls.version += 1
+        cls.rendered = None
+
+    @classmethod
+    async def update_bot_cmd(cls, bot: Bot) -> None:
+        """Update bot cmds in Telegram, eliminating the need to do it manually through @BotFather.
+        The commands are only sent when they differ from what Telegram currently has."""
+        commands: tuple[BotCommand, ...] = tuple(
             BotCommand(cmd, cls.help_messages.get(cmd, "")) for cmd in cls.help_messages.keys()
-        ]
+        )
 
-        try:
+        if await bot.get_my_commands() == commands:
+            log.info("Bot cmd already up to date")
+        else:
             log.info("Updating bot cmd")
-            cls.loop.run_until_complete(cls.bot.delete_my_commands())
-            cls.loop.run_until_complete(cls.bot.set_my_commands(commands))
+            await bot.set_my_commands(commands)
 
-            cls.cmd_update_pending = False
-        except Exception as e:
-            log.error("Failed to update bot cmd:\n" + str(e))
+        cls.cmd_update_pending = False
 
     @classmethod
-    def register_help(cls, command: str, help_string: str) -> None:
-        """Register a unique help string for a command."""
+    def register_help(cls, command: str, help_string: str, owner: str | None = None) -> None:
+        """Register a unique help string for a command.
+        owner is the module the command belongs to, defaults to the caller's module.
+        A module may overwrite help strings that were registered on its behalf."""
+        if owner is None:
+            owner = inspect.currentframe().f_back.f_globals.get("__name__", "")
+
         if cls.help_messages.get(command) is None:
             log.info(f"Registering help for command {command}")
             cls.help_messages[command] = help_string
+            cls.help_owners[command] = owner
             cls.cmd_update_pending = True
+            cls._changed()
+        elif cls.help_owners.get(command) == owner:
+            if cls.help_messages[command] != help_string:
+                log.info(f"Updating help for command {command}")
+                cls.help_messages[command] = help_string
+                cls.cmd_update_pending = True
+                cls._changed()
         else:
             log.warning(f"Command {command} already have help message set!")
 
@@ -72,22 +90,62 @@ class Help:
         if cls.help_messages.get(command) is not None:
             log.info(f"Removing help string for command {command}")
             del cls.help_messages[command]
+            cls.help_owners.pop(command, None)
             cls.cmd_update_pending = True
+            cls._changed()
         else:
             log.warning(f"No help message from {command} to be removed!")
 
     @classmethod
-    def get_help(cls, commands: list = None) -> str:
+    def remove_help_of(cls, owner: str) -> None:
+        """Remove the help strings registered by a module."""
+        for command in [cmd for cmd, cmd_owner in cls.help_owners.items() if cmd_owner == owner]:
+            cls.remove_help(command)
+
+    @classmethod
+    def sort_help(cls, modules: list[str]) -> None:
+        """Reorder help strings by the module that registered them, following the order of modules."""
+        rank: dict[str, int] = {name: index for index, name in enumerate(modules)}
+        commands: list[str] = sorted(cls.help_messages, key=lambda cmd: rank.get(cls.help_owners.get(cmd, ""), -1))
+        cls.help_messages = {cmd: cls.help_messages[cmd] for cmd in commands}
+        cls._changed()
+
+    @classmethod
+    def digest(cls) -> str:
+        """Return a hash of all commands and their help strings, in order."""
+        return hashlib.sha256(json.dumps(list(cls.help_messages.items())).encode()).hexdigest()
+
+    @classmethod
+    def _render(cls) -> tuple[int, str, tuple[str, ...]]:
+        if cls.rendered is not None and cls.rendered[0] == cls.version:
+            return cls.rendered
+
+        lines: list[str] = [f"/{cmd} -> {text}\n" for cmd, text in cls.help_messages.items()]
+        pages: list[str] = []
+        page: list[str] = []
+        size: int = 0
+        for line in lines:
+            # Leave room for the page number added by modules/help.py
+            if page and (len(page) == HELP_PAGE_LINES or size + len(line) > MessageLimit.MAX_TEXT_LENGTH - 100):
+                pages.append("".join(page))
+                page, size = [], 0
+            page.append(line)
+            size += len(line)
+        pages.append("".join(page))
+
+        cls.rendered = (cls.version, "".join(lines), tuple(pages))
+        return cls.rendered
+
+    @classmethod
+    def get_help(cls) -> str:
         """Return help string of all commands combined.
         e.g.:
         /foo -> bar
         /baz -> bat"""
-        if commands is None:
-            commands = []
+        return cls._render()[1]
 
-        help_message = ""
-        for cmd in cls.help_messages.keys():
-            # help_message += "/" + cmd + " -> " + cls.help_messages[cmd] + '\n'
-            help_message += f"/{cmd} -> {cls.help_messages[cmd]}\n"
-
-        return help_message
+    @classmethod
+    def get_help_pages(cls) -> tuple[str, ...]:
+        """Return the help string split into pages of HELP_PAGE_LINES commands, which also fit
+        in a message. There is always at least one page."""
+        return cls._render()[2]
@@ -0,0 +1,595 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Module loader used by main.py.
+Available methods:
+
+    load_modules(app)
+        Discover, import and set up every module, returns the book-keeping of each one.
+
+    discover_modules()
+        Return the module files found in MODULE_DIR/modules.
+
+    import_modules(paths, workers)
+        Import the given module files, optionally in a thread pool.
+
+    setup_modules(app, loaded)
+        Run setup_module() of every imported module, in the given order.
+
+    load_command(app, command)
+        Import the lazy module providing a command, if there is one.
+
+    core_changed()
+        Return whether files other than modules changed since startup, which needs a restart.
+
+    reload_modules(app)
+        Re-import the modules whose file changed, without restarting the bot.
+
+    commands_synced()
+        Return whether the current help strings were already sent to Telegram.
+
+    mark_commands_synced()
+        Remember the current help strings as sent to Telegram.
+
+    write_cache()
+        Save what the modules registered, so the next startup can skip importing them. Only read
+        back with LAZY_MODULES, apart from synced_commands.
+
+    log_timing_report(loaded)
+        Log import and setup time of every module.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from pathlib import Path
+from types import ModuleType
+
+from telegram import Update
+from telegram.ext import (
+    Application,
+    BaseHandler,
+    CallbackContext,
+    CallbackQueryHandler,
+    CommandHandler,
+)
+
+from tgbot_python_v2 import MODULE_DIR
+from tgbot_python_v2.util import routing
+from tgbot_python_v2.util.config import Config, load_configs
+from tgbot_python_v2.util.help import Help
+from tgbot_python_v2.util.module import ModuleMetadata
+from tgbot_python_v2.util.routing import iter_handlers
+from tgbot_python_v2.util.scheduler import adopt_handlers
+from tgbot_python_v2.util.tracing import trace_handlers
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# Number of threads used to import modules. 0 or 1 means the modules are imported one by one.
+IMPORT_WORKERS: int = int(os.getenv("TGBOT_IMPORT_WORKERS", "0"))
+# Import modules listed in the manifest on their first update instead of on startup.
+LAZY_MODULES: bool = os.getenv("TGBOT_LAZY_MODULES", "0") == "1"
+MANIFEST_FILE: Path = Path(f"{MODULE_DIR}/modules/manifest.json")
+MODULE_PACKAGE: str = "tgbot_python_v2.modules"
+"""structure of manifest.json:
+{
+    module_name: {
+        "commands": {command: help_string or null},
+        "callbacks": [callback_data regex]
+    }
+}
+
+Only modules whose handlers are all covered by commands and callbacks may be listed,
+anything registering e.g. a MessageHandler has to be imported on startup.
+"""
+CACHE_FILE: Path = Path(".module_cache.json")
+CACHE_VERSION: int = 1
+"""structure of .module_cache.json:
+{
+    version: int,
+    modules: {
+        module_name: {
+            sha256: str,
+            commands: [command],
+            help: {command: help_string},
+            callbacks: [callback_data regex],
+            lazy: bool
+        }
+    },
+    synced_commands: str | None
+}
+
+modules.*.sha256: str
+    hash of the module file the entry was recorded from, the entry
+    is ignored once the file changes
+
+modules.*.lazy: bool
+    whether every handler of the module is a command or a callback query
+    with a regex pattern, i.e. whether stub handlers can stand in for it
+
+synced_commands: str | None
+    Help.digest() of the command list last sent to Telegram
+"""
+
+
+class LoadedModule:
+    """Book-keeping of a single file in MODULE_DIR/modules."""
+
+    def __init__(self, path: Path):
+        self.path: Path = path
+        self.name: str = f"{MODULE_PACKAGE}.{path.name.removesuffix('.py')}"
+        self.sha256: str = hashlib.sha256(path.read_bytes()).hexdigest()
+        self.module: ModuleType | None = None
+        self.handlers: list[tuple[int, BaseHandler]] = []
+        self.import_time: float = 0.0
+        self.setup_time: float = 0.0
+        self.error: Exception | None = None
+        self.lazy: LazyModule | None = None
+
+    @property
+    def short_name(self) -> str:
+        return self.name.removeprefix(f"{MODULE_PACKAGE}.")
+
+
+class LazyModule:
+    """Stand-in for a module listed in the manifest. Registers stub handlers for the module's
+    commands and callbacks, and swaps in the real handlers on the first matching update."""
+
+    def __init__(self, loaded: LoadedModule, commands: list[str], help_strings: dict[str, str], callbacks: list[str]):
+        self.loaded: LoadedModule = loaded
+        self.commands: list[str] = commands
+        self.help_strings: dict[str, str] = help_strings
+        self.callbacks: list[str] = callbacks
+        self.stubs: list[BaseHandler] = []
+        self.ready: bool = False
+        self.lock: asyncio.Lock = asyncio.Lock()
+        loaded.lazy = self
+
+    def register(self, app: Application) -> None:
+        for command, help_string in self.help_strings.items():
+            Help.register_help(command, help_string, owner=self.loaded.name)
+
+        if self.commands:
+            self.stubs.append(CommandHandler(self.commands, self.handle, block=False))
+        for pattern in self.callbacks:
+            self.stubs.append(CallbackQueryHandler(self.handle, pattern=pattern, block=False))
+
+        adopt_handlers(self.stubs)
+        for stub in self.stubs:
+            app.add_handler(stub)
+
+    async def load(self, app: Application) -> bool:
+        """Import and set up the real module. Returns whether the module is usable."""
+        async with self.lock:
+            if self.ready:
+                return True
+
+            log.info(f"Lazily loading module '{self.loaded.path}'")
+            # Module level code may read config files, keep that off the event loop.
+            await asyncio.to_thread(_import, self.loaded)
+            if self.loaded.error is not None:
+                log.error(f"failed to import module '{self.loaded.path.name}', error was: {self.loaded.error}")
+                return False
+
+            # One of the stubs may be handling the update that triggered this
+            routing.remove_handlers(app, self.stubs)
+            self.stubs.clear()
+
+            _setup(app, self.loaded)
+            self.ready = True
+            # The configs the module opened, before its handlers use them
+            await load_configs()
+
+            missing: set[str] = {
+                command
+                for _, handler in self.loaded.handlers
+                if isinstance(handler, CommandHandler)
+                for command in handler.commands
+            } - set(self.commands)
+            if missing:
+                log.warning(f"Commands {missing} of module '{self.loaded.short_name}' are missing from manifest.json")
+
+            log.info(f"Module '{self.loaded.short_name}' loaded in {self.loaded.import_time:.3f}s")
+            _record(self.loaded)
+            await asyncio.to_thread(write_cache)
+            return True
+
+    async def handle(self, update: Update, context: CallbackContext) -> None:
+        if not await self.load(context.application):
+            return
+
+        # The stub already consumed this update, hand it to the real handlers so it is not lost.
+        handled_groups: set[int] = set()
+        for group, handler in self.loaded.handlers:
+            if group in handled_groups:
+                continue
+
+            check = handler.check_update(update)
+            if check is None or check is False:
+                continue
+
+            handled_groups.add(group)
+            await handler.handle_update(update, context.application, check, context)
+
+
+lazy_modules: dict[str, LazyModule] = {}
+# Every module file known to the loader, by module name
+modules: dict[str, LoadedModule] = {}
+# Hash of every other source file, taken on startup
+core_hashes: dict[Path, str] = {}
+cache: dict = {"version": CACHE_VERSION, "modules": {}, "synced_commands": None}
+
+
+def discover_modules() -> tuple[Path, ...]:
+    mdls: tuple[Path, ...] = tuple(Path(f"{MODULE_DIR}/modules").glob("*.py"))
+    log.info(f"Modules found: {mdls}")
+    return mdls
+
+
+def load_manifest() -> dict:
+    try:
+        return json.loads(MANIFEST_FILE.read_text())
+    except (OSError, json.JSONDecodeError) as e:
+        log.error(f"Failed to read {MANIFEST_FILE}, all modules will be imported on startup: {e}")
+        return {}
+
+
+def read_cache() -> None:
+    try:
+        content: dict = json.loads(CACHE_FILE.read_text())
+    except FileNotFoundError:
+        return
+    except (OSError, json.JSONDecodeError) as e:
+        log.warning(f"Ignoring unreadable {CACHE_FILE}: {e}")
+        return
+
+    if content.get("version") != CACHE_VERSION:
+        log.info(f"Ignoring {CACHE_FILE} written by another loader version")
+        return
+    cache.update(content)
+
+
+def write_cache() -> None:
+    tmp_file: Path = CACHE_FILE.with_name(f"{CACHE_FILE.name}.{os.getpid()}.tmp")
+    try:
+        tmp_file.write_text(json.dumps(cache, indent=2))
+        tmp_file.replace(CACHE_FILE)
+    except OSError as e:
+        log.warning(f"Failed to write {CACHE_FILE}: {e}")
+
+
+def _record(mdl: LoadedModule) -> None:
+    """Store what the module registered in the cache, keyed by its file hash."""
+    if mdl.module is None:
+        cache["modules"].pop(mdl.short_name, None)
+        return
+
+    commands: list[str] = []
+    callbacks: list[str] = []
+    lazy: bool = len(mdl.handlers) > 0
+    for _, handler in mdl.handlers:
+        if isinstance(handler, CommandHandler):
+            commands.extend(command for command in handler.commands if command not in commands)
+        elif isinstance(handler, CallbackQueryHandler) and isinstance(handler.pattern, re.Pattern):
+            callbacks.append(handler.pattern.pattern)
+        else:
+            lazy = False
+
+    cache["modules"][mdl.short_name] = {
+        "sha256": mdl.sha256,
+        "commands": commands,
+        "help": {cmd: text for cmd, text in Help.help_messages.items() if Help.help_owners.get(cmd) == mdl.name},
+        "callbacks": callbacks,
+        "lazy": lazy,
+    }
+
+
+def commands_synced() -> bool:
+    return cache["synced_commands"] == Help.digest()
+
+
+def mark_commands_synced() -> None:
+    cache["synced_commands"] = Help.digest()
+
+
+def _import(loaded: LoadedModule) -> LoadedModule:
+    start: float = time.perf_counter()
+    try:
+        loaded.module = import_module(loaded.name)
+        loaded.error = None
+    except Exception as e:
+        # Reported once every import is done, see import_modules()
+        log.debug(f"Importing module '{loaded.path.name}' failed", exc_info=True)
+        loaded.error = e
+    loaded.import_time = time.perf_counter() - start
+    return loaded
+
+
+def import_modules(paths: tuple[Path, ...], workers: int = IMPORT_WORKERS) -> list[LoadedModule]:
+    """Import every module file. The returned list keeps the order of paths, no matter
+    in which order the imports finished."""
+    loaded: list[LoadedModule] = [LoadedModule(path) for path in paths]
+
+    if workers <= 1:
+        for mdl in loaded:
+            _import(mdl)
+    else:
+        log.info(f"Importing {len(loaded)} modules using {workers} threads")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="module-import") as pool:
+            tuple(pool.map(_import, loaded))
+
+        # Two threads importing modules that import each other can make importlib bail out
+        # with a deadlock error, give those a second chance now that nothing else is importing.
+        for mdl in loaded:
+            if mdl.error is not None:
+                log.warning(f"Retrying import of module '{mdl.path.name}' serially, error was: {mdl.error}")
+                _import(mdl)
+
+    for mdl in loaded:
+        if mdl.error is not None:
+            log.error(f"failed to import module '{mdl.path.name}', it will not be loaded at all.")
+            log.error(f"error was: {mdl.error}")
+
+    return loaded
+
+
+def _setup(app: Application, mdl: LoadedModule) -> None:
+    log.info(f"Loading module '{mdl.path}'")
+    if not getattr(mdl.module, "ModuleMetadata", None):
+        log.error(f"Failure loading module '{mdl.path}', ModuleMetadata not detected.")
+        return
+
+    if not issubclass(mdl.module.ModuleMetadata, ModuleMetadata):
+        log.error(
+            f"ModuleMetadata of module '{mdl.path}' is not a subclass of tgbot_python_v2.util.module.ModuleMetadata"
+        )
+        log.error(f"Refusing to load module '{mdl.path}'")
+        return
+
+    log.debug(f"Running setup_module() for module '{mdl.path}'")
+    known: set[int] = {id(handler) for _, handler in iter_handlers(app)}
+    start: float = time.perf_counter()
+    try:
+        mdl.module.ModuleMetadata.setup_module(app)
+        log.debug("setup_module() finished.")
+    except Exception:
+        log.warning(
+            f"Error while running setup_module() for module '{mdl.path}', module may not work properly.",
+            exc_info=True,
+        )
+    mdl.setup_time = time.perf_counter() - start
+    mdl.handlers = [(group, handler) for group, handler in iter_handlers(app) if id(handler) not in known]
+    adopt_handlers(handler for _, handler in mdl.handlers)
+    trace_handlers(mdl.short_name, (handler for _, handler in mdl.handlers))
+
+
+def setup_modules(app: Application, loaded: list[LoadedModule]) -> None:
+    for mdl in loaded:
+        if mdl.module is not None:
+            _setup(app, mdl)
+
+
+def _plan(paths: tuple[Path, ...], manifest: dict) -> tuple[list[LazyModule], list[Path]]:
+    """Split the module files into modules loaded on first use and modules imported on startup."""
+    lazy: list[LazyModule] = []
+    eager: list[Path] = []
+    for path in paths:
+        mdl: LoadedModule = LoadedModule(path)
+        cached: dict | None = cache["modules"].get(mdl.short_name)
+        entry: dict | None = manifest.get(mdl.short_name)
+
+        # An up to date cache entry knows better than the manifest what the module registers
+        if LAZY_MODULES and cached is not None and cached["sha256"] == mdl.sha256:
+            if cached["lazy"]:
+                lazy.append(LazyModule(mdl, cached["commands"], cached["help"], cached["callbacks"]))
+            else:
+                eager.append(path)
+        elif entry is not None:
+            commands: dict[str, str | None] = entry.get("commands", {})
+            help_strings: dict[str, str] = {cmd: text for cmd, text in commands.items() if text is not None}
+            lazy.append(LazyModule(mdl, list(commands), help_strings, entry.get("callbacks", [])))
+        else:
+            eager.append(path)
+    return lazy, eager
+
+
+def load_modules(app: Application) -> list[LoadedModule]:
+    paths: tuple[Path, ...] = discover_modules()
+    manifest: dict = load_manifest() if LAZY_MODULES else {}
+    read_cache()
+
+    lazy, eager = _plan(paths, manifest)
+    loaded: list[LoadedModule] = import_modules(tuple(eager))
+    setup_modules(app, loaded)
+    for mdl in loaded:
+        _record(mdl)
+
+    # Forget modules that no longer exist
+    for name in set(cache["modules"]) - {path.name.removesuffix(".py") for path in paths}:
+        del cache["modules"][name]
+
+    for mdl in lazy:
+        log.info(f"Module '{mdl.loaded.path}' will be loaded on first use")
+        mdl.register(app)
+        lazy_modules[mdl.loaded.name] = mdl
+        loaded.append(mdl.loaded)
+
+    # Put help strings back in module order, threads and lazy modules register them out of order.
+    # This keeps /help and the command list the same across restarts.
+    if lazy or IMPORT_WORKERS > 1:
+        Help.sort_help([f"{MODULE_PACKAGE}.{path.name.removesuffix('.py')}" for path in paths])
+
+    modules.update({mdl.name: mdl for mdl in loaded})
+    core_hashes.update({path: _hash(path) for path in _core_files()})
+    return sorted(loaded, key=lambda mdl: paths.index(mdl.path))
+
+
+async def load_command(app: Application, command: str) -> None:
+    for mdl in lazy_modules.values():
+        if command in mdl.commands:
+            await mdl.load(app)
+
+
+def _hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _core_files() -> list[Path]:
+    return [path for path in Path(MODULE_DIR).rglob("*.py") if path.parent != Path(f"{MODULE_DIR}/modules")]
+
+
+def core_changed() -> bool:
+    """Modules can be reloaded on their own, anything else (main.py, util/) needs a restart."""
+    current: dict[Path, str] = {path: _hash(path) for path in _core_files()}
+    return current != core_hashes
+
+
+def _dependents(names: set[str], paths: tuple[Path, ...]) -> set[str]:
+    """Return the modules importing any of the given modules, directly or not. Those hold
+    references to objects of the old module, so they have to be reloaded as well."""
+    imports: dict[str, set[str]] = {
+        f"{MODULE_PACKAGE}.{path.name.removesuffix('.py')}": set(
+            re.findall(rf"{re.escape(MODULE_PACKAGE)}\.(\w+)", path.read_text())
+        )
+        for path in paths
+    }
+
+    dependents: set[str] = set()
+    while True:
+        found: set[str] = {
+            name
+            for name, imported in imports.items()
+            if name not in names | dependents
+            and {f"{MODULE_PACKAGE}.{short_name}" for short_name in imported} & (names | dependents)
+        }
+        if not found:
+            return dependents
+        dependents |= found
+
+
+def _unload(mdl: LoadedModule) -> None:
+    """Remove what the module registered, except for its handlers, see _swap_handlers()."""
+    log.info(f"Unloading module '{mdl.short_name}'")
+    Help.remove_help_of(mdl.name)
+
+    # Save and release its config files, the new module opens them again
+    for value in vars(mdl.module).values() if mdl.module is not None else ():
+        if isinstance(value, Config) and value.owner == mdl.name and not value.closed:
+            value.close()
+
+    sys.modules.pop(mdl.name, None)
+    modules.pop(mdl.name, None)
+
+
+def _swap_handlers(app: Application, old: LoadedModule, new: LoadedModule | None) -> None:
+    """Handlers are tried in order, so the new handlers take the place of the old ones
+    instead of being added at the end of their group. Updates being processed keep iterating
+    over the old groups, see routing.remove_handlers()."""
+    old_handlers: list[tuple[int, BaseHandler]] = list(old.handlers)
+    if (lazy := lazy_modules.pop(old.name, None)) is not None:
+        old_handlers.extend((0, stub) for stub in lazy.stubs)
+    replaced: set[BaseHandler] = {routing.placed(handler) for _, handler in old_handlers}
+    new_handlers: set[BaseHandler] = {routing.placed(handler) for _, handler in (new.handlers if new else [])}
+
+    groups: dict[int, list[BaseHandler]] = {}
+    for group, handlers in app.handlers.items():
+        if not replaced.intersection(handlers):
+            groups[group] = handlers
+            continue
+
+        added: list[BaseHandler] = [handler for handler in handlers if handler in new_handlers]
+        groups[group] = []
+        for handler in handlers:
+            if handler in replaced:
+                groups[group].extend(added)
+                added = []
+            elif handler not in new_handlers:
+                groups[group].append(handler)
+
+    app.handlers = {group: handlers for group, handlers in groups.items() if handlers}
+    for _, handler in old_handlers:
+        routing.scoped.pop(handler, None)
+
+
+def reload_modules(app: Application) -> list[LoadedModule]:
+    """Unload modules whose file changed or was removed, along with the modules importing them,
+    and load them again from the new files. New module files are loaded as well.
+    The other modules, and their state, are left alone. Returns the modules that were loaded."""
+    paths: tuple[Path, ...] = discover_modules()
+    hashes: dict[str, str] = {f"{MODULE_PACKAGE}.{path.name.removesuffix('.py')}": _hash(path) for path in paths}
+    changed: set[str] = {name for name, mdl in modules.items() if hashes.get(name) != mdl.sha256}
+    changed |= set(hashes) - set(modules)
+    changed |= _dependents(changed, paths)
+    if not changed:
+        log.info("No module changed, nothing to reload")
+        return []
+
+    log.info(f"Reloading modules: {sorted(changed)}")
+    old: dict[str, LoadedModule] = {name: modules[name] for name in changed if name in modules}
+    for mdl in old.values():
+        _unload(mdl)
+    for name in set(cache["modules"]) - {name.removeprefix(f"{MODULE_PACKAGE}.") for name in hashes}:
+        del cache["modules"][name]
+
+    loaded: list[LoadedModule] = []
+    for path in paths:
+        mdl: LoadedModule = LoadedModule(path)
+        if mdl.name not in changed:
+            continue
+
+        _import(mdl)
+        if mdl.error is not None:
+            log.error(f"failed to import module '{mdl.path.name}', error was: {mdl.error}")
+        else:
+            _setup(app, mdl)
+        _record(mdl)
+        modules[mdl.name] = mdl
+        loaded.append(mdl)
+
+    # Removed modules and modules that failed to import are swapped for nothing
+    for name, mdl in old.items():
+        _swap_handlers(app, mdl, modules.get(name))
+
+    Help.sort_help(list(hashes))
+    if LAZY_MODULES:
+        write_cache()
+    return loaded
+
+
+def log_timing_report(loaded: list[LoadedModule]) -> None:
+    """Log a table of import and setup time per module, slowest first."""
+    width: int = max((len(mdl.short_name) for mdl in loaded), default=6)
+    lines: list[str] = [f"{'module':<{width}}  {'import':>8}  {'setup':>8}  {'total':>8}"]
+    for mdl in sorted(loaded, key=lambda m: m.import_time + m.setup_time, reverse=True):
+        status: str = ""
+        if mdl.error is not None:
+            status = "  (failed)"
+        elif mdl.lazy is not None and not mdl.lazy.ready:
+            status = "  (lazy)"
+        lines.append(
+            f"{mdl.short_name:<{width}}  {mdl.import_time:>7.3f}s  {mdl.setup_time:>7.3f}s  "
+            f"{mdl.import_time + mdl.setup_time:>7.3f}s{status}"
+        )
+
+    log.info("Module startup timing:\n" + "\n".join(lines))
@@ -14,17 +14,32 @@
 #
 # Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
 
+import atexit
+import contextvars
+import datetime
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
+from typing import ClassVar
 
 GLOBAL_DEBUG: bool = False
 if os.getenv("TGBOT_DEBUG") is not None:
     GLOBAL_DEBUG = True
 
-log_additional_args: dict = {"filename": "bot.log", "level": logging.INFO}
-if GLOBAL_DEBUG:
-    log_additional_args.clear()
-    log_additional_args.update({"level": logging.DEBUG})
+LOG_FILE: str = os.getenv("TGBOT_LOG_FILE", "bot.log")
+# The log file is rotated once it is larger than this, and at midnight
+LOG_MAX_BYTES: int = int(os.getenv("TGBOT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_DAILY: bool = os.getenv("TGBOT_LOG_DAILY", "1") != "0"
+# Rotated logs to keep, compressed as bot.log.1.gz (the newest), bot.log.2.gz, ...
+LOG_BACKUPS: int = int(os.getenv("TGBOT_LOG_BACKUPS", "5"))
+# Worker processes write to the same file, only the process started first rotates it
+LOG_ROTATE: bool = os.getenv("TGBOT_WORKER_INDEX") is None
+LOG_FORMAT: str = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+# Set by util/tracing.py while an update is handled, prefixed to the messages logged meanwhile
+trace_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_id", default=None)
 
 
 #
@@ -38,33 +53,126 @@ class ColouredFormatter(logging.Formatter):
     blue = "\x1b[0;34m"
     bold_red = "\x1b[31;1m"
     reset = "\x1b[0m"
-    format_str = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+    format_str = LOG_FORMAT
 
-    FORMATS = {
+    FORMATS: ClassVar[dict[int, str]] = {
         logging.DEBUG: blue + format_str + reset,
         logging.INFO: green + format_str + reset,
         logging.WARNING: yellow + format_str + reset,
         logging.ERROR: red + format_str + reset,
         logging.CRITICAL: bold_red + format_str + reset,
     }
+    FORMATTERS: ClassVar[dict[int, logging.Formatter]] = {
+        level: logging.Formatter(fmt) for level, fmt in FORMATS.items()
+    }
+    PLAIN = logging.Formatter()
 
     def format(self, record: logging.LogRecord):
-        if record.name.startswith("httpx") and record.levelno <= logging.INFO:
-            return ""
+        return self.FORMATTERS.get(record.levelno, self.PLAIN).format(record)
+
+
+class NoiseFilter(logging.Filter):
+    """Keeps the line httpx logs for every request off the console, bot.log still has it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not (record.levelno <= logging.INFO and record.name.startswith("httpx"))
+
+
+def _next_midnight(timestamp: float) -> float:
+    day: datetime.date = datetime.date.fromtimestamp(timestamp) + datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+
+def _compress(source: str, dest: str) -> None:
+    # Move the log out of the way first, so that other processes notice the new file right away
+    tmp_file: str = f"{source}.rotating"
+    os.replace(source, tmp_file)
+    with open(tmp_file, "rb") as log_in, gzip.open(dest, "wb") as log_out:
+        shutil.copyfileobj(log_in, log_out)
+    os.remove(tmp_file)
+
 
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Writes the log file, rotating it when it gets larger than LOG_MAX_BYTES and at midnight, and
+    compressing rotated files. Reopens the file when another process rotated it. Runs in the
+    thread of the QueueListener, so none of this happens on the event loop."""
 
+    def __init__(self, filename: str):
+        super().__init__(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = _compress
+        # A log last written to yesterday is rotated with the first record of today
+        self.rollover_at: float = _next_midnight(os.stat(self.baseFilename).st_mtime)
+        self.inode: int = os.fstat(self.stream.fileno()).st_ino
 
-logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", **log_additional_args)
+    def _reopen_if_moved(self) -> None:
+        try:
+            inode: int | None = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self.inode:
+            self.stream.close()
+            self.stream = self._open()
+            self.inode = os.fstat(self.stream.fileno()).st_ino
 
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if not LOG_ROTATE:
+            return False
+        size: int = self.stream.tell()
+        if LOG_DAILY and record.created >= self.rollover_at:
+            self.rollover_at = _next_midnight(record.created)
+            return size > 0
+        return 0 < self.maxBytes <= size
 
-for handler in logging.root.handlers:
-    if issubclass(logging.StreamHandler, type(handler)):
-        logging.root.removeHandler(handler)
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.inode = os.fstat(self.stream.fileno()).st_ino
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is not None:
+            self._reopen_if_moved()
+        super().emit(record)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler.prepare() formats and copies each record so that it can be pickled. Records
+    stay in this process here, only the message arguments are merged, in case they change before
+    the listener formats the record. Tracebacks are formatted by the listener. The trace ID is
+    added here, the listener runs outside of the update's context."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        trace: str | None = trace_id.get()
+        if trace is not None:
+            record.msg = f"[{trace}] {record.getMessage()}"
+            record.args = None
+        elif record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+# Handlers run in the listener's thread, logging only puts records into the queue
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
 
 _sh = logging.StreamHandler()
 _sh.setFormatter(ColouredFormatter())
-logging.root.addHandler(_sh)
+_sh.addFilter(NoiseFilter())
+log_handlers: list[logging.Handler] = [_sh]
+if not GLOBAL_DEBUG:
+    _fh = RotatingLogHandler(LOG_FILE)
+    _fh.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_handlers.append(_fh)
+
+_qh = LocalQueueHandler(log_queue)
+for handler in logging.root.handlers[:]:
+    logging.root.removeHandler(handler)
+logging.root.addHandler(_qh)
+logging.root.setLevel(logging.DEBUG if GLOBAL_DEBUG else logging.INFO)
+
+log_listener: logging.handlers.QueueListener = logging.handlers.QueueListener(
+    log_queue, *log_handlers, respect_handler_level=True
+)
+log_listener.start()
+# Registered before anything that logs at exit, so it runs after them and writes their records
+atexit.register(log_listener.stop)
 logging.getLogger(__name__).info("Coloured log output initialized")
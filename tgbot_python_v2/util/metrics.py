@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Bot API and event loop metrics in the OpenMetrics text format, to see the bot getting close to
+Telegram's limits before it gets throttled, and handlers blocking the event loop. Calls are
+counted by util/tracing.TracedRequest, the event loop is watched by util/watchdog.py.
+Available methods:
+
+    record_api_call(method, seconds, error)
+        Count a finished Bot API call.
+
+    record_loop_lag(seconds)
+        Count how late the event loop ran a callback.
+
+    record_loop_stall(culprit, seconds)
+        Count a time the event loop was blocked, by the handler found blocking it.
+
+    render()
+        Return every metric in the OpenMetrics text format.
+
+    start_export()
+        Serve the metrics on METRICS_LISTEN:METRICS_PORT and/or write them to METRICS_FILE.
+
+    stop_export()
+        Stop serving the metrics and write METRICS_FILE one last time.
+"""
+
+import asyncio
+import bisect
+import datetime
+import logging
+import os
+from collections import Counter
+
+from telegram.error import RetryAfter, TimedOut
+
+from tgbot_python_v2.util.workers import WORKER_INDEX
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# Serve the metrics on http://METRICS_LISTEN:METRICS_PORT/metrics, 0 to turn it off. Worker
+# processes use the port after it plus their index.
+METRICS_PORT: int = int(os.getenv("TGBOT_METRICS_PORT", "0")) + (WORKER_INDEX or 0)
+METRICS_LISTEN: str = os.getenv("TGBOT_METRICS_LISTEN", "127.0.0.1")
+# Write the metrics to this file every METRICS_INTERVAL seconds, e.g. for a textfile collector.
+# Worker processes write to METRICS_FILE.<index>.
+METRICS_FILE: str | None = os.getenv("TGBOT_METRICS_FILE")
+if METRICS_FILE and WORKER_INDEX is not None:
+    METRICS_FILE = f"{METRICS_FILE}.{WORKER_INDEX}"
+METRICS_INTERVAL: float = float(os.getenv("TGBOT_METRICS_INTERVAL", "15"))
+METRICS_PATH: str = "/metrics"
+CONTENT_TYPE: str = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+REQUEST_TIMEOUT: float = 5.0
+# Upper bounds of the request duration buckets, in seconds
+DURATION_BUCKETS: tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ApiMethodStats:
+    def __init__(self):
+        self.requests: int = 0
+        # Per bucket of DURATION_BUCKETS and one for longer requests, not cumulative
+        self.buckets: list[int] = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration: float = 0.0
+        self.errors: Counter[str] = Counter()
+        self.flood_waits: int = 0
+        self.flood_wait_seconds: float = 0.0
+
+
+api_stats: dict[str, ApiMethodStats] = {}
+# Requests sent and not answered yet, ApplicationBuilder's default pool has 256 connections
+in_flight: int = 0
+# Per bucket of LAG_BUCKETS and one for longer lags, not cumulative
+loop_lag_buckets: list[int] = [0] * (len(LAG_BUCKETS) + 1)
+loop_lag_sum: float = 0.0
+# Keyed by the handler, "module.callback", or the function found blocking the loop
+loop_stalls: Counter[str] = Counter()
+loop_blocked_seconds: dict[str, float] = {}
+
+
+def _error_name(error: BaseException) -> str:
+    # Requests waiting for a free connection time out with a TimedOut as well
+    if isinstance(error, TimedOut) and str(error).startswith("Pool timeout"):
+        return "PoolTimeout"
+    return type(error).__name__
+
+
+def record_api_call(method: str, seconds: float, error: BaseException | None) -> None:
+    stats: ApiMethodStats | None = api_stats.get(method)
+    if stats is None:
+        stats = api_stats[method] = ApiMethodStats()
+
+    stats.requests += 1
+    stats.buckets[bisect.bisect_left(DURATION_BUCKETS, seconds)] += 1
+    stats.duration += seconds
+    if error is None:
+        return
+
+    stats.errors[_error_name(error)] += 1
+    if isinstance(error, RetryAfter):
+        stats.flood_waits += 1
+        # An int, or a timedelta with newer versions of python-telegram-bot
+        delay: int | datetime.timedelta = error.retry_after
+        stats.flood_wait_seconds += delay.total_seconds() if isinstance(delay, datetime.timedelta) else delay
+
+
+def record_loop_lag(seconds: float) -> None:
+    global loop_lag_sum
+
+    loop_lag_buckets[bisect.bisect_left(LAG_BUCKETS, seconds)] += 1
+    loop_lag_sum += seconds
+
+
+def record_loop_stall(culprit: str, seconds: float) -> None:
+    loop_stalls[culprit] += 1
+    loop_blocked_seconds[culprit] = loop_blocked_seconds.get(culprit, 0.0) + seconds
+
+
+def _family(name: str, metric_type: str, help_text: str, unit: str | None = None) -> list[str]:
+    lines: list[str] = [f"# TYPE {name} {metric_type}"]
+    if unit is not None:
+        lines.append(f"# UNIT {name} {unit}")
+    lines.append(f"# HELP {name} {help_text}")
+    return lines
+
+
+def _buckets(name: str, labels: str, bounds: tuple[float, ...], counts: list[int], total: float) -> list[str]:
+    lines: list[str] = []
+    cumulative: int = 0
+    for bound, count in zip((*bounds, "+Inf"), counts, strict=True):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    # Labels end with a comma, the histogram's own samples have no le
+    own_labels: str = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{name}_count{own_labels} {cumulative}")
+    lines.append(f"{name}_sum{own_labels} {total}")
+    return lines
+
+
+def render() -> str:
+    """Method, error and handler names are identifiers, so label values need no escaping."""
+    methods: list[tuple[str, ApiMethodStats]] = sorted(api_stats.items())
+    lines: list[str] = _family("tgbot_api_requests", "counter", "Bot API requests, by method.")
+    lines += [f'tgbot_api_requests_total{{method="{method}"}} {stats.requests}' for method, stats in methods]
+
+    name: str = "tgbot_api_request_duration_seconds"
+    lines += _family(name, "histogram", "Time until Telegram answered a request.", "seconds")
+    for method, stats in methods:
+        lines += _buckets(name, f'method="{method}",', DURATION_BUCKETS, stats.buckets, stats.duration)
+
+    lines += _family("tgbot_api_errors", "counter", "Failed Bot API requests, by method and exception.")
+    lines += [
+        f'tgbot_api_errors_total{{method="{method}",error="{error}"}} {count}'
+        for method, stats in methods
+        for error, count in sorted(stats.errors.items())
+    ]
+
+    lines += _family("tgbot_api_flood_waits", "counter", "Requests refused by flood control (RetryAfter).")
+    lines += [f'tgbot_api_flood_waits_total{{method="{method}"}} {stats.flood_waits}' for method, stats in methods]
+    name = "tgbot_api_flood_wait_seconds"
+    lines += _family(name, "counter", "Time flood control asked to wait before retrying.", "seconds")
+    lines += [f'{name}_total{{method="{method}"}} {stats.flood_wait_seconds}' for method, stats in methods]
+
+    lines += _family("tgbot_api_requests_in_flight", "gauge", "Bot API requests waiting for an answer.")
+    lines.append(f"tgbot_api_requests_in_flight {in_flight}")
+
+    name = "tgbot_loop_lag_seconds"
+    lines += _family(name, "histogram", "How late the event loop ran a periodic callback.", "seconds")
+    lines += _buckets(name, "", LAG_BUCKETS, loop_lag_buckets, loop_lag_sum)
+    lines += _family("tgbot_loop_stalls", "counter", "Times the event loop was blocked, by the handler blocking it.")
+    lines += [
+        f'tgbot_loop_stalls_total{{handler="{culprit}"}} {count}' for culprit, count in sorted(loop_stalls.items())
+    ]
+    name = "tgbot_loop_blocked_seconds"
+    lines += _family(name, "counter", "Time the event loop was blocked, by the handler blocking it.", "seconds")
+    lines += [
+        f'{name}_total{{handler="{culprit}"}} {seconds}' for culprit, seconds in sorted(loop_blocked_seconds.items())
+    ]
+    lines += ["# EOF", ""]
+    return "\n".join(lines)
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answers a single request per connection, which is all a scraper needs."""
+    try:
+        request_line: bytes = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        while (await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts: list[str] = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?", 1)[0] == METRICS_PATH:
+            status: str = "200 OK"
+            content_type: str = CONTENT_TYPE
+            body: bytes = render().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+        head: str = (
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + (body if parts[:1] != ["HEAD"] else b""))
+        await writer.drain()
+    except (TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _write_file(text: str) -> None:
+    tmp_file: str = f"{METRICS_FILE}.tmp"
+    with open(tmp_file, "w") as metrics_file:
+        metrics_file.write(text)
+    # Readers never see a half written file
+    os.replace(tmp_file, METRICS_FILE)
+
+
+async def _write_periodically() -> None:
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        try:
+            await asyncio.to_thread(_write_file, render())
+        except OSError as e:
+            log.error(f"Cannot write metrics to {METRICS_FILE}: {e}")
+
+
+server: asyncio.Server | None = None
+writer_task: asyncio.Task | None = None
+
+
+async def start_export() -> None:
+    global server, writer_task
+
+    if METRICS_PORT:
+        try:
+            server = await asyncio.start_server(_serve, METRICS_LISTEN, METRICS_PORT)
+            log.info(f"Serving metrics on http://{METRICS_LISTEN}:{METRICS_PORT}{METRICS_PATH}")
+        except OSError as e:
+            log.error(f"Cannot serve metrics on {METRICS_LISTEN}:{METRICS_PORT}: {e}")
+    if METRICS_FILE:
+        writer_task = asyncio.create_task(_write_periodically(), name="write_metrics")
+        log.info(f"Writing metrics to {METRICS_FILE} every {METRICS_INTERVAL:.0f}s")
+
+
+async def stop_export() -> None:
+    global server, writer_task
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        server = None
+    if writer_task is not None:
+        writer_task.cancel()
+        writer_task = None
+        try:
+            await asyncio.to_thread(_write_file, render())
+        except OSError as e:
+            log.error(f"Cannot write metrics to {METRICS_FILE}: {e}")
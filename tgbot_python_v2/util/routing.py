@@ -0,0 +1,132 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Handlers that only apply to some chats. Each of them is wrapped in a ChatScoped handler, which
+turns away updates from other chats with a set lookup before the handler's own, costlier checks
+(filters, regexes) run. The wrapper takes the handler's place in its group, so handlers are
+tried in the order they were added, chat-scoped or not.
+Available methods:
+
+    add_handler(app, handler, chats, group)
+        Add a handler that is only tried for updates from the given chats.
+
+    add_chat(handler, chat_id)
+        Let a chat-scoped handler handle updates from one more chat.
+
+    remove_chat(handler, chat_id)
+        Stop a chat-scoped handler from handling updates of a chat.
+
+    remove_handler(app, handler)
+        Remove a chat-scoped handler.
+
+    remove_handlers(app, handlers)
+        Remove handlers from the application, chat-scoped ones by their wrapper, while updates
+        may be processed.
+
+    placed(handler)
+        Return what stands in app.handlers for a handler, its ChatScoped wrapper or the handler.
+
+    iter_handlers(app)
+        Return every handler of the application, including chat-scoped ones, with their group.
+"""
+
+import logging
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler, CallbackContext
+
+from tgbot_python_v2.util.scheduler import adopt_handlers
+
+log: logging.Logger = logging.getLogger(__name__)
+
+
+class ChatScoped(BaseHandler[Update, CallbackContext, Any]):
+    """Stands in for a chat-scoped handler, handing it the updates of its chats."""
+
+    def __init__(self, handler: BaseHandler, chats: Iterable[int]):
+        super().__init__(self._no_callback, block=handler.block)
+        self.handler: BaseHandler = handler
+        self.chats: set[int] = set(chats)
+
+    @staticmethod
+    async def _no_callback(update: Update, context: CallbackContext) -> None:
+        raise RuntimeError("ChatScoped hands updates to the handler it stands in for")
+
+    def check_update(self, update: object) -> object | None:
+        if not isinstance(update, Update) or update.effective_chat is None:
+            return None
+        if update.effective_chat.id not in self.chats:
+            return None
+        return self.handler.check_update(update)
+
+    async def handle_update(
+        self,
+        update: Update,
+        application: Application,
+        check_result: object,
+        context: CallbackContext,
+    ) -> Any:
+        return await self.handler.handle_update(update, application, check_result, context)
+
+
+# Wrapper of each chat-scoped handler
+scoped: dict[BaseHandler, ChatScoped] = {}
+
+
+def add_handler(app: Application, handler: BaseHandler, chats: Iterable[int], group: int = 0) -> None:
+    """The handler is tried where it was added, like with app.add_handler()."""
+    wrapper: ChatScoped = ChatScoped(handler, chats)
+    adopt_handlers([wrapper])
+    app.add_handler(wrapper, group)
+    scoped[handler] = wrapper
+
+
+def add_chat(handler: BaseHandler, chat_id: int) -> None:
+    log.info(f"Enabling {handler.callback.__qualname__} in chat {chat_id}")
+    scoped[handler].chats.add(chat_id)
+
+
+def remove_chat(handler: BaseHandler, chat_id: int) -> None:
+    log.info(f"Disabling {handler.callback.__qualname__} in chat {chat_id}")
+    scoped[handler].chats.discard(chat_id)
+
+
+def remove_handler(app: Application, handler: BaseHandler) -> None:
+    remove_handlers(app, [scoped.pop(handler)])
+
+
+def remove_handlers(app: Application, handlers: Iterable[BaseHandler]) -> None:
+    """process_update() iterates over app.handlers and its lists across awaits, unlike
+    app.remove_handler() this leaves them alone and puts new ones in their place."""
+    removed: set[BaseHandler] = set(handlers)
+    app.handlers = {
+        group: kept
+        for group, group_handlers in app.handlers.items()
+        if (kept := [handler for handler in group_handlers if handler not in removed])
+    }
+
+
+def placed(handler: BaseHandler) -> BaseHandler:
+    return scoped.get(handler, handler)
+
+
+def iter_handlers(app: Application) -> Iterator[tuple[int, BaseHandler]]:
+    for group, handlers in app.handlers.items():
+        for handler in handlers:
+            yield group, handler.handler if isinstance(handler, ChatScoped) else handler
@@ -0,0 +1,187 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Update scheduler, processing updates of each chat in order while sharing a fixed
+number of slots fairly between chats.
+Available methods:
+
+    ChatScheduler(concurrency, max_pending, max_chat_pending)
+        Update processor to be passed to ApplicationBuilder.concurrent_updates().
+
+    adopt_handlers(handlers)
+        Make handlers that did not choose block themselves run inside the scheduler's slots.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from collections.abc import Awaitable, Hashable, Iterable
+from typing import Any
+
+from telegram import Update
+from telegram._utils.defaultvalue import DefaultValue
+from telegram.ext import BaseHandler, BaseUpdateProcessor
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# Updates processed at the same time, 0 (the default) disables the scheduler
+SCHEDULER_CONCURRENCY: int = int(os.getenv("TGBOT_SCHEDULER_CONCURRENCY", "0"))
+# Updates waiting for a slot before the bot stops taking new updates from Telegram
+SCHEDULER_MAX_PENDING: int = int(os.getenv("TGBOT_SCHEDULER_MAX_PENDING", "1000"))
+# Updates waiting in a single chat before new ones from that chat are dropped, 0 for no limit
+SCHEDULER_MAX_CHAT_PENDING: int = int(os.getenv("TGBOT_SCHEDULER_MAX_CHAT_PENDING", "200"))
+
+
+class ChatScheduler(BaseUpdateProcessor):
+    """Every chat gets a FIFO lane, at most one update per lane is processed at a time and lanes
+    take turns on the free slots. A chat flooding the bot therefore only ever holds one slot.
+
+    The application hands updates over one by one (max_concurrent_updates is 1 from its point of
+    view), and is kept waiting while max_pending updates are queued, so a raid slows down intake
+    instead of piling up tasks."""
+
+    def __init__(
+        self,
+        concurrency: int = SCHEDULER_CONCURRENCY,
+        max_pending: int = SCHEDULER_MAX_PENDING,
+        max_chat_pending: int = SCHEDULER_MAX_CHAT_PENDING,
+    ):
+        super().__init__(1)
+        self.concurrency: int = concurrency
+        self.max_pending: int = max_pending
+        self.max_chat_pending: int = max_chat_pending
+        self.lanes: dict[Hashable, deque[Awaitable[Any]]] = {}
+        self.ready: deque[Hashable] = deque()
+        self.busy: set[Hashable] = set()
+        self.tasks: set[asyncio.Task] = set()
+        self.pending: int = 0
+        self.processed: int = 0
+        self.dropped: int = 0
+        self.changed: asyncio.Condition | None = None
+
+    @staticmethod
+    def lane_of(update: object) -> Hashable:
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return f"user:{update.effective_user.id}"
+
+        return None
+
+    async def initialize(self) -> None:
+        self.changed = asyncio.Condition()
+        log.info(
+            f"Scheduling updates with {self.concurrency} slots, "
+            f"{self.max_pending} pending updates at most, {self.max_chat_pending or 'unlimited'} per chat"
+        )
+
+    async def shutdown(self) -> None:
+        # The bot is already shut down at this point, drain() belongs in post_stop
+        for queue in self.lanes.values():
+            for coroutine in queue:
+                coroutine.close()
+        for task in self.tasks:
+            task.cancel()
+        if self.pending or self.tasks:
+            log.warning(f"Discarded {self.pending + len(self.tasks)} unprocessed updates")
+        self.lanes.clear()
+        self.ready.clear()
+        self.pending = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        lane: Hashable = self.lane_of(update)
+        queue: deque[Awaitable[Any]] | None = self.lanes.get(lane)
+        if self.max_chat_pending and queue is not None and len(queue) >= self.max_chat_pending:
+            self.dropped += 1
+            log.warning(f"Dropping update from {lane}, {len(queue)} updates are already waiting there")
+            coroutine.close()
+            return
+
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.pending < self.max_pending)
+
+        # The lane may have been emptied while waiting
+        queue = self.lanes.get(lane)
+        if queue is None:
+            queue = self.lanes[lane] = deque()
+            if lane not in self.busy:
+                self.ready.append(lane)
+        queue.append(coroutine)
+        self.pending += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.ready and len(self.busy) < self.concurrency:
+            lane: Hashable = self.ready.popleft()
+            coroutine: Awaitable[Any] = self.lanes[lane].popleft()
+            if not self.lanes[lane]:
+                del self.lanes[lane]
+            self.pending -= 1
+            self.busy.add(lane)
+
+            task: asyncio.Task = asyncio.create_task(self._run(lane, coroutine))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, lane: Hashable, coroutine: Awaitable[Any]) -> None:
+        try:
+            # Application.process_update() reports errors of handlers itself
+            await coroutine
+        finally:
+            self.processed += 1
+            self.busy.discard(lane)
+            # Back of the line, so every chat with waiting updates gets a turn first
+            if lane in self.lanes:
+                self.ready.append(lane)
+            self._dispatch()
+            async with self.changed:
+                self.changed.notify_all()
+
+    async def drain(self) -> None:
+        """Wait until every queued update was processed."""
+        if self.changed is None:
+            return
+
+        if self.pending or self.tasks:
+            log.info(f"Waiting for {self.pending + len(self.tasks)} updates to be processed")
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.pending and not self.busy)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.busy),
+            "pending": self.pending,
+            "chats_waiting": len(self.lanes),
+            "deepest_chat": max((len(queue) for queue in self.lanes.values()), default=0),
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+
+def adopt_handlers(handlers: Iterable[BaseHandler]) -> None:
+    """block=False, also through Defaults(block=False), makes the application run a handler as a
+    separate task, which escapes the scheduler's limits and ordering. Handlers already run
+    concurrently to other chats' updates, so ones that left block at its default are made to
+    block. An explicit block=False is kept, such handlers run outside the scheduler."""
+    if not SCHEDULER_CONCURRENCY:
+        return
+
+    for handler in handlers:
+        if isinstance(handler.block, DefaultValue):
+            handler.block = True
@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+How the bot receives updates, selected with TGBOT_SERVE_MODE.
+Available methods:
+
+    run(app)
+        Run the application until stopped, either polling or serving a webhook.
+
+    run_application(app, start_intake, stop_intake)
+        Run the application with a custom source of updates.
+
+    stop_intake(app, last_update_id)
+        Stop receiving updates, ahead of a restart.
+
+    restart()
+        Start the bot again with the same arguments.
+
+    relaunch(app, last_update_id)
+        Replace this process with a new instance of the bot, handing over to it if possible.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import signal
+import sys
+from collections.abc import Awaitable, Callable
+
+import telegram.error
+from telegram.ext import Application
+
+from tgbot_python_v2.util import handover, workers
+from tgbot_python_v2.util.webhook import WebhookServer
+
+log: logging.Logger = logging.getLogger(__name__)
+
+SERVE_MODE: str = os.getenv("TGBOT_SERVE_MODE", "polling")
+if SERVE_MODE not in ("polling", "webhook"):
+    log.error(f"Unknown TGBOT_SERVE_MODE '{SERVE_MODE}', falling back to polling")
+    SERVE_MODE = "polling"
+
+webhook_server: WebhookServer | None = None
+
+
+def _raise_system_exit() -> None:
+    raise SystemExit
+
+
+def run_application(
+    app: Application,
+    start_intake: Callable[[], Awaitable[None]],
+    stop_intake: Callable[[], Awaitable[None]],
+) -> None:
+    """Same lifecycle as Application.run_polling(), including post_init, post_stop and
+    post_shutdown, but updates come from start_intake() instead of the application's updater.
+    stop_intake() is also called when the intake was stopped already, e.g. by a handover."""
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        loop.add_signal_handler(sig, _raise_system_exit)
+
+    intake_started: bool = False
+    try:
+        loop.run_until_complete(app.initialize())
+        if app.post_init:
+            loop.run_until_complete(app.post_init(app))
+        loop.run_until_complete(start_intake())
+        intake_started = True
+        loop.run_until_complete(app.start())
+        # Application.stop_running() stops the loop, just like it does for run_polling()
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        log.debug("Application received stop signal. Shutting down.")
+    finally:
+        try:
+            if intake_started:
+                loop.run_until_complete(stop_intake())
+            if app.running:
+                loop.run_until_complete(app.stop())
+            if app.post_stop:
+                loop.run_until_complete(app.post_stop(app))
+            loop.run_until_complete(app.shutdown())
+            if app.post_shutdown:
+                loop.run_until_complete(app.post_shutdown(app))
+        finally:
+            loop.close()
+
+
+def _after_predecessor(app: Application, start_intake: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+    """A successor only starts receiving updates once the bot it replaces stopped receiving them."""
+    if not handover.IS_SUCCESSOR:
+        return start_intake
+
+    async def start() -> None:
+        handed_over: tuple[int, list[int]] | None = await handover.wait_for_predecessor()
+        if handed_over is not None and webhook_server is not None:
+            # Telegram may still deliver updates the predecessor already received
+            webhook_server.last_update_id, received = handed_over
+            webhook_server.remember(received)
+        elif handed_over is not None and handed_over[0] > 0:
+            try:
+                await app.bot.get_updates(offset=handed_over[0] + 1)
+            except telegram.error.TimedOut:
+                pass
+        await start_intake()
+
+    return start
+
+
+async def _stop_polling(app: Application) -> None:
+    # Handing over to a successor stops the updater already, see _release_intake()
+    if app.updater.running:
+        await app.updater.stop()
+
+
+def run(app: Application) -> None:
+    global webhook_server
+
+    if workers.IS_WORKER:
+        # Updates come from the intake process
+        intake: workers.PipeIntake = workers.PipeIntake(app)
+        run_application(app, intake.start, intake.stop)
+    elif SERVE_MODE == "webhook":
+        webhook_server = WebhookServer(app)
+        run_application(app, _after_predecessor(app, webhook_server.start), webhook_server.stop)
+    elif handover.IS_SUCCESSOR:
+        run_application(app, _after_predecessor(app, app.updater.start_polling), lambda: _stop_polling(app))
+    else:
+        app.run_polling()
+
+
+async def stop_intake(app: Application, last_update_id: int) -> None:
+    """Stop receiving updates, so that a restarting bot does not handle the same update twice.
+    Telegram is told that everything up to last_update_id was handled."""
+    if workers.IS_WORKER:
+        # The intake process marks updates as handled when it stops
+        return
+    if webhook_server is not None:
+        # Updates are acknowledged as soon as they are received, nothing else to do
+        await webhook_server.stop()
+        return
+
+    await app.updater._stop_polling()
+    try:
+        await app.bot.get_updates(offset=last_update_id + 1)
+    except telegram.error.TimedOut:
+        pass
+
+
+def restart() -> None:
+    """Replace the running process with a new instance of the bot. Workers ask the intake process
+    to restart every process instead, this returns immediately in that case."""
+    if workers.IS_WORKER:
+        workers.request_restart()
+        return
+
+    atexit._run_exitfuncs()
+    os.execve(sys.executable, [sys.executable, *sys.argv], os.environ)
+
+
+async def _release_intake(app: Application) -> int:
+    """Stop receiving updates, returns the id of the last update received."""
+    if webhook_server is not None:
+        await webhook_server.stop()
+        return webhook_server.last_update_id
+
+    # Confirms the fetched updates with Telegram
+    await app.updater.stop()
+    # The updater keeps the offset to fetch from, one past the last update
+    return app.updater._last_update_id - 1
+
+
+async def relaunch(app: Application, last_update_id: int) -> bool:
+    """Start a new instance of the bot in place of this one. With handover, this one keeps
+    receiving updates until the new one is ready and then stops, without handover the process
+    is replaced right away (see stop_intake() and restart()).
+
+    Returns False when the new instance failed to start, this one keeps running then."""
+    if workers.IS_WORKER or not handover.HANDOVER_ENABLED:
+        await stop_intake(app, last_update_id)
+        restart()
+        return True
+
+    # Telegram keeps sending the current secret until the successor registered its own
+    env: dict[str, str] = {"TGBOT_WEBHOOK_SECRET": webhook_server.secret} if webhook_server is not None else {}
+    successor: handover.Successor | None = await handover.start_successor(env)
+    if successor is None:
+        return False
+
+    last_received: int = await _release_intake(app)
+    await successor.release(last_received, webhook_server.seen if webhook_server is not None else ())
+    # post_stop handles the updates received so far, then this process exits
+    app.stop_running()
+    return True
@@ -0,0 +1,278 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Tracing of update handling. Every update gets a trace ID, which is added to the log lines written
+while handling it, and the time taken by every handler is recorded per handler and per module,
+split into time spent waiting for the Bot API and time spent in the bot's own code.
+Available methods:
+
+    TracedApplication
+        Application class to be passed to ApplicationBuilder.application_class().
+
+    TracedRequest
+        Request to be passed to ApplicationBuilder.request(), times and counts the Bot API calls.
+
+    trace_handlers(module, handlers)
+        Record the time taken by the callbacks of the given handlers.
+
+    worst(count)
+        Return the handlers with the highest p95 latency of the last STATS_WINDOW seconds.
+
+    describe(name, stats)
+        Return a line summing up the latency of a handler, module or of whole updates.
+
+    report_stats()
+        Log the slowest handlers every STATS_INTERVAL seconds, until cancelled.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import math
+import os
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Coroutine, Iterable
+from contextvars import ContextVar
+from typing import Any
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler, CallbackContext
+from telegram.request import HTTPXRequest
+
+from tgbot_python_v2.util import metrics
+from tgbot_python_v2.util.logging import trace_id
+
+log: logging.Logger = logging.getLogger(__name__)
+
+TRACE_ENABLED: bool = os.getenv("TGBOT_TRACE", "1") != "0"
+# Latency quantiles cover this many seconds
+STATS_WINDOW: float = float(os.getenv("TGBOT_STATS_WINDOW", "3600"))
+# Seconds between log lines reporting the slowest handlers, 0 to turn them off
+STATS_INTERVAL: float = float(os.getenv("TGBOT_STATS_INTERVAL", "900"))
+STATS_TOP: int = 5
+# The window moves on in steps of STATS_WINDOW / SLICES
+SLICES: int = 12
+# Latencies are counted in buckets growing by this factor from BUCKET_MIN seconds on
+BUCKET_MIN: float = 0.001
+BUCKET_GROWTH: float = 1.2
+
+Callback = Callable[[Any, CallbackContext], Coroutine[Any, Any, Any]]
+
+
+class _Slice:
+    def __init__(self, index: int):
+        self.index: int = index
+        self.counts: Counter[int] = Counter()
+        self.time: float = 0.0
+
+
+class Histogram:
+    """Counts of latencies per bucket over the last STATS_WINDOW seconds. Quantiles are the upper
+    bound of their bucket, so they are up to BUCKET_GROWTH times too high."""
+
+    def __init__(self):
+        self.slices: deque[_Slice] = deque()
+
+    @staticmethod
+    def _slice_index(now: float) -> int:
+        return int(now * SLICES / STATS_WINDOW)
+
+    def record(self, seconds: float, now: float) -> None:
+        index: int = self._slice_index(now)
+        if not self.slices or self.slices[-1].index != index:
+            self.slices.append(_Slice(index))
+            while self.slices[0].index <= index - SLICES:
+                self.slices.popleft()
+
+        bucket: int = 0 if seconds < BUCKET_MIN else int(math.log(seconds / BUCKET_MIN, BUCKET_GROWTH)) + 1
+        self.slices[-1].counts[bucket] += 1
+        self.slices[-1].time += seconds
+
+    def _window(self, now: float) -> list[_Slice]:
+        oldest: int = self._slice_index(now) - SLICES
+        return [window_slice for window_slice in self.slices if window_slice.index > oldest]
+
+    def count(self, now: float) -> int:
+        return sum(window_slice.counts.total() for window_slice in self._window(now))
+
+    def time(self, now: float) -> float:
+        return sum(window_slice.time for window_slice in self._window(now))
+
+    def quantiles(self, now: float, *quantiles: float) -> list[float]:
+        counts: Counter[int] = Counter()
+        for window_slice in self._window(now):
+            counts.update(window_slice.counts)
+
+        total: int = counts.total()
+        result: list[float] = []
+        for quantile in quantiles:
+            seen: int = 0
+            for bucket in sorted(counts):
+                seen += counts[bucket]
+                if seen >= quantile * total:
+                    result.append(BUCKET_MIN * BUCKET_GROWTH**bucket)
+                    break
+            else:
+                result.append(0.0)
+        return result
+
+
+class HandlerStats:
+    def __init__(self):
+        # Whole time of each call, and the part of it not spent waiting for the Bot API
+        self.total: Histogram = Histogram()
+        self.own: Histogram = Histogram()
+        self.calls: int = 0
+
+    def record(self, seconds: float, api_seconds: float, now: float) -> None:
+        self.total.record(seconds, now)
+        # API calls made concurrently may add up to more than the wall time
+        self.own.record(max(seconds - api_seconds, 0.0), now)
+        self.calls += 1
+
+
+class Span:
+    """Time spent waiting for the Bot API while handling an update, or while running a handler."""
+
+    def __init__(self, parent: "Span | None"):
+        self.parent: Span | None = parent
+        self.api: float = 0.0
+        self.api_calls: int = 0
+
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+update_stats: HandlerStats = HandlerStats()
+# Keyed by "module.callback"
+handler_stats: dict[str, HandlerStats] = {}
+module_stats: dict[str, HandlerStats] = {}
+# Handler each task is running, read by the loop watchdog (see util/watchdog.py) from its thread
+running: dict[asyncio.Task, str] = {}
+# Trace IDs of objects other than updates, e.g. updates put in the queue by hand
+_trace_ids: itertools.count = itertools.count(1)
+
+
+class TracedApplication(Application):
+    """With the scheduler turned off, handlers with block=False run as separate tasks and are not
+    part of the time recorded for the update, they are still recorded on their own."""
+
+    async def process_update(self, update: object) -> None:
+        trace: str = str(update.update_id) if isinstance(update, Update) else f"x{next(_trace_ids)}"
+        trace_token = trace_id.set(trace)
+        span_token = current_span.set(Span(None))
+        start: float = time.perf_counter()
+        try:
+            await super().process_update(update)
+        finally:
+            span: Span = current_span.get()
+            update_stats.record(time.perf_counter() - start, span.api, time.monotonic())
+            current_span.reset(span_token)
+            trace_id.reset(trace_token)
+
+
+class TracedRequest(HTTPXRequest):
+    """Adds the time taken by each Bot API call to the spans it was made in, and counts the call
+    in util/metrics.py. Also used with tracing turned off, for the metrics."""
+
+    async def post(self, url: str, *args: Any, **kwargs: Any) -> Any:
+        error: BaseException | None = None
+        metrics.in_flight += 1
+        start: float = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed: float = time.perf_counter() - start
+            metrics.in_flight -= 1
+            metrics.record_api_call(url.rsplit("/", 1)[-1], elapsed, error)
+            span: Span | None = current_span.get()
+            while span is not None:
+                span.api += elapsed
+                span.api_calls += 1
+                span = span.parent
+
+
+def _traced(module: str, callback: Callback) -> Callback:
+    name: str = f"{module}.{callback.__qualname__}"
+    stats: HandlerStats = handler_stats.setdefault(name, HandlerStats())
+    module_total: HandlerStats = module_stats.setdefault(module, HandlerStats())
+
+    @functools.wraps(callback)
+    async def traced(update: Any, context: CallbackContext) -> Any:
+        span: Span = Span(current_span.get())
+        token = current_span.set(span)
+        task: asyncio.Task = asyncio.current_task()
+        outer: str | None = running.get(task)
+        running[task] = name
+        start: float = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            elapsed: float = time.perf_counter() - start
+            current_span.reset(token)
+            if outer is None:
+                del running[task]
+            else:
+                running[task] = outer
+            now: float = time.monotonic()
+            stats.record(elapsed, span.api, now)
+            module_total.record(elapsed, span.api, now)
+
+    traced.traced_as = name
+    return traced
+
+
+def trace_handlers(module: str, handlers: Iterable[BaseHandler]) -> None:
+    if not TRACE_ENABLED:
+        return
+
+    for handler in handlers:
+        if not hasattr(handler.callback, "traced_as"):
+            handler.callback = _traced(module, handler.callback)
+
+
+def worst(count: int = STATS_TOP) -> list[tuple[str, HandlerStats]]:
+    now: float = time.monotonic()
+    active: list[tuple[str, HandlerStats]] = [item for item in handler_stats.items() if item[1].total.count(now)]
+    return sorted(active, key=lambda item: item[1].total.quantiles(now, 0.95)[0], reverse=True)[:count]
+
+
+def _duration(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+
+def describe(name: str, stats: HandlerStats) -> str:
+    now: float = time.monotonic()
+    count: int = stats.total.count(now)
+    if not count:
+        return f"{name}: no calls"
+
+    total: float = stats.total.time(now)
+    api_share: float = 1 - stats.own.time(now) / total if total else 0.0
+    p50, p95, p99 = (_duration(seconds) for seconds in stats.total.quantiles(now, 0.5, 0.95, 0.99))
+    return f"{name}: {count} calls, p50 {p50}, p95 {p95}, p99 {p99}, {api_share:.0%} waiting for the Bot API"
+
+
+async def report_stats() -> None:
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        if slowest := worst():
+            lines: str = "; ".join(describe(name, stats) for name, stats in slowest)
+            log.info(f"Slowest handlers of the last {STATS_WINDOW / 60:.0f} minutes: {lines}")
@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Dicts and lists that report where they were changed, used by Config to know whether and
+what to write.
+Available methods:
+
+    track(value, changed, path)
+        Wrap value, and every dict and list in it, so that changes call changed(path).
+
+A path is the tuple of keys leading from the root to the changed value, e.g. changing
+config["a"]["b"] reports ("a", "b"). Items of a list share the path of the list, since indexes
+shift on every insert or removal. Clearing or replacing the root reports ().
+
+Plain dicts and lists cannot be made to report changes, so they are copied when stored: after
+config["a"] = value, changes to value are neither seen in nor tracked by config["a"].
+"""
+
+import copy
+from collections.abc import Callable, Hashable, Iterable
+from typing import Any, Self, SupportsIndex
+
+Path = tuple[Hashable, ...]
+
+
+def track(value: Any, changed: Callable[[Path], None], path: Path = ()) -> Any:
+    """Returns a tracked copy of plain dicts and lists, value itself is left untracked. Values that
+    are tracked already at the same place are kept as they are, tracked values from somewhere else
+    are copied, so that each change has a single path."""
+    if isinstance(value, (TrackedDict, TrackedList)) and value.changed == changed and value.path == path:
+        return value
+    if isinstance(value, dict):
+        return TrackedDict(value, changed, path)
+    if isinstance(value, list):
+        return TrackedList(value, changed, path)
+    return value
+
+
+class TrackedDict(dict):
+    def __init__(self, data: dict, changed: Callable[[Path], None], path: Path):
+        super().__init__()
+        self.changed: Callable[[Path], None] = changed
+        self.path: Path = path
+        for key, value in data.items():
+            dict.__setitem__(self, key, track(value, changed, (*path, key)))
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        dict.__setitem__(self, key, track(value, self.changed, (*self.path, key)))
+        self.changed((*self.path, key))
+
+    def __delitem__(self, key: Hashable) -> None:
+        dict.__delitem__(self, key)
+        self.changed((*self.path, key))
+
+    def __ior__(self, other: Any) -> Self:
+        self.update(other)
+        return self
+
+    def pop(self, key: Hashable, *default: Any) -> Any:
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value: Any = dict.pop(self, key)
+        self.changed((*self.path, key))
+        return value
+
+    def popitem(self) -> tuple[Hashable, Any]:
+        key, value = dict.popitem(self)
+        self.changed((*self.path, key))
+        return key, value
+
+    def setdefault(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        # The stored value is the tracked one
+        return dict.__getitem__(self, key)
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> None:
+        dict.clear(self)
+        self.changed(self.path)
+
+    def __copy__(self) -> dict:
+        return dict(self)
+
+    def __deepcopy__(self, memo: dict) -> dict:
+        """Copies are detached from the config."""
+        return {copy.deepcopy(key, memo): copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self) -> tuple:
+        return dict, (dict(self),)
+
+
+class TrackedList(list):
+    def __init__(self, data: Iterable, changed: Callable[[Path], None], path: Path):
+        super().__init__(track(value, changed, path) for value in data)
+        self.changed: Callable[[Path], None] = changed
+        self.path: Path = path
+
+    def _track(self, value: Any) -> Any:
+        return track(value, self.changed, self.path)
+
+    def __setitem__(self, index: SupportsIndex | slice, value: Any) -> None:
+        if isinstance(index, slice):
+            list.__setitem__(self, index, [self._track(item) for item in value])
+        else:
+            list.__setitem__(self, index, self._track(value))
+        self.changed(self.path)
+
+    def __delitem__(self, index: SupportsIndex | slice) -> None:
+        list.__delitem__(self, index)
+        self.changed(self.path)
+
+    def __iadd__(self, other: Iterable) -> Self:
+        self.extend(other)
+        return self
+
+    def __imul__(self, count: SupportsIndex) -> Self:
+        list.__imul__(self, count)
+        self.changed(self.path)
+        return self
+
+    def append(self, value: Any) -> None:
+        list.append(self, self._track(value))
+        self.changed(self.path)
+
+    def extend(self, values: Iterable) -> None:
+        list.extend(self, [self._track(value) for value in values])
+        self.changed(self.path)
+
+    def insert(self, index: SupportsIndex, value: Any) -> None:
+        list.insert(self, index, self._track(value))
+        self.changed(self.path)
+
+    def pop(self, index: SupportsIndex = -1) -> Any:
+        value: Any = list.pop(self, index)
+        self.changed(self.path)
+        return value
+
+    def remove(self, value: Any) -> None:
+        list.remove(self, value)
+        self.changed(self.path)
+
+    def clear(self) -> None:
+        list.clear(self)
+        self.changed(self.path)
+
+    def sort(self, *args: Any, **kwargs: Any) -> None:
+        list.sort(self, *args, **kwargs)
+        self.changed(self.path)
+
+    def reverse(self) -> None:
+        list.reverse(self)
+        self.changed(self.path)
+
+    def __copy__(self) -> list:
+        return list(self)
+
+    def __deepcopy__(self, memo: dict) -> list:
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self) -> tuple:
+        return list, (list(self),)
@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Watchdog finding handlers that block the event loop, e.g. with synchronous HTTP requests or
+subprocesses. The loop notes the time in regular intervals, and a thread checks that it does. Once
+the loop is late by LOOP_LAG_THRESHOLD, the thread takes the stack of the loop's thread, which is
+still running the blocking code, and logs it along with the handler it belongs to: the traced
+handler the blocked task is running (see util/tracing.py), or else the one found on the stack.
+Available methods:
+
+    start_watchdog()
+        Start watching the running event loop.
+
+    stop_watchdog()
+        Stop watching.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+
+from tgbot_python_v2.util import tracing
+from tgbot_python_v2.util.metrics import record_loop_lag, record_loop_stall
+
+log: logging.Logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG: bool = os.getenv("TGBOT_LOOP_WATCHDOG", "1") != "0"
+# The event loop counts as blocked once it is late by this many seconds
+LOOP_LAG_THRESHOLD: float = float(os.getenv("TGBOT_LOOP_LAG_THRESHOLD", "0.25"))
+# Innermost frames of the loop's stack that are logged
+STACK_LIMIT: int = 25
+MODULE_PACKAGE: str = "tgbot_python_v2.modules."
+PACKAGE: str = "tgbot_python_v2."
+
+
+def _culprit(frame: FrameType) -> str:
+    """The outermost frame in a module is the handler, "module.callback" like in util/tracing.py,
+    decorators in the module left aside: they wrap the handler in a function defined in another
+    one. Without one, the innermost frame of the bot's own code, or else the innermost frame."""
+    frames: list[FrameType] = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+
+    in_modules: list[FrameType] = [
+        outer for outer in reversed(frames) if outer.f_globals.get("__name__", "").startswith(MODULE_PACKAGE)
+    ]
+    if in_modules:
+        handler: FrameType = next(
+            (outer for outer in in_modules if "<locals>" not in outer.f_code.co_qualname), in_modules[0]
+        )
+        return f"{handler.f_globals['__name__'].removeprefix(MODULE_PACKAGE)}.{handler.f_code.co_qualname}"
+    for inner in frames:
+        module: str = inner.f_globals.get("__name__", "")
+        if module.startswith(PACKAGE):
+            return f"{module.removeprefix(PACKAGE)}.{inner.f_code.co_qualname}"
+    return f"{frames[0].f_globals.get('__name__', '?')}.{frames[0].f_code.co_qualname}"
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD):
+        self.threshold: float = threshold
+        # The loop notes the time this often, the thread checks twice as often whether it is late.
+        # A block shorter than threshold + interval may end up under the threshold, depending on
+        # when the loop noted the time last.
+        self.interval: float = threshold / 4
+        self.loop_thread: int = threading.get_ident()
+        self.loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.beat: float = time.monotonic()
+        # Set by the thread while the loop is blocked, taken by the loop once it runs again
+        self.culprit: str | None = None
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self._watch, name="loop_watchdog", daemon=True)
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._beat(), name="loop_watchdog_beat")
+        self.thread.start()
+        log.info(f"Watching for the event loop being blocked for more than {self.threshold:.2f}s")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+        self.thread.join()
+
+    async def _beat(self) -> None:
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag: float = max(time.monotonic() - self.beat - self.interval, 0.0)
+            record_loop_lag(lag)
+            if lag >= self.threshold:
+                # Stalls just over the threshold may be over before the thread looked
+                culprit: str = self.culprit or "unknown"
+                self.culprit = None
+                record_loop_stall(culprit, lag)
+                log.warning(f"Event loop was blocked for {lag:.2f}s by {culprit}")
+
+    def _watch(self) -> None:
+        captured: float | None = None
+        while not self.stopped.wait(self.interval / 2):
+            beat: float = self.beat
+            late: float = time.monotonic() - beat - self.interval
+            if late < self.threshold or captured == beat:
+                continue
+
+            captured = beat
+            frame: FrameType | None = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            culprit: str = tracing.running.get(asyncio.current_task(self.loop)) or _culprit(frame)
+            stack: str = "".join(traceback.format_list(traceback.extract_stack(frame, STACK_LIMIT)))
+            del frame
+            # The loop may have run on while the stack was taken, it would belong to the next stall then
+            if self.beat != beat:
+                continue
+            self.culprit = culprit
+            log.warning(f"Event loop blocked for {late:.2f}s so far by {culprit}, stack:\n{stack}")
+
+
+watchdog: LoopWatchdog | None = None
+
+
+def start_watchdog() -> None:
+    global watchdog
+
+    if LOOP_WATCHDOG and watchdog is None:
+        watchdog = LoopWatchdog()
+        watchdog.start()
+
+
+def stop_watchdog() -> None:
+    global watchdog
+
+    if watchdog is not None:
+        watchdog.stop()
+        watchdog = None
@@ -0,0 +1,251 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Minimal HTTP server receiving updates from Telegram's webhook.
+
+    POST <path>
+        Telegram update as JSON. Requests without the right
+        X-Telegram-Bot-Api-Secret-Token header are refused.
+
+    GET /healthz
+        200 while the application is running, 503 otherwise.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+from collections.abc import Iterable
+
+from telegram import Update
+from telegram.ext import Application
+
+log: logging.Logger = logging.getLogger(__name__)
+
+WEBHOOK_LISTEN: str = os.getenv("TGBOT_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("TGBOT_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH: str = os.getenv("TGBOT_WEBHOOK_PATH", "/webhook")
+# Public URL Telegram should send updates to. When unset the webhook is not registered with
+# Telegram, which is handy for testing locally by posting recorded updates.
+WEBHOOK_URL: str | None = os.getenv("TGBOT_WEBHOOK_URL")
+WEBHOOK_SECRET: str = os.getenv("TGBOT_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("TGBOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+HEALTH_PATH: str = "/healthz"
+MAX_BODY_SIZE: int = 1024 * 1024
+# Longest request or header line, and most header lines, of a request
+MAX_LINE_SIZE: int = 8 * 1024
+MAX_HEADERS: int = 100
+IDLE_TIMEOUT: float = 75.0
+# Ids of this many updates received last are kept, Telegram sends an update again when the
+# answer to it got lost
+SEEN_UPDATES: int = 1000
+
+REASONS: dict[int, str] = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    414: "URI Too Long",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+}
+
+
+class WebhookServer:
+    """Receives updates over HTTP and puts them on the application's update queue."""
+
+    def __init__(
+        self,
+        app: Application,
+        listen: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+    ):
+        self.app: Application = app
+        self.listen: str = listen
+        self.port: int = port
+        self.path: str = path
+        self.secret: str = secret
+        self.max_connections: int = max_connections
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.received: int = 0
+        # Highest update id received
+        self.last_update_id: int = 0
+        # Ids of the updates received last, in the order they came in. Updates arrive out of order
+        # over parallel connections, so the highest id alone does not tell which ones were received.
+        self.seen: dict[int, None] = {}
+        self.rejected: int = 0
+        self.server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(
+            self._serve_connection, self.listen, self.port, reuse_port=True, limit=MAX_LINE_SIZE
+        )
+        log.info(f"Listening for webhook updates on {self.listen}:{self.port}{self.path}")
+
+        if WEBHOOK_URL:
+            await self.app.bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=self.secret,
+                max_connections=self.max_connections,
+            )
+            log.info(f"Webhook registered with Telegram: {WEBHOOK_URL}")
+        else:
+            log.warning("TGBOT_WEBHOOK_URL is not set, not registering the webhook with Telegram")
+
+    async def stop(self) -> None:
+        if self.server is None:
+            return
+
+        log.info("Stopping webhook server")
+        self.server.close()
+        # Idle keep-alive connections would otherwise hold up wait_closed()
+        for writer in self.writers:
+            writer.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if len(self.writers) >= self.max_connections:
+            await self._respond(writer, 503, {"error": "too many connections"}, keep_alive=False)
+            writer.close()
+            return
+
+        self.writers.add(writer)
+        try:
+            # Telegram keeps connections open, serve requests until either side closes it
+            while await self._serve_request(reader, writer):
+                pass
+        except (TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _serve_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Serve one request, returns whether the connection can be reused. Requests that are
+        refused before their body was read close the connection, what follows is not a request."""
+        try:
+            request_line: bytes = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        except ValueError:
+            # Longer than the reader's limit, MAX_LINE_SIZE
+            return await self._refuse(writer, 414, "request line too long")
+        if not request_line:
+            return False
+
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return await self._refuse(writer, 400, "malformed request line")
+
+        headers: dict[str, str] = {}
+        for _ in range(MAX_HEADERS + 1):
+            try:
+                line: bytes = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            except ValueError:
+                return await self._refuse(writer, 431, "header line too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return await self._refuse(writer, 431, "too many headers")
+
+        keep_alive: bool = headers.get("connection", "").lower() != "close"
+        content_length: str = headers.get("content-length", "0") or "0"
+        # int() would also take signs, spaces and underscores
+        if not (content_length.isascii() and content_length.isdigit()):
+            return await self._refuse(writer, 400, "malformed content length")
+        length: int = int(content_length)
+        if length > MAX_BODY_SIZE:
+            return await self._refuse(writer, 413, "body too large")
+        body: bytes = await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT) if length else b""
+
+        path: str = target.split("?", 1)[0]
+        if path == HEALTH_PATH and method in ("GET", "HEAD"):
+            status: int = 200 if self.app.running else 503
+            await self._respond(writer, status, self.health(), keep_alive)
+        elif path != self.path:
+            await self._respond(writer, 404, {"error": "not found"}, keep_alive)
+        elif method != "POST":
+            await self._respond(writer, 405, {"error": "method not allowed"}, keep_alive)
+        elif not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), self.secret):
+            self.rejected += 1
+            log.warning("Refusing webhook request with a wrong secret token")
+            await self._respond(writer, 403, {"error": "wrong secret token"}, keep_alive)
+        else:
+            try:
+                update: Update = Update.de_json(json.loads(body), self.app.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                log.warning(f"Refusing malformed webhook update: {e}")
+                await self._respond(writer, 400, {"error": "malformed update"}, keep_alive)
+                return keep_alive
+
+            self.received += 1
+            if update.update_id in self.seen:
+                await self._respond(writer, 200, None, keep_alive)
+                return keep_alive
+            self.remember((update.update_id,))
+            self.last_update_id = max(self.last_update_id, update.update_id)
+            await self.app.update_queue.put(update)
+            await self._respond(writer, 200, None, keep_alive)
+
+        return keep_alive
+
+    async def _refuse(self, writer: asyncio.StreamWriter, status: int, error: str) -> bool:
+        self.rejected += 1
+        log.warning(f"Refusing webhook request: {error}")
+        await self._respond(writer, status, {"error": error}, keep_alive=False)
+        return False
+
+    def remember(self, update_ids: Iterable[int]) -> None:
+        """Acknowledge these updates without handling them when Telegram sends them again."""
+        for update_id in update_ids:
+            self.seen[update_id] = None
+        for update_id in list(self.seen)[: max(len(self.seen) - SEEN_UPDATES, 0)]:
+            del self.seen[update_id]
+
+    def health(self) -> dict:
+        health: dict = {
+            "running": self.app.running,
+            "pending_updates": self.app.update_queue.qsize(),
+            "connections": len(self.writers),
+            "received": self.received,
+            "rejected": self.rejected,
+        }
+        if stats := getattr(self.app.update_processor, "stats", None):
+            health["scheduler"] = stats()
+
+        return health
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: dict | None, keep_alive: bool) -> None:
+        body: bytes = json.dumps(payload).encode() if payload is not None else b""
+        head: str = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
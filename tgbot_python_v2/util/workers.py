@@ -0,0 +1,246 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright (c) 2024, Firdaus Hakimi <hakimifirdaus944@gmail.com>
+
+"""
+Sharding of updates over worker processes, enabled with TGBOT_WORKERS.
+
+The intake process receives updates (polling or webhook) without loading any module, and
+writes each update as a line of JSON to the stdin of a worker, chosen by chat_id. Workers
+are the same bot started with TGBOT_WORKER_INDEX set, they load every module and handle
+the updates they are given. Config files are shared through the filesystem, see util/config.py.
+
+Telegram considers an update delivered once the intake received it, so the intake keeps every
+update until the worker reports it handled, writing its id as a line to TGBOT_WORKER_ACK_FD.
+The updates a worker had not handled when it crashed are given to the worker started in its place.
+Available methods:
+
+    shard_of(update, count)
+        Return the index of the worker handling the given update.
+
+    WorkerPool(count)
+        Starts, feeds and stops the workers of the intake process.
+
+    PipeIntake(app)
+        Feeds updates written by the intake process to a worker's application.
+
+    request_restart()
+        Ask the intake process to restart the whole bot.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import signal
+import sys
+from collections.abc import Coroutine
+from typing import Any
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+log: logging.Logger = logging.getLogger(__name__)
+
+WORKERS: int = int(os.getenv("TGBOT_WORKERS", "1"))
+WORKER_INDEX: int | None = int(index) if (index := os.getenv("TGBOT_WORKER_INDEX")) is not None else None
+# The process receiving updates from Telegram and handing them to workers
+IS_INTAKE: bool = WORKERS > 1 and WORKER_INDEX is None
+IS_WORKER: bool = WORKER_INDEX is not None
+# Pipe a worker writes the ids of the updates it handled to
+ACK_FD: int | None = int(fd) if (fd := os.environ.pop("TGBOT_WORKER_ACK_FD", None)) is not None else None
+RESTART_SIGNAL: signal.Signals = signal.SIGUSR1
+# Time given to a worker to handle the updates it has left before it is killed
+STOP_TIMEOUT: float = 60.0
+RESPAWN_DELAY: float = 1.0
+# An update is a single line, keep room for huge messages
+LINE_LIMIT: int = 16 * 1024 * 1024
+
+
+def shard_of(update: object, count: int) -> int:
+    """Updates of the same chat always go to the same worker, so they are still handled in order."""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id % count
+        if update.effective_user is not None:
+            return update.effective_user.id % count
+
+    return 0
+
+
+class WorkerPool:
+    def __init__(self, count: int = WORKERS):
+        self.app: Application | None = None
+        self.count: int = count
+        self.processes: list[asyncio.subprocess.Process | None] = [None] * count
+        self.watchers: list[asyncio.Task | None] = [None] * count
+        # Updates written to each worker and not handled yet, as written, by update_id
+        self.unacked: list[dict[int, bytes]] = [{} for _ in range(count)]
+        self.stopping: bool = False
+        self.restart_requested: bool = False
+
+    async def start(self, app: Application) -> None:
+        """Meant to be the intake application's post_init."""
+        self.app = app
+        log.info(f"Starting {self.count} workers")
+        for index in range(self.count):
+            await self._spawn(index)
+
+        asyncio.get_running_loop().add_signal_handler(RESTART_SIGNAL, self.restart)
+
+    async def _spawn(self, index: int) -> None:
+        ack_read, ack_write = os.pipe()
+        try:
+            process: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                *sys.argv,
+                stdin=asyncio.subprocess.PIPE,
+                pass_fds=(ack_write,),
+                env={**os.environ, "TGBOT_WORKER_INDEX": str(index), "TGBOT_WORKER_ACK_FD": str(ack_write)},
+                # Keep Ctrl+C away from workers, they stop once the intake closes their stdin
+                start_new_session=True,
+            )
+        finally:
+            os.close(ack_write)
+        acks: asyncio.StreamReader = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(acks), os.fdopen(ack_read, "rb")
+        )
+        log.info(f"Worker {index} started with pid {process.pid}")
+
+        if self.unacked[index]:
+            log.warning(f"Giving worker {index} the {len(self.unacked[index])} updates its predecessor left unhandled")
+            process.stdin.write(b"".join(self.unacked[index].values()))
+        # Only from here on route() writes to the new worker, after the updates written above
+        self.processes[index] = process
+        self.watchers[index] = asyncio.create_task(self._watch(index, process, acks))
+        try:
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def _watch(self, index: int, process: asyncio.subprocess.Process, acks: asyncio.StreamReader) -> None:
+        # The pipe is closed once the worker exited
+        while line := await acks.readline():
+            self.unacked[index].pop(int(line), None)
+
+        returncode: int = await process.wait()
+        if self.stopping:
+            log.info(f"Worker {index} exited with code {returncode}")
+            return
+
+        log.error(f"Worker {index} exited unexpectedly with code {returncode}, starting it again")
+        await asyncio.sleep(RESPAWN_DELAY)
+        if not self.stopping:
+            await self._spawn(index)
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        index: int = shard_of(update, self.count)
+        process: asyncio.subprocess.Process | None = self.processes[index]
+        if process is None or process.stdin is None:
+            log.error(f"Worker {index} is not running, dropping update {update.update_id}")
+            return
+
+        line: bytes = json.dumps(update.to_dict()).encode() + b"\n"
+        self.unacked[index][update.update_id] = line
+        process.stdin.write(line)
+        try:
+            # Waits while the worker's pipe is full, slowing down intake instead of buffering
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            log.warning(f"Worker {index} is gone, update {update.update_id} goes to the worker replacing it")
+
+    def restart(self) -> None:
+        log.info("A worker asked for a restart")
+        self.restart_requested = True
+        self.app.stop_running()
+
+    async def stop(self, app: Application) -> None:
+        """Meant to be the intake application's post_stop.
+        Close every worker's stdin and wait for them to handle what they were given."""
+        self.stopping = True
+        for index, process in enumerate(self.processes):
+            if process is not None and process.stdin is not None and process.returncode is None:
+                log.info(f"Stopping worker {index}")
+                process.stdin.close()
+
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+            except TimeoutError:
+                log.error(f"Worker {index} did not stop in {STOP_TIMEOUT:.0f}s, killing it")
+                process.kill()
+                await process.wait()
+
+        await asyncio.gather(*(watcher for watcher in self.watchers if watcher is not None), return_exceptions=True)
+
+
+class PipeIntake:
+    """Feeds updates written by the intake process to a worker's application."""
+
+    def __init__(self, app: Application):
+        self.app: Application = app
+        self.task: asyncio.Task | None = None
+        self.acks: asyncio.WriteTransport | None = None
+
+    async def start(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        reader: asyncio.StreamReader = asyncio.StreamReader(limit=LINE_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        if ACK_FD is not None:
+            self.acks, _ = await loop.connect_write_pipe(asyncio.Protocol, os.fdopen(ACK_FD, "wb"))
+        self.task = asyncio.create_task(self._read_updates(reader), name=f"worker_{WORKER_INDEX}_intake")
+        log.info(f"Worker {WORKER_INDEX} waiting for updates")
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _read_updates(self, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            try:
+                update: Update = Update.de_json(json.loads(line), self.app.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                log.error(f"Malformed update from intake process: {e}")
+                continue
+
+            # What the application does with updates from its queue, but noting when one is done
+            handled: list[bool] = [False]
+            coroutine: Coroutine[Any, Any, None] = self._process(update, handled)
+            await self.app.update_processor.process_update(update, coroutine)
+            if not handled[0] and inspect.getcoroutinestate(coroutine) == inspect.CORO_CLOSED:
+                # Dropped by the scheduler without running
+                self._ack(update)
+
+        log.info("Intake process closed the pipe, stopping")
+        self.task = None
+        self.app.stop_running()
+
+    async def _process(self, update: Update, handled: list[bool]) -> None:
+        await self.app.process_update(update)
+        handled[0] = True
+        self._ack(update)
+
+    def _ack(self, update: Update) -> None:
+        if self.acks is not None and not self.acks.is_closing():
+            self.acks.write(f"{update.update_id}\n".encode())
+
+
+def request_restart() -> None:
+    os.kill(os.getppid(), RESTART_SIGNAL)